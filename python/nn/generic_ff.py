@@ -5,6 +5,11 @@ This scripts trains a simple feed forward neural network based on given train da
 then tests it with data from test CSV. You have to give a comma separated list of input
 columns as well as outut columns. Type of task (regression or classification) as well as 
 the architecture of network are inferred from data.
+Trained model can be used to predict outputs of new data with "predict" subcommand
+(generic_ff.py predict --help), preprocessing is stored next to the model for that purpose.
+It can also be served over HTTP with "serve" subcommand and queried with "query" subcommand.
+TensorFlow is loaded only when needed, --dry_run reports task, data shapes and architecture
+without it and "benchmark_import" subcommand guards import time of this script.
 THIS WORKS
 '''
 # ==================================================================================================
@@ -15,23 +20,76 @@ from __future__ import annotations
 
 # Basic python imports
 import argparse
+import glob
+import hashlib
+import http.client
+import importlib
+import json
 import logging
 import math
+import multiprocessing
+import os
+import queue
+import shutil
+import socket
+import socketserver
+import subprocess
 import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum, auto
-from dataclasses import dataclass
-from typing import Tuple, Optional, Sequence, List, Final, Dict, Any
+from dataclasses import dataclass, field
+from functools import cached_property
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import ModuleType
+from typing import (Tuple, Optional, Sequence, List, Final, Dict, Any, Callable, Deque, ClassVar,
+                    Iterable, Iterator, TYPE_CHECKING)
 from datetime import datetime
 
 # External libraries
 import numpy as np
-import tensorflow as tf
-import pandas as pd
-import keras as krs
-import matplotlib.pyplot as plt
-from sklearn.preprocessing import StandardScaler
-from keras.layers import Dense, BatchNormalization, Dropout
-from keras.callbacks import ReduceLROnPlateau, EarlyStopping, ModelCheckpoint
+
+
+class LazyModule:
+    '''
+    Stands in for module which is imported on first access to its attribute. Heavy frameworks are
+    then loaded only by stages which use them, so --help or data inspection start fast.
+    '''
+
+    def __init__(self, name: str) -> None:
+        self.name_ = name
+        self.module_: ModuleType | None = None
+
+    def __getattr__(self, attr: str) -> Any:
+        if self.module_ is None:
+            self.module_ = importlib.import_module(self.name_)
+        return getattr(self.module_, attr)
+
+
+if TYPE_CHECKING:
+    import tensorflow as tf
+    import pandas as pd
+    import keras as krs
+    import matplotlib.pyplot as plt
+    from matplotlib import figure as matplotlib_figure
+    from matplotlib.backends import backend_agg
+    from scipy import sparse
+    from sklearn import preprocessing
+    from sklearn.preprocessing import StandardScaler
+else:
+    tf = LazyModule('tensorflow')
+    pd = LazyModule('pandas')
+    krs = LazyModule('keras')
+    plt = LazyModule('matplotlib.pyplot')
+    matplotlib_figure = LazyModule('matplotlib.figure')
+    backend_agg = LazyModule('matplotlib.backends.backend_agg')
+    sparse = LazyModule('scipy.sparse')
+    preprocessing = LazyModule('sklearn.preprocessing')
+HEAVY_MODULES: Final[Tuple[str, ...]] = ('tensorflow', 'keras', 'pandas', 'matplotlib', 'sklearn',
+                                         'scipy')
 # ==================================================================================================
 #                                          CONSTANS
 # ==================================================================================================
@@ -39,11 +97,27 @@ MIN_LAYER_SIZE: Final[int] = 16
 MAX_LAYER_SIZE: Final[int] = 512
 FEATURES_TO_SIZE_FACTOR: Final[float] = 2.5
 MAX_LAYER_COUNT: Final[int] = 3
+CLASS_COUNT_THRESHOLD: Final[int] = 20  # Integer outputs with fewer values are class ids
 # TODO: Name following two better
 SAMPLES_TO_LAYER_BASE: Final[int] = 1000
 SAMPLES_TO_LAYER_STEP_MULTIPLIER: Final[int] = 10
 LEARNING_RATE: float = 1e-3  # Make this argument later
 MIN_LEARNING_RATE: float = 1e-6  # Make this argument later
+DEFAULT_CSV_CHUNK_SIZE: Final[int] = 100_000
+DEFAULT_SHUFFLE_BUFFER: Final[int] = 10_000
+DEFAULT_PREDICT_BATCH_SIZE: Final[int] = 8192
+DEFAULT_SERVER_HOST: Final[str] = '127.0.0.1'
+DEFAULT_SERVER_PORT: Final[int] = 8500
+DEFAULT_BATCH_WINDOW_MS: Final[float] = 5.0
+DEFAULT_MAX_BATCH_ROWS: Final[int] = 4096
+DEFAULT_MAX_IMPORT_SECONDS: Final[float] = 1.0
+DEFAULT_SPARSE_THRESHOLD: Final[int] = 100
+DEFAULT_EMBEDDING_THRESHOLD: Final[int] = 1000
+MAX_EMBEDDING_SIZE: Final[int] = 50
+DEFAULT_STEPS_PER_EXECUTION: Final[int] = 32  # Training steps run by one call of compiled function
+BATCH_SIZE_CANDIDATES: Final[Tuple[int, ...]] = (32, 64, 128, 256, 512, 1024, 2048, 4096)
+BATCH_SIZE_PROBE_STEPS: Final[int] = 20  # Steps of largest candidate timed by batch size probe
+BATCH_SIZE_THROUGHPUT_TOLERANCE: Final[float] = 0.9  # Smallest batch this close to best is used
 
 # ==================================================================================================
 #                                          LOGGING
@@ -119,6 +193,30 @@ def arg_positive_int(txt: str) -> int:
             f'Unable to convert "{txt}" to valid integer')
 
 
+def arg_non_negative_float(txt: str) -> float:
+    try:
+        val = float(txt)
+        if val < 0.0:
+            raise argparse.ArgumentTypeError(
+                'Argument value must not be negative')
+        return val
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f'Unable to convert "{txt}" to valid float')
+
+
+def arg_non_negative_int(txt: str) -> int:
+    try:
+        val = int(txt)
+        if val < 0:
+            raise argparse.ArgumentTypeError(
+                'Argument value must not be negative')
+        return val
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f'Unable to convert "{txt}" to valid integer')
+
+
 def arg_int(txt: str) -> int:
     try:
         val = int(txt)
@@ -128,6 +226,17 @@ def arg_int(txt: str) -> int:
             f'Unable to convert "{txt}" to valid integer')
 
 
+def arg_step_range(txt: str) -> Tuple[int, int]:
+    try:
+        first, last = (int(part) for part in txt.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f'Step range must be two comma separated integers, "{txt}" given instead')
+    if not 0 < first <= last:
+        raise argparse.ArgumentTypeError('Step range must satisfy 0 < FIRST <= LAST')
+    return first, last
+
+
 def arg_verbosity_level(txt: str) -> VerbosityLevel:
     try:
         return VerbosityLevel.parse_string(txt)
@@ -151,6 +260,25 @@ class Config:
     random_seed: int  # A seed used for all random generators, if set to 0 time will be used
     epochs: int  # Maximum number of epochs for which network will be trained.
     verbosity: VerbosityLevel  # Program verbosity
+    chunk_size: int  # Number of CSV rows read at once
+    streaming: bool  # Stream training data from disk with tf.data instead of loading it
+    shuffle_buffer: int  # Number of samples in shuffle buffer used in streaming mode
+    cache_dir: str | None  # Directory with cached preprocessed data, if None cache is not used
+    memmap_dir: str | None  # Directory for memory mapped input matrices, if None they stay in RAM
+    sparse_threshold: int  # Categorical inputs with more levels are stored as sparse matrix
+    embedding_threshold: int  # Categorical inputs with more levels are fed to Embedding layers
+    search_trials: int  # Number of hyperparameter settings evaluated before training, 0 disables
+    search_workers: int  # Number of worker processes used by search
+    search_threads: int  # TensorFlow threads of each search worker
+    search_min_epochs: int  # Epochs after which first part of trials is pruned
+    search_max_epochs: int  # Epochs trained by trials that are not pruned
+    cpu_performance: bool  # Compile training step, tune threads, precision and batch size for CPU
+    dry_run: bool  # Only report task, data shapes and architecture, TensorFlow is not loaded
+    non_interactive: bool  # Do not ask for confirmation and save plots to file instead of showing
+    plot_out: str | None  # Path to image with history plots, if None they are shown in windows
+    metrics_out: str | None  # Path to JSON Lines file to which metrics are appended each epoch
+    profile: bool  # Measure where time of each epoch goes, summary is saved next to history
+    profile_trace_steps: Tuple[int, int] | None  # First and last step of TensorFlow profiler trace
 
     @staticmethod
     def from_args(argv: Optional[Sequence[str]] = None) -> Config:
@@ -186,6 +314,70 @@ class Config:
                           help='Verbosity level, available value are '
                           f'{[e._name_ for e in VerbosityLevel]}'
                           ' (default: INFO)')
+        prsr.add_argument('--chunk_size', type=arg_positive_int, default=DEFAULT_CSV_CHUNK_SIZE,
+                          help='Number of CSV rows read at once, only input and output columns '
+                          f'are kept in memory (default: {DEFAULT_CSV_CHUNK_SIZE})')
+        prsr.add_argument('--streaming', action='store_true',
+                          help='Stream training data from disk instead of loading it into memory, '
+                          'train_csv and test_csv may then be glob patterns matching CSV shards')
+        prsr.add_argument('--shuffle_buffer', type=arg_positive_int, default=DEFAULT_SHUFFLE_BUFFER,
+                          help='Number of samples in shuffle buffer used in streaming mode '
+                          f'(default: {DEFAULT_SHUFFLE_BUFFER})')
+        prsr.add_argument('--cache_dir', type=str, default=None,
+                          help='Directory where preprocessed data is cached, repeated runs on '
+                          'same CSV files and columns skip parsing and preprocessing')
+        prsr.add_argument('--memmap_dir', type=str, default=None,
+                          help='Directory where preprocessed input matrices are written as memory '
+                          'mapped files instead of being kept in memory')
+        prsr.add_argument('--sparse_threshold', type=arg_positive_int,
+                          default=DEFAULT_SPARSE_THRESHOLD,
+                          help='Categorical inputs with more levels are one hot encoded into sparse '
+                          f'matrix instead of dense one (default: {DEFAULT_SPARSE_THRESHOLD})')
+        prsr.add_argument('--embedding_threshold', type=arg_positive_int,
+                          default=DEFAULT_EMBEDDING_THRESHOLD,
+                          help='Categorical inputs with more levels are encoded as category ids '
+                          f'and fed to Embedding layers (default: {DEFAULT_EMBEDDING_THRESHOLD})')
+        prsr.add_argument('--search_trials', type=arg_non_negative_int, default=0,
+                          help='Number of hyperparameter settings (architecture, learning rate, '
+                          'dropout and batch size) evaluated in parallel before training, network '
+                          'is then trained with the best one (default: 0, no search)')
+        prsr.add_argument('--search_workers', type=arg_positive_int,
+                          default=max(1, (os.cpu_count() or 1) // 2),
+                          help='Number of search worker processes (default: half of cores)')
+        prsr.add_argument('--search_threads', type=arg_positive_int, default=None,
+                          help='TensorFlow threads of each search worker (default: cores divided '
+                          'by number of workers)')
+        prsr.add_argument('--search_min_epochs', type=arg_positive_int, default=2,
+                          help='Epochs after which worse trials are pruned for the first time '
+                          '(default: 2)')
+        prsr.add_argument('--search_max_epochs', type=arg_positive_int, default=18,
+                          help='Epochs trained by best trials (default: 18)')
+        prsr.add_argument('--cpu_performance', action='store_true',
+                          help='Train with XLA compiled steps, several steps per execution, '
+                          'threads set from core count, bfloat16 where CPU supports it and batch '
+                          'size chosen by measured throughput')
+        prsr.add_argument('--dry_run', action='store_true',
+                          help='Prepare data and report inferred task, data shapes and network '
+                          'architecture without loading TensorFlow or training')
+        prsr.add_argument('--non_interactive', action='store_true',
+                          help='Train without asking for confirmation and save history plots to '
+                          'plot_out (default: model path with .history.png suffix)')
+        prsr.add_argument('--plot_out', type=str, default=None,
+                          help='Image file to which history plots are saved in one figure instead '
+                          'of being shown')
+        prsr.add_argument('--metrics_out', type=str, default=None,
+                          help='JSON Lines file to which metrics, throughput and step time are '
+                          'appended after each epoch')
+        prsr.add_argument('--profile', action='store_true',
+                          help='Record step time histograms, input wait (streaming only), '
+                          'validation, callback and checkpoint time of each epoch. Summary is '
+                          'printed and saved next to history_out (or model) with .profile.json '
+                          'suffix')
+        prsr.add_argument('--profile_trace_steps', type=arg_step_range, default=None,
+                          metavar='FIRST,LAST',
+                          help='Capture TensorFlow profiler trace of given training steps (counted '
+                          'from 1 across epochs) into directory with .trace suffix, implies '
+                          '--profile')
 
         # Parsing arguments
         args: argparse.Namespace = prsr.parse_args(argv)
@@ -201,9 +393,205 @@ class Config:
             epochs=args.epochs,
             verbosity=args.verbosity,
             model_out=args.model_out,
-            history_out=args.history_out
+            history_out=args.history_out,
+            chunk_size=args.chunk_size,
+            streaming=args.streaming,
+            shuffle_buffer=args.shuffle_buffer,
+            cache_dir=args.cache_dir,
+            memmap_dir=args.memmap_dir,
+            sparse_threshold=args.sparse_threshold,
+            embedding_threshold=args.embedding_threshold,
+            search_trials=args.search_trials,
+            search_workers=args.search_workers,
+            search_threads=(args.search_threads or
+                            max(1, (os.cpu_count() or 1) // args.search_workers)),
+            search_min_epochs=args.search_min_epochs,
+            search_max_epochs=args.search_max_epochs,
+            cpu_performance=args.cpu_performance,
+            dry_run=args.dry_run,
+            non_interactive=args.non_interactive,
+            plot_out=(args.plot_out or (f'{os.path.splitext(args.model_out)[0]}.history.png'
+                                        if args.non_interactive else None)),
+            metrics_out=args.metrics_out,
+            profile=args.profile or args.profile_trace_steps is not None,
+            profile_trace_steps=args.profile_trace_steps
+        )
+
+
+@dataclass(frozen=True)
+class PredictConfig:
+    model: str  # Path to trained model, preprocessing bundle is read from file next to it
+    input_csv: str  # CSV with input columns, may be a glob pattern matching CSV shards
+    output_csv: str  # Path to CSV where predictions will be written
+    keep_cols: Tuple[str, ...]  # Input CSV columns copied to output (e.g. identifiers)
+    chunk_size: int  # Number of CSV rows read and predicted at once
+    batch_size: int  # Batch size used by model.predict
+
+    @staticmethod
+    def from_args(argv: Optional[Sequence[str]] = None) -> PredictConfig:
+        prsr = argparse.ArgumentParser(
+            description='Predicts outputs for rows of CSV file with model trained by this script.',
+            formatter_class=argparse.RawTextHelpFormatter,
         )
 
+        # Declare arguments
+        prsr.add_argument('--model', required=True, type=str,
+                          help='Path to trained model, preprocessing saved with it is used')
+        prsr.add_argument('--input_csv', required=True, type=str,
+                          help='CSV with input columns or glob pattern matching CSV shards')
+        prsr.add_argument('--output_csv', required=True, type=str,
+                          help='Path to CSV where predictions will be written')
+        prsr.add_argument('--keep_cols', type=arg_column_list, default=(),
+                          help='Comma separated names of input CSV columns copied to output')
+        prsr.add_argument('--chunk_size', type=arg_positive_int, default=DEFAULT_CSV_CHUNK_SIZE,
+                          help=f'Number of CSV rows predicted at once (default: {DEFAULT_CSV_CHUNK_SIZE})')
+        prsr.add_argument('--batch_size', type=arg_positive_int, default=DEFAULT_PREDICT_BATCH_SIZE,
+                          help=f'Batch size used for prediction (default: {DEFAULT_PREDICT_BATCH_SIZE})')
+
+        # Parsing arguments
+        args: argparse.Namespace = prsr.parse_args(argv)
+
+        # Returning config
+        return PredictConfig(
+            model=args.model,
+            input_csv=args.input_csv,
+            output_csv=args.output_csv,
+            keep_cols=args.keep_cols,
+            chunk_size=args.chunk_size,
+            batch_size=args.batch_size
+        )
+
+
+@dataclass(frozen=True)
+class ServeConfig:
+    model: str  # Path to trained model, preprocessing bundle is read from file next to it
+    host: str  # Address on which server listens
+    port: int  # TCP port on which server listens
+    unix_socket: str | None  # Path of unix socket, if set it is used instead of TCP
+    batch_window_ms: float  # Maximum time request waits for others to be batched with
+    max_batch_rows: int  # Batch is run as soon as it has that many rows
+
+    @staticmethod
+    def from_args(argv: Optional[Sequence[str]] = None) -> ServeConfig:
+        prsr = argparse.ArgumentParser(
+            description='Serves predictions of model trained by this script over HTTP. '
+            'Concurrent requests are batched together, statistics are available at /metrics.',
+            formatter_class=argparse.RawTextHelpFormatter,
+        )
+
+        # Declare arguments
+        prsr.add_argument('--model', required=True, type=str,
+                          help='Path to trained model, preprocessing saved with it is used')
+        add_server_address_arguments(prsr)
+        prsr.add_argument('--batch_window_ms', type=arg_non_negative_float,
+                          default=DEFAULT_BATCH_WINDOW_MS,
+                          help='Maximum time in milliseconds request waits for other requests to '
+                          f'be batched with (default: {DEFAULT_BATCH_WINDOW_MS})')
+        prsr.add_argument('--max_batch_rows', type=arg_positive_int, default=DEFAULT_MAX_BATCH_ROWS,
+                          help=f'Maximum number of rows in batch (default: {DEFAULT_MAX_BATCH_ROWS})')
+
+        # Parsing arguments
+        args: argparse.Namespace = prsr.parse_args(argv)
+
+        # Returning config
+        return ServeConfig(
+            model=args.model,
+            host=args.host,
+            port=args.port,
+            unix_socket=args.unix_socket,
+            batch_window_ms=args.batch_window_ms,
+            max_batch_rows=args.max_batch_rows
+        )
+
+
+@dataclass(frozen=True)
+class QueryConfig:
+    input_csv: str  # CSV with rows that will be sent to server
+    host: str  # Address of server
+    port: int  # TCP port of server
+    unix_socket: str | None  # Path of unix socket of server, if set it is used instead of TCP
+    rows: int  # Number of CSV rows sent
+    request_rows: int  # Number of rows in single request
+    concurrency: int  # Number of clients sending requests at the same time
+    output_csv: str | None  # Path to CSV where predictions will be written, if None they are not
+
+    @staticmethod
+    def from_args(argv: Optional[Sequence[str]] = None) -> QueryConfig:
+        prsr = argparse.ArgumentParser(
+            description='Sends rows of CSV file to prediction server from concurrent clients and '
+            'reports throughput and server metrics.',
+            formatter_class=argparse.RawTextHelpFormatter,
+        )
+
+        # Declare arguments
+        prsr.add_argument('--input_csv', required=True, type=str,
+                          help='CSV with input columns of served model')
+        add_server_address_arguments(prsr)
+        prsr.add_argument('--rows', type=arg_positive_int, default=1000,
+                          help='Number of CSV rows sent to server (default: 1000)')
+        prsr.add_argument('--request_rows', type=arg_positive_int, default=1,
+                          help='Number of rows in single request (default: 1)')
+        prsr.add_argument('--concurrency', type=arg_positive_int, default=8,
+                          help='Number of concurrent clients (default: 8)')
+        prsr.add_argument('--output_csv', type=str, default=None,
+                          help='Path to CSV where received predictions will be written')
+
+        # Parsing arguments
+        args: argparse.Namespace = prsr.parse_args(argv)
+
+        # Returning config
+        return QueryConfig(
+            input_csv=args.input_csv,
+            host=args.host,
+            port=args.port,
+            unix_socket=args.unix_socket,
+            rows=args.rows,
+            request_rows=args.request_rows,
+            concurrency=args.concurrency,
+            output_csv=args.output_csv
+        )
+
+
+@dataclass(frozen=True)
+class ImportBenchmarkConfig:
+    repeats: int  # Number of measurements, each in fresh interpreter
+    max_seconds: float  # Benchmark fails if median import time is longer
+
+    @staticmethod
+    def from_args(argv: Optional[Sequence[str]] = None) -> ImportBenchmarkConfig:
+        prsr = argparse.ArgumentParser(
+            description='Measures import time of this script and --help in fresh interpreters. '
+            'Fails if import is slower than limit or if it loads any heavy framework '
+            f'({", ".join(HEAVY_MODULES)}).',
+            formatter_class=argparse.RawTextHelpFormatter,
+        )
+
+        # Declare arguments
+        prsr.add_argument('--repeats', type=arg_positive_int, default=5,
+                          help='Number of measurements (default: 5)')
+        prsr.add_argument('--max_seconds', type=arg_non_negative_float,
+                          default=DEFAULT_MAX_IMPORT_SECONDS,
+                          help='Limit of median import time in seconds '
+                          f'(default: {DEFAULT_MAX_IMPORT_SECONDS})')
+
+        # Parsing arguments
+        args: argparse.Namespace = prsr.parse_args(argv)
+
+        # Returning config
+        return ImportBenchmarkConfig(
+            repeats=args.repeats,
+            max_seconds=args.max_seconds
+        )
+
+
+def add_server_address_arguments(prsr: argparse.ArgumentParser) -> None:
+    prsr.add_argument('--host', type=str, default=DEFAULT_SERVER_HOST,
+                      help=f'Server address (default: {DEFAULT_SERVER_HOST})')
+    prsr.add_argument('--port', type=arg_positive_int, default=DEFAULT_SERVER_PORT,
+                      help=f'Server TCP port (default: {DEFAULT_SERVER_PORT})')
+    prsr.add_argument('--unix_socket', type=str, default=None,
+                      help='Path of unix socket used instead of TCP')
+
 # ==================================================================================================
 #                                           HELPERS
 # ==================================================================================================
@@ -216,9 +604,42 @@ def set_global_random_seed(seed: int) -> None:
     tf.random.set_seed(seed)
 
 
+def get_available_cores() -> int:
+    ''' Cores this process may run on, which is less than os.cpu_count() in containers. '''
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def cpu_supports_bfloat16() -> bool:
+    ''' Only CPUs with native bfloat16 instructions benefit from it, others emulate it slowly. '''
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags: set[str] = {flag for line in f if line.startswith('flags')
+                               for flag in line.split(':', 1)[1].split()}
+    except OSError:
+        return False
+    return bool(flags & {'avx512_bf16', 'amx_bf16'})
+
+
+def configure_tensorflow_threads(intra_op: Optional[int] = None,
+                                 inter_op: Optional[int] = None) -> None:
+    '''
+    Sets TensorFlow thread pools, by default intra op pool uses all available cores and only
+    few independent ops run concurrently, so that pools do not oversubscribe cores. Must be
+    called before TensorFlow executes first operation.
+    '''
+    cores: int = get_available_cores()
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op or cores)
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op or min(2, cores))
+    except RuntimeError as err:
+        print(f'TensorFlow threads were not configured - {err}')
+
+
 def panic(msg: str) -> None:
-    print(str)  # Maybe log
-    sys.exit()
+    print(msg)  # Maybe log
+    sys.exit(1)
 
 
 def check_for_missing_columns(data: pd.DataFrame, cols: Sequence[str], filename: str) -> None:
@@ -228,6 +649,25 @@ def check_for_missing_columns(data: pd.DataFrame, cols: Sequence[str], filename:
             f'File {filename} is missing following columns f{missing}')
 
 
+def to_json_value(value: Any) -> Any:
+    ''' Numpy scalars (e.g. category levels) are not accepted by json module. '''
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def get_percentile_summary(values: np.ndarray) -> Dict[str, float]:
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {'mean': float(values.mean()), 'p50': float(p50), 'p90': float(p90),
+            'p99': float(p99), 'max': float(values.max())}
+
+
+def get_power_of_two_histogram(values: np.ndarray) -> Dict[str, int]:
+    ''' Counts of values in power of two buckets, key is bucket upper bound. '''
+    buckets: np.ndarray = np.left_shift(
+        1, np.ceil(np.log2(np.maximum(values, 1))).astype(np.int64))
+    bounds, counts = np.unique(buckets, return_counts=True)
+    return {str(bound): int(count) for bound, count in zip(bounds, counts)}
+
+
 def is_numeric(s: pd.Series) -> bool:
     ''' For better redability of final code (why there is no s.is_numeric() :( )'''
     return pd.api.types.is_numeric_dtype(s)
@@ -243,43 +683,209 @@ class NetworkTaskType(Enum):
 
     @staticmethod
     def infer_from_data(data_out: pd.DataFrame) -> NetworkTaskType:
+        return TargetSummary.from_data(data_out).get_task()
+
+
+@dataclass
+class TargetSummary:
+    '''
+    Statistics of output columns from which task is inferred, computed in single vectorized pass.
+    Summary can be updated chunk by chunk, so it can be built from streamed data (see from_chunks).
+    Distinct values of numeric column are tracked as class ids only while they still can be class
+    ids. Their text is kept as well, so that they become classes if later chunk contains text.
+    '''
+    column_count: int = 0
+    rows: int = 0
+    numeric: bool = True
+    floating: bool = False
+    minimum: float = math.inf  # Value range of numeric outputs, NaN values are ignored
+    maximum: float = -math.inf
+    levels: set[Any] | None = field(default_factory=set)  # Distinct values of single column,
+    # None if column is numeric and cannot encode classes
+    numeric_text: set[str] | None = field(default_factory=set)  # Distinct numbers of single
+    # column as text, None once column has text
+
+    def update(self, data_out: pd.DataFrame) -> TargetSummary:
+        if self.column_count and data_out.shape[1] != self.column_count:
+            raise ValueError(f'Chunk has {data_out.shape[1]} columns, {self.column_count} expected.')
+        self.column_count = data_out.shape[1]
+        self.rows += data_out.shape[0]
+        self.numeric = self.numeric and all(is_numeric(data_out[col]) for col in data_out.columns)
+        if self.numeric:
+            self.floating = self.floating or any(pd.api.types.is_float_dtype(data_out[col])
+                                                 for col in data_out.columns)
+            values: np.ndarray = data_out.to_numpy()
+            if values.dtype.kind == 'f':
+                values = values[~np.isnan(values)]
+            if values.size:
+                self.minimum = min(self.minimum, float(values.min()))
+                self.maximum = max(self.maximum, float(values.max()))
+        if self.column_count > 1:
+            return self
 
+        y: pd.Series = data_out.iloc[:, 0]
+        if not self.numeric:
+            if self.numeric_text is not None:
+                # First text chunk, numbers of previous chunks are classes as well
+                self.levels, self.numeric_text = self.numeric_text, None
+            # Numbers of this chunk are written as in chunks read before text was found
+            self.levels.update(pd.unique(y.dropna().to_numpy()).astype(str) if is_numeric(y)
+                               else pd.unique(y.dropna()))
+            return self
+        self.numeric_text.update(pd.unique(y.dropna().to_numpy()).astype(str))
+        if self.levels is None:
+            return self
+        # Numbers are considered class ids only if they are non negative integers lower than
+        # CLASS_COUNT_THRESHOLD, such values are counted with bincount instead of hashing
+        if self.floating or self.minimum < 0 or self.maximum >= CLASS_COUNT_THRESHOLD:
+            self.levels = None
+        else:
+            self.levels.update(np.flatnonzero(np.bincount(y.to_numpy(dtype=np.int64))).tolist())
+        return self
+
+    def get_class_count(self) -> Optional[int]:
+        ''' Number of classes, None for outputs which cannot be classes. '''
+        if self.column_count != 1 or self.levels is None:
+            return None
+        if not self.numeric:
+            return len(self.levels)
+        # What is important if there is a larger number, like 15 we assume that all values from
+        # 0 to 15 can be set even if it is not present.
+        return int(max(len(self.levels), self.maximum if self.rows else 0))
+
+    def get_categories(self) -> List[str]:
+        '''
+        Distinct values of classification output as text (the way CSV reader of tf.data pipeline
+        reads them), numbers are sorted by value. Empty for outputs which cannot be classes.
+        '''
+        if self.column_count != 1 or self.levels is None:
+            return []
+        if self.numeric:
+            return [str(level) for level in sorted(self.levels)]
+        # Chunks read before first text value was found may have stored numbers
+        return sorted({str(level) for level in self.levels})
+
+    def get_value_range(self) -> Optional[Tuple[float, float]]:
+        if not self.numeric or self.minimum > self.maximum:
+            return None
+        return self.minimum, self.maximum
+
+    def get_task(self) -> NetworkTaskType:
         # If there are multiple columns it can only be regression, if there are non numeric
         # columns an ValueError is thrown.
-        if data_out.shape[1] > 1:
-            if any(not is_numeric(data_out[col]) for col in data_out.columns):
+        if self.column_count > 1:
+            if not self.numeric:
                 raise ValueError('Non numeric data detected for multi column output, '
                                  ' this script can only handle classification for single '
                                  ' column output.')
             return NetworkTaskType.REGRESSION
 
-        # We now that there is only a single column so we can focus on it
-        y: pd.Series = data_out.iloc[:, 0]
-
         # If there is a single column with non numeric data this is clearly classification
-        # we only need to check if there are only two classes or more.
-        if not is_numeric(y):
-            if y.astype('category').cat.categories.size == 2:
-                return NetworkTaskType.BINARY_CLASSIFICATION
-            else:
-                return NetworkTaskType.MULTICLASS_CLASSIFICATION
-
-        # If there is a single column with numeric value we must decide if those numers encode
-        # categories or are values for regression. We will concider numbers as category id's if
-        # values are positive integers and there is less unique numbers than some given threshold.
-        # What is important if there is a larger number, like 15 we assume that all values from
-        # 0 to 15 can be set even if it is not present.
-        CLASS_COUNT_THRESHOLD: Final[int] = 20
-        if pd.api.types.is_float_dtype(y) or any(y < 0):
+        # we only need to check if there are only two classes or more. Numbers are classes if
+        # there are less of them than CLASS_COUNT_THRESHOLD.
+        class_count: Optional[int] = self.get_class_count()
+        if class_count is None:
             return NetworkTaskType.REGRESSION
-        class_count = max(y.nunique(dropna=True), y.max())
         if class_count == 2:
             return NetworkTaskType.BINARY_CLASSIFICATION
-        elif class_count < CLASS_COUNT_THRESHOLD:
+        elif not self.numeric or class_count < CLASS_COUNT_THRESHOLD:
             return NetworkTaskType.MULTICLASS_CLASSIFICATION
         else:
             return NetworkTaskType.REGRESSION
 
+    @staticmethod
+    def from_data(data_out: pd.DataFrame) -> TargetSummary:
+        return TargetSummary().update(data_out)
+
+    @staticmethod
+    def from_chunks(chunks: Iterable[pd.DataFrame]) -> TargetSummary:
+        ''' Summarizes chunks one by one, only single chunk is kept in memory. '''
+        summary = TargetSummary()
+        for chunk in chunks:
+            summary.update(chunk)
+        return summary
+
+# ==================================================================================================
+#                                        DATA LOADING
+# ==================================================================================================
+
+
+def compact_chunk_column(s: pd.Series) -> pd.Series:
+    '''
+    Stores column of single chunk compactly while reading. Floats are stored as float32 which is
+    the precision used by network anyway and text becomes category so that each distinct value is
+    stored only once. Integers are kept as read, they are shrunk once whole column is known.
+    '''
+    if pd.api.types.is_bool_dtype(s) or pd.api.types.is_integer_dtype(s):
+        return s
+    if is_numeric(s):
+        return s.astype(np.float32)
+    return s.astype('category')
+
+
+def merge_chunk_columns(parts: Sequence[pd.Series]) -> Any:
+    '''
+    Merges column read in chunks, dtype of each chunk was inferred on its own. Column becomes
+    category when any chunk contains text (other chunks must be text as well or have only missing
+    values, see read_csv_columns), float32 when any chunk has missing values or fractions, bool
+    when all chunks are bool and otherwise smallest integer type holding all values, so that class
+    ids can still be recognized.
+    '''
+    if any(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+        # Categories differ from chunk to chunk, plain concatenation would turn them back into
+        # object column. Categories are sorted as they would be for column read as a whole.
+        text_parts: List[pd.Series] = [part for part in parts
+                                       if isinstance(part.dtype, pd.CategoricalDtype)]
+        empty: pd.CategoricalDtype = pd.CategoricalDtype(text_parts[0].cat.categories[:0])
+        return pd.api.types.union_categoricals(
+            [part if isinstance(part.dtype, pd.CategoricalDtype)
+             else pd.Series(pd.Categorical(np.full(part.shape[0], np.nan), dtype=empty))
+             for part in parts], sort_categories=True)
+    if all(pd.api.types.is_bool_dtype(part) for part in parts):
+        return np.concatenate([part.to_numpy() for part in parts])
+    if all(pd.api.types.is_integer_dtype(part) or pd.api.types.is_bool_dtype(part)
+           for part in parts):
+        values: np.ndarray = np.concatenate([part.to_numpy(dtype=np.int64) for part in parts])
+        return pd.to_numeric(values, downcast='integer')
+    return np.concatenate([part.to_numpy(dtype=np.float32) for part in parts])
+
+
+def read_csv_columns(filename: str, cols: Sequence[str], chunk_size: int) -> pd.DataFrame:
+    '''
+    Reads only given columns from CSV file in chunks of chunk_size rows with compact dtypes (see
+    merge_chunk_columns). Peak memory depends on selected columns, not on file width.
+    '''
+    # Header is read on its own so that missing columns are reported before reading any data
+    check_for_missing_columns(pd.read_csv(filename, nrows=0), cols, filename)
+    selected: List[str] = list(dict.fromkeys(cols))
+    parts: Dict[str, List[pd.Series]] = {col: [] for col in selected}
+    for chunk in pd.read_csv(filename, usecols=selected, chunksize=chunk_size):
+        for col in selected:
+            parts[col].append(compact_chunk_column(chunk[col]))
+    if not parts[selected[0]]:
+        return pd.read_csv(filename, usecols=selected)[selected]
+
+    # Column with text in some chunks and numbers in others is read again as text. Parsed
+    # numbers cannot be turned back into text they were written as ('001', '3' read as 3.0),
+    # which predict and serve use, as they read such columns as text.
+    mixed: List[str] = [
+        col for col in selected
+        if any(isinstance(part.dtype, pd.CategoricalDtype) for part in parts[col]) and
+        any(not isinstance(part.dtype, pd.CategoricalDtype) and part.notna().any()
+            for part in parts[col])]
+    if mixed:
+        for col in mixed:
+            parts[col] = []
+        for chunk in pd.read_csv(filename, usecols=mixed, dtype={col: str for col in mixed},
+                                 chunksize=chunk_size):
+            for col in mixed:
+                parts[col].append(chunk[col].astype('category'))
+
+    columns: Dict[str, Any] = {}
+    for col in selected:
+        columns[col] = merge_chunk_columns(parts.pop(col))
+    return pd.DataFrame(columns)
+
 # ==================================================================================================
 #                                    DATA PREPROCESSING
 # ==================================================================================================
@@ -290,6 +896,7 @@ class OneHotCategoryDecoder:
     idx_to_category_: Dict[int, str] = {}
 
     def __init__(self, encoded: OneHotEncodedData) -> None:
+        self.idx_to_category_ = {}
         for col in encoded.encoding_columns:
             if col not in encoded.data.columns:
                 raise KeyError(f'Column {col} not present in data')
@@ -313,6 +920,24 @@ class OneHotEncodedData:
     # Names of original categorical columns that are no longer presend in data
     categorical_columns: List[str]
 
+    @cached_property
+    def column_index_(self) -> Dict[str, Dict[str, int]]:
+        '''
+        Maps each categorical column to its encoding columns and their positions among encoding
+        columns. Encoding column is assigned to longest categorical column name it starts with, so
+        that columns like "a" and "a_b" are not confused.
+        '''
+        index: Dict[str, Dict[str, int]] = {col: {} for col in self.categorical_columns}
+        by_length: List[str] = sorted(self.categorical_columns, key=len, reverse=True)
+        for position, name in enumerate(self.encoding_columns):
+            owner: Optional[str] = next((col for col in by_length if name.startswith(f'{col}_')),
+                                        None)
+            if owner is None:
+                raise ValueError(f'Encoding column {name} does not match any categorical column '
+                                 f'from {self.categorical_columns}')
+            index[owner][name] = position
+        return index
+
     @staticmethod
     def encode(data: pd.DataFrame,
                categorical_cols: List[str],
@@ -320,26 +945,44 @@ class OneHotEncodedData:
                ) -> OneHotEncodedData:
         if not categorical_cols:
             return OneHotEncodedData(data=data.copy(), encoding_columns=[], categorical_columns=categorical_cols)
+        if categories:
+            return OneHotEncodedData.encode_like(
+                data, OneHotEncodedData(data=pd.DataFrame(), encoding_columns=list(categories),
+                                        categorical_columns=list(categorical_cols)))
         encoded = pd.get_dummies(
             data, columns=categorical_cols, dummy_na=False)
-        if not categories:
-            generated_columns = [
-                col for col in encoded.columns if col not in data.columns]
-            return OneHotEncodedData(data=encoded, encoding_columns=generated_columns, categorical_columns=categorical_cols)
-        # Add missing categories
-        for category in categories:
-            if category not in encoded.columns:
-                encoded[category] = 0
-        # Remove extra categories
-        valid_columns: List[str] = list(data.columns) + categories
-        to_drop = [col for col in encoded.columns if col not in valid_columns]
-        if to_drop:
-            encoded.drop(columns=to_drop, inplace=True)
-        return OneHotEncodedData(data=encoded, encoding_columns=categories, categorical_columns=categorical_cols)
+        generated_columns = [
+            col for col in encoded.columns if col not in data.columns]
+        return OneHotEncodedData(data=encoded, encoding_columns=generated_columns, categorical_columns=categorical_cols)
 
     @staticmethod
     def encode_like(data: pd.DataFrame, reference: OneHotEncodedData) -> OneHotEncodedData:
-        return OneHotEncodedData.encode(data, reference.categorical_columns, reference.encoding_columns)
+        '''
+        Encodes data with encoding columns of reference, in the same order. Levels unknown to
+        reference and missing values are encoded as all zeros. Used only for test outputs,
+        inputs (also at inference) are encoded by IncrementalInputEncoder.
+        '''
+        encoding_columns: List[str] = reference.encoding_columns
+        # Column major layout is what DataFrame stores internally, so it is wrapped without copy
+        one_hot: np.ndarray = np.zeros((data.shape[0], len(encoding_columns)), dtype=bool, order='F')
+        rows: np.ndarray = np.arange(data.shape[0])
+        for col, index in reference.column_index_.items():
+            # Only distinct levels are looked up, rows are then mapped through their level codes.
+            # Last entry (-1) is picked by code -1 of missing values.
+            levels: pd.Series = data[col].astype('category')
+            lookup: np.ndarray = np.array(
+                [index.get(f'{col}_{level}', -1) for level in levels.cat.categories] + [-1],
+                dtype=np.int64)
+            positions: np.ndarray = lookup[levels.cat.codes.to_numpy()]
+            known: np.ndarray = positions >= 0
+            one_hot[rows[known], positions[known]] = True
+
+        kept: pd.DataFrame = data.drop(columns=reference.categorical_columns)
+        encoded: pd.DataFrame = pd.DataFrame(one_hot, columns=encoding_columns, index=data.index,
+                                             copy=False)
+        return OneHotEncodedData(data=pd.concat([kept, encoded], axis=1),
+                                 encoding_columns=list(encoding_columns),
+                                 categorical_columns=list(reference.categorical_columns))
 
 
 class BinaryCategoryDecoder:
@@ -397,13 +1040,302 @@ class BinaryEncodedData:
         return BinaryEncodedData(encoded_data, reference.category, reference.name)
 
 
+def allocate_matrix(rows: int, cols: int, memmap_path: Optional[str] = None) -> np.ndarray:
+    ''' Allocates float32 matrix in memory or, if path is given, as memory mapped .npy file. '''
+    if memmap_path is None:
+        return np.empty((rows, cols), dtype=np.float32)
+    return np.lib.format.open_memmap(memmap_path, mode='w+', dtype=np.float32, shape=(rows, cols))
+
+
+def get_embedding_size(id_count: int) -> int:
+    ''' Rule of thumb (used by fast.ai) for size of embedding vector of categorical column. '''
+    return int(max(1, min(MAX_EMBEDDING_SIZE, round(1.6 * id_count ** 0.56))))
+
+
+class CategoryEncoding(Enum):
+    ONE_HOT = auto(),  # Dense one hot columns, standard scaled
+    SPARSE = auto(),  # One hot columns stored as CSR matrix, scaled but not centered
+    EMBEDDING = auto()  # Integer category ids fed to Embedding layer
+
+    def __repr__(self) -> str:
+        return f'{self.name}'
+
+    @staticmethod
+    def choose(category_count: int,
+               sparse_threshold: Optional[int],
+               embedding_threshold: Optional[int]) -> CategoryEncoding:
+        if embedding_threshold is not None and category_count > embedding_threshold:
+            return CategoryEncoding.EMBEDDING
+        if sparse_threshold is not None and category_count > sparse_threshold:
+            return CategoryEncoding.SPARSE
+        return CategoryEncoding.ONE_HOT
+
+
+class IncrementalInputEncoder:
+    '''
+    Fits encoding and standard scaling of input columns in a single pass over chunks of data.
+    Numeric columns accumulate count, mean and sum of squared deviations (chunk statistics are
+    merged as in Chan et al. parallel variance), categorical columns accumulate counts of each
+    level, from which mean and variance of one hot columns follow directly. Encoded and scaled
+    chunks are then written straight into preallocated output, without intermediate copies.
+
+    Encoding of each categorical column is chosen by its cardinality (see CategoryEncoding), when
+    thresholds are None every column is one hot encoded.
+    '''
+
+    numeric_columns_: List[str]
+    categorical_columns_: List[str]
+    sparse_threshold_: Optional[int]
+    embedding_threshold_: Optional[int]
+    rows_: int
+    count_: np.ndarray
+    mean_: np.ndarray
+    m2_: np.ndarray
+    level_counts_: Dict[str, Dict[Any, int]]
+    # Set by finalize
+    categories_: Dict[str, List[Any]]
+    encodings_: Dict[str, CategoryEncoding]
+    columns_: List[str]  # Dense columns followed by sparse ones
+    dense_width_: int
+    embedded_columns_: List[str]
+    category_index_: Dict[str, pd.Index]  # Hash index of categories_ used to encode values
+    scaler_: StandardScaler
+
+    def __init__(self, numeric_columns: Sequence[str], categorical_columns: Sequence[str],
+                 sparse_threshold: Optional[int] = None,
+                 embedding_threshold: Optional[int] = None) -> None:
+        self.numeric_columns_ = list(numeric_columns)
+        self.categorical_columns_ = list(categorical_columns)
+        self.sparse_threshold_ = sparse_threshold
+        self.embedding_threshold_ = embedding_threshold
+        self.rows_ = 0
+        self.count_ = np.zeros(len(self.numeric_columns_), dtype=np.int64)
+        self.mean_ = np.zeros(len(self.numeric_columns_), dtype=np.float64)
+        self.m2_ = np.zeros(len(self.numeric_columns_), dtype=np.float64)
+        self.level_counts_ = {col: {} for col in self.categorical_columns_}
+
+    def partial_fit(self, chunk: pd.DataFrame) -> None:
+        self.rows_ += chunk.shape[0]
+        if self.numeric_columns_:
+            # Missing values are skipped per column, just like StandardScaler does
+            values: np.ndarray = chunk[self.numeric_columns_].to_numpy(dtype=np.float64)
+            valid: np.ndarray = ~np.isnan(values)
+            count: np.ndarray = valid.sum(axis=0)
+            mean: np.ndarray = np.where(valid, values, 0.0).sum(axis=0) / np.maximum(count, 1)
+            m2: np.ndarray = np.where(valid, values - mean, 0.0)
+            m2 = np.einsum('ij,ij->j', m2, m2)
+
+            total: np.ndarray = self.count_ + count
+            delta: np.ndarray = mean - self.mean_
+            weight: np.ndarray = count / np.maximum(total, 1)
+            self.mean_ += delta * weight
+            self.m2_ += m2 + delta * delta * self.count_ * weight
+            self.count_ = total
+        for col in self.categorical_columns_:
+            counts = self.level_counts_[col]
+            for level, count in chunk[col].value_counts(sort=False, dropna=True).items():
+                counts[level] = counts.get(level, 0) + int(count)
+
+    def columns_with_(self, encoding: CategoryEncoding) -> List[str]:
+        return [col for col in self.categorical_columns_ if self.encodings_[col] == encoding]
+
+    def finalize(self) -> StandardScaler:
+        ''' Fixes encoding after all chunks were seen and returns fitted scaler. '''
+        # Levels are sorted as pd.get_dummies would sort them, levels that were never present
+        # (possible for categorical dtype) are skipped as get_dummies skips them too
+        self.categories_ = {col: sorted(level for level, count in self.level_counts_[col].items()
+                                        if count > 0)
+                            for col in self.categorical_columns_}
+        self.encodings_ = {col: CategoryEncoding.choose(len(self.categories_[col]),
+                                                        self.sparse_threshold_,
+                                                        self.embedding_threshold_)
+                           for col in self.categorical_columns_}
+        self.set_layout_()
+        one_hot_cols: List[str] = (self.columns_with_(CategoryEncoding.ONE_HOT)
+                                   + self.columns_with_(CategoryEncoding.SPARSE))
+
+        # One hot column with p ones among all rows has mean p and variance p(1-p)
+        frequencies: List[np.ndarray] = [
+            np.array([self.level_counts_[col][category] for category in self.categories_[col]],
+                     dtype=np.float64) / max(self.rows_, 1)
+            for col in one_hot_cols]
+        mean: np.ndarray = np.concatenate([self.mean_] + frequencies)
+        var: np.ndarray = np.concatenate(
+            [self.m2_ / np.maximum(self.count_, 1)] + [p * (1.0 - p) for p in frequencies])
+        samples: np.ndarray = np.concatenate(
+            [self.count_] + [np.full(p.shape[0], self.rows_, dtype=np.int64) for p in frequencies])
+
+        # Constant columns (variance within rounding error) are only centered, as in StandardScaler
+        eps: float = np.finfo(np.float64).eps
+        constant: np.ndarray = var <= samples * eps * var + (samples * mean * eps) ** 2
+        scaler = preprocessing.StandardScaler()
+        scaler.mean_ = mean
+        # Sparse columns are not centered, otherwise zeros would not stay zeros
+        scaler.mean_[self.dense_width_:] = 0.0
+        scaler.var_ = var
+        scaler.scale_ = np.where(constant, 1.0, np.sqrt(var))
+        scaler.n_samples_seen_ = samples if len(set(samples.tolist())) > 1 else self.rows_
+        scaler.n_features_in_ = mean.shape[0]
+        self.scaler_ = scaler
+        return scaler
+
+    def set_layout_(self) -> None:
+        ''' Derives order of encoded columns from categories and encodings. '''
+        one_hot_cols: List[str] = (self.columns_with_(CategoryEncoding.ONE_HOT)
+                                   + self.columns_with_(CategoryEncoding.SPARSE))
+        self.embedded_columns_ = self.columns_with_(CategoryEncoding.EMBEDDING)
+        self.columns_ = self.numeric_columns_ + [f'{col}_{category}'
+                                                 for col in one_hot_cols
+                                                 for category in self.categories_[col]]
+        self.dense_width_ = len(self.numeric_columns_) + sum(
+            len(self.categories_[col]) for col in self.columns_with_(CategoryEncoding.ONE_HOT))
+        self.category_index_ = {col: pd.Index(levels) for col, levels in self.categories_.items()}
+
+    def to_dict(self) -> Dict[str, Any]:
+        ''' State of finalized encoder as JSON compatible dictionary. '''
+        return {
+            'numeric_columns': self.numeric_columns_,
+            'categorical_columns': self.categorical_columns_,
+            'sparse_threshold': self.sparse_threshold_,
+            'embedding_threshold': self.embedding_threshold_,
+            'rows': self.rows_,
+            'categories': {col: [to_json_value(level) for level in levels]
+                           for col, levels in self.categories_.items()},
+            'encodings': {col: encoding.name for col, encoding in self.encodings_.items()},
+            'scaler_mean': self.scaler_.mean_.tolist(),
+            'scaler_var': self.scaler_.var_.tolist(),
+            'scaler_scale': self.scaler_.scale_.tolist(),
+            'scaler_samples': np.asarray(self.scaler_.n_samples_seen_).tolist(),
+        }
+
+    @staticmethod
+    def from_dict(state: Dict[str, Any]) -> IncrementalInputEncoder:
+        ''' Restores finalized encoder stored by to_dict. '''
+        encoder = IncrementalInputEncoder(state['numeric_columns'], state['categorical_columns'],
+                                          state['sparse_threshold'], state['embedding_threshold'])
+        encoder.rows_ = state['rows']
+        encoder.categories_ = state['categories']
+        encoder.encodings_ = {col: CategoryEncoding[name]
+                              for col, name in state['encodings'].items()}
+        encoder.set_layout_()
+
+        scaler = preprocessing.StandardScaler()
+        scaler.mean_ = np.asarray(state['scaler_mean'], dtype=np.float64)
+        scaler.var_ = np.asarray(state['scaler_var'], dtype=np.float64)
+        scaler.scale_ = np.asarray(state['scaler_scale'], dtype=np.float64)
+        scaler.n_samples_seen_ = (np.asarray(state['scaler_samples'], dtype=np.int64)
+                                  if isinstance(state['scaler_samples'], list)
+                                  else state['scaler_samples'])
+        scaler.n_features_in_ = scaler.mean_.shape[0]
+        encoder.scaler_ = scaler
+        return encoder
+
+    def is_sparse(self) -> bool:
+        return self.dense_width_ < len(self.columns_)
+
+    def get_embedding_id_counts(self) -> Dict[str, int]:
+        ''' Number of ids of each embedded column, id 0 is used for unknown and missing levels. '''
+        return {col: len(self.categories_[col]) + 1 for col in self.embedded_columns_}
+
+    def category_codes_(self, chunk: pd.DataFrame, col: str) -> np.ndarray:
+        ''' Index of level of each row in categories_, -1 for unknown and missing values. '''
+        values: pd.Series = chunk[col]
+        index: pd.Index = self.category_index_[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Only distinct levels are looked up, last entry (-1) is picked by missing values
+            lookup: np.ndarray = np.append(index.get_indexer(values.cat.categories), -1)
+            return lookup[values.cat.codes.to_numpy()]
+        # Text read by predict and serve is looked up directly in hash table of index, finding
+        # distinct levels first (factorize) would hash every row anyway and it is ~3x slower
+        return index.get_indexer(values)
+
+    def transform_into(self, chunk: pd.DataFrame, out: np.ndarray) -> None:
+        '''
+        Writes encoded and scaled dense columns of chunk into out, which must have shape
+        (rows, dense_width_).
+        '''
+        mean: np.ndarray = self.scaler_.mean_
+        scale: np.ndarray = self.scaler_.scale_
+        numeric_count: int = len(self.numeric_columns_)
+        if numeric_count:
+            out[:, :numeric_count] = (
+                (chunk[self.numeric_columns_].to_numpy(dtype=np.float64) - mean[:numeric_count])
+                / scale[:numeric_count])
+        offset: int = numeric_count
+        for col in self.columns_with_(CategoryEncoding.ONE_HOT):
+            width: int = len(self.categories_[col])
+            # Every row starts as all zeros encoding, then single one is set for known levels.
+            # Unknown levels and missing values stay all zeros.
+            out[:, offset:offset + width] = -mean[offset:offset + width] / scale[offset:offset + width]
+            codes: np.ndarray = self.category_codes_(chunk, col)
+            rows: np.ndarray = np.flatnonzero(codes >= 0)
+            hot: np.ndarray = offset + codes[rows].astype(np.int64)
+            out[rows, hot] = (1.0 - mean[hot]) / scale[hot]
+            offset += width
+
+    def transform_sparse_(self, chunk: pd.DataFrame, dense: np.ndarray) -> sparse.csr_matrix:
+        ''' Joins dense part of chunk with its sparse one hot columns into single CSR matrix. '''
+        row_ids: List[np.ndarray] = []
+        column_ids: List[np.ndarray] = []
+        offset: int = self.dense_width_
+        for col in self.columns_with_(CategoryEncoding.SPARSE):
+            codes: np.ndarray = self.category_codes_(chunk, col)
+            rows: np.ndarray = np.flatnonzero(codes >= 0)
+            row_ids.append(rows)
+            column_ids.append(offset + codes[rows].astype(np.int64))
+            offset += len(self.categories_[col])
+        rows = np.concatenate(row_ids)
+        hot: np.ndarray = np.concatenate(column_ids)
+        one_hot = sparse.csr_matrix(
+            ((1.0 / self.scaler_.scale_[hot]).astype(np.float32), (rows, hot - self.dense_width_)),
+            shape=(chunk.shape[0], len(self.columns_) - self.dense_width_))
+        return sparse.hstack([sparse.csr_matrix(dense), one_hot], format='csr', dtype=np.float32)
+
+    def transform_ids_(self, chunk: pd.DataFrame) -> np.ndarray:
+        ids: np.ndarray = np.empty((chunk.shape[0], len(self.embedded_columns_)), dtype=np.int32)
+        for idx, col in enumerate(self.embedded_columns_):
+            ids[:, idx] = self.category_codes_(chunk, col) + 1
+        return ids
+
+    def transform(self, data: pd.DataFrame, chunk_size: int, memmap_path: Optional[str] = None
+                  ) -> Tuple[np.ndarray | sparse.csr_matrix, np.ndarray | None]:
+        '''
+        Returns encoded and scaled matrix (CSR matrix if any column uses sparse encoding, memmap
+        is then not used) and category ids of embedded columns (None if there are none).
+        '''
+        ids: np.ndarray | None = None
+        if self.embedded_columns_:
+            ids = np.concatenate([self.transform_ids_(data.iloc[start:start + chunk_size])
+                                  for start in range(0, data.shape[0], chunk_size)]
+                                 or [self.transform_ids_(data)])
+        if self.is_sparse():
+            parts: List[sparse.csr_matrix] = []
+            for start in range(0, data.shape[0], chunk_size):
+                chunk: pd.DataFrame = data.iloc[start:start + chunk_size]
+                dense: np.ndarray = allocate_matrix(chunk.shape[0], self.dense_width_)
+                self.transform_into(chunk, dense)
+                parts.append(self.transform_sparse_(chunk, dense))
+            if not parts:
+                return sparse.csr_matrix((0, len(self.columns_)), dtype=np.float32), ids
+            return sparse.vstack(parts, format='csr', dtype=np.float32), ids
+        result: np.ndarray = allocate_matrix(data.shape[0], len(self.columns_), memmap_path)
+        for start in range(0, data.shape[0], chunk_size):
+            self.transform_into(data.iloc[start:start + chunk_size], result[start:start + chunk_size])
+        return result, ids
+
+
 @dataclass
 class InputData:
 
-    train_input: np.ndarray
-    test_input: np.ndarray
+    train_input: np.ndarray | sparse.csr_matrix
+    test_input: np.ndarray | sparse.csr_matrix
     scaler: StandardScaler
     columns: List[str]
+    # Category ids of embedded columns, None if no column uses embedding
+    train_ids: np.ndarray | None
+    test_ids: np.ndarray | None
+    embedding_ids: Dict[str, int]  # Number of ids of each embedded column
+    encoder: IncrementalInputEncoder  # Fitted encoding, applies the same preprocessing to new data
 
     def get_training_sample_count(self) -> int:
         return self.train_input.shape[0]
@@ -412,32 +1344,83 @@ class InputData:
         return self.test_input.shape[0]
 
     def get_feature_count(self) -> int:
+        ''' Number of encoded columns, embedded columns are not included. '''
         return self.train_input.shape[1]
 
+    def is_sparse(self) -> bool:
+        return sparse.issparse(self.train_input)
+
+    def get_train_inputs(self, rows: slice = slice(None)
+                         ) -> np.ndarray | sparse.csr_matrix | Dict[str, Any]:
+        ''' Rows of dense arrays are returned as views. '''
+        return InputData.make_model_inputs(self.train_input[rows],
+                                           None if self.train_ids is None else self.train_ids[rows])
+
+    def reorder_rows(self, order: np.ndarray, memmap_path: Optional[str] = None,
+                     chunk_size: int = DEFAULT_CSV_CHUNK_SIZE) -> InputData:
+        ''' Copies training rows in given order, dense matrix is written to memmap_path if given. '''
+        train_input: np.ndarray | sparse.csr_matrix
+        if self.is_sparse():
+            train_input = self.train_input[order]
+        else:
+            train_input = allocate_matrix(order.shape[0], self.get_feature_count(), memmap_path)
+            for start in range(0, order.shape[0], chunk_size):
+                train_input[start:start + chunk_size] = self.train_input[order[start:start + chunk_size]]
+        train_ids: np.ndarray | None = None if self.train_ids is None else self.train_ids[order]
+        return InputData(train_input, self.test_input, self.scaler, self.columns, train_ids,
+                         self.test_ids, self.embedding_ids, self.encoder)
+
+    def get_test_inputs(self) -> np.ndarray | sparse.csr_matrix | Dict[str, Any]:
+        return InputData.make_model_inputs(self.test_input, self.test_ids)
+
     @staticmethod
-    def prepare_inputs(data_train: pd.DataFrame, data_test: pd.DataFrame, input_cols: Sequence[str]) -> InputData:
-        train_raw: pd.DataFrame = data_train[list(input_cols)].copy()
-        test_raw: pd.DataFrame = data_test[list(input_cols)].copy()
+    def make_model_inputs(features: np.ndarray | sparse.csr_matrix, ids: np.ndarray | None
+                          ) -> np.ndarray | sparse.csr_matrix | Dict[str, Any]:
+        ''' Network has a single input, unless some column is embedded. '''
+        if ids is None:
+            return features
+        return {'inputs': features, 'ids': ids}
 
+    @staticmethod
+    def prepare_inputs(data_train: pd.DataFrame,
+                       data_test: pd.DataFrame,
+                       input_cols: Sequence[str],
+                       chunk_size: int = DEFAULT_CSV_CHUNK_SIZE,
+                       memmap_dir: Optional[str] = None,
+                       sparse_threshold: Optional[int] = DEFAULT_SPARSE_THRESHOLD,
+                       embedding_threshold: Optional[int] = DEFAULT_EMBEDDING_THRESHOLD
+                       ) -> InputData:
+        '''
+        Encodes and scales inputs chunk by chunk, each of resulting matrices is written once into
+        preallocated (or memory mapped, if memmap_dir is given) array. Categorical columns with
+        more than sparse_threshold levels are stored as CSR matrix and those with more than
+        embedding_threshold levels as category ids for Embedding layers.
+        '''
         categorical_cols: List[str] = [
-            col for col in input_cols if not is_numeric(train_raw[col])]
-        train_encoded: OneHotEncodedData = OneHotEncodedData.encode(
-            train_raw, categorical_cols)
-        test_encoded: OneHotEncodedData = OneHotEncodedData.encode_like(
-            test_raw, train_encoded)
-        train_np: np.ndarray = train_encoded.data.to_numpy(
-            dtype=np.float32, copy=True)
-        test_np: np.ndarray = test_encoded.data.to_numpy(
-            dtype=np.float32, copy=True)
-
-        scaler: StandardScaler = StandardScaler().fit(train_np)
-        train_np = scaler.transform(train_np)
-        test_np = scaler.transform(test_np)
-
-        return InputData(train_input=train_np,
-                         test_input=test_np,
+            col for col in input_cols if not is_numeric(data_train[col])]
+        numeric_cols: List[str] = [col for col in input_cols if col not in categorical_cols]
+        encoder = IncrementalInputEncoder(numeric_cols, categorical_cols,
+                                          sparse_threshold, embedding_threshold)
+        for start in range(0, data_train.shape[0], chunk_size):
+            encoder.partial_fit(data_train.iloc[start:start + chunk_size])
+        scaler: StandardScaler = encoder.finalize()
+
+        train_path: Optional[str] = None
+        test_path: Optional[str] = None
+        if memmap_dir:
+            os.makedirs(memmap_dir, exist_ok=True)
+            train_path = os.path.join(memmap_dir, 'train_input.npy')
+            test_path = os.path.join(memmap_dir, 'test_input.npy')
+        train_input, train_ids = encoder.transform(data_train, chunk_size, train_path)
+        test_input, test_ids = encoder.transform(data_test, chunk_size, test_path)
+        return InputData(train_input=train_input,
+                         test_input=test_input,
                          scaler=scaler,
-                         columns=list(train_encoded.data.columns))
+                         columns=encoder.columns_,
+                         train_ids=train_ids,
+                         test_ids=test_ids,
+                         embedding_ids=encoder.get_embedding_id_counts(),
+                         encoder=encoder)
 
 
 @dataclass
@@ -447,10 +1430,11 @@ class OutputData:
     decoder: BinaryCategoryDecoder | OneHotCategoryDecoder | None
 
     def get_output_size(self) -> int:
-        return self.train_out.shape[1]
+        # Binary classification keeps its targets in one dimensional array
+        return self.train_out.shape[1] if self.train_out.ndim > 1 else 1
 
     def get_category_count(self):
-        return self.train_out.shape[1] if self.train_out.shape[1] > 1 else 2
+        return self.get_output_size() if self.get_output_size() > 1 else 2
 
     @staticmethod
     def prepare_outputs(data_train: pd.DataFrame,
@@ -487,49 +1471,898 @@ class OutputData:
         # For one hot encoding we use train and test raw as OneHotEncodedData was designed for
         # more general cases than BinaryEncodedData
         train_encoded = OneHotEncodedData.encode(train_raw, list(output_cols))
-        test_encoded = OneHotEncodedData.encode(test_raw, list(output_cols))
+        test_encoded = OneHotEncodedData.encode_like(test_raw, train_encoded)
         decoder = OneHotCategoryDecoder(train_encoded)
         return OutputData(train_encoded.data.to_numpy(dtype=np.float32), test_encoded.data.to_numpy(dtype=np.float32), decoder)
 
+    def reorder_rows(self, order: np.ndarray) -> OutputData:
+        return OutputData(self.train_out[order], self.test_out, self.decoder)
+
+# ==================================================================================================
+#                                   TRAIN/VALIDATION SPLIT
+# ==================================================================================================
+
+
+@dataclass(frozen=True)
+class DataSplit:
+    '''
+    Seeded random split of training rows into training and validation part. Classification data
+    is split per class, so that validation part keeps class proportions of training data.
+    '''
+    train_indices: np.ndarray  # Sorted indices of rows used for training
+    validation_indices: np.ndarray  # Sorted indices of rows used for validation
+
+    def get_train_count(self) -> int:
+        return self.train_indices.shape[0]
+
+    def get_validation_count(self) -> int:
+        return self.validation_indices.shape[0]
+
+    def get_order(self) -> np.ndarray:
+        ''' Row order in which training rows come first and validation rows form the tail. '''
+        return np.concatenate([self.train_indices, self.validation_indices])
+
+    @staticmethod
+    def make(sample_count: int, validation_split: float, seed: int,
+             labels: Optional[np.ndarray] = None) -> DataSplit:
+        ''' Rows are split with single permutation, or one per class if labels are given. '''
+        rng = np.random.default_rng(seed)
+        if labels is None:
+            groups: List[np.ndarray] = [np.arange(sample_count)]
+        else:
+            _, inverse = np.unique(labels, return_inverse=True)
+            groups = np.split(np.argsort(inverse, kind='stable'),
+                              np.cumsum(np.bincount(inverse))[:-1])
+        validation: np.ndarray = np.sort(np.concatenate(
+            [rng.permutation(group)[:int(round(group.shape[0] * validation_split))]
+             for group in groups]))
+        is_train: np.ndarray = np.ones(sample_count, dtype=bool)
+        is_train[validation] = False
+        return DataSplit(np.flatnonzero(is_train), validation)
+
+    @staticmethod
+    def for_task(task: NetworkTaskType, train_out: np.ndarray, validation_split: float,
+                 seed: int) -> DataSplit:
+        labels: Optional[np.ndarray] = {
+            NetworkTaskType.REGRESSION: None,
+            NetworkTaskType.BINARY_CLASSIFICATION: train_out,
+            NetworkTaskType.MULTICLASS_CLASSIFICATION: (
+                np.argmax(train_out, axis=1) if train_out.ndim > 1 else None)}[task]
+        return DataSplit.make(train_out.shape[0], validation_split, seed, labels)
+
+
+def split_training_data(data_in: InputData, data_out: OutputData, task: NetworkTaskType,
+                        validation_split: float, seed: int, memmap_dir: Optional[str] = None
+                        ) -> Tuple[InputData, OutputData, DataSplit]:
+    '''
+    Reorders training rows once, so that training and validation parts are contiguous and can be
+    passed to network as views instead of copies made for each fit.
+    '''
+    split: DataSplit = DataSplit.for_task(task, data_out.train_out, validation_split, seed)
+    memmap_path: Optional[str] = None
+    if memmap_dir:
+        os.makedirs(memmap_dir, exist_ok=True)
+        memmap_path = os.path.join(memmap_dir, 'train_input_split.npy')
+    order: np.ndarray = split.get_order()
+    return data_in.reorder_rows(order, memmap_path), data_out.reorder_rows(order), split
+
+# ==================================================================================================
+#                                    PREPROCESSING BUNDLE
+# ==================================================================================================
+
+
+@dataclass
+class PreprocessingBundle:
+    '''
+    Everything needed to use trained network on new data: input encoding and scaling, task and
+    decoding of network outputs. It is saved as JSON file next to the model.
+    '''
+
+    task: NetworkTaskType
+    encoder: IncrementalInputEncoder
+    output_columns: List[str]
+    decoder: BinaryCategoryDecoder | OneHotCategoryDecoder | None
+
+    @staticmethod
+    def get_path(model_path: str) -> str:
+        ''' Path of bundle stored with given model file. '''
+        return f'{os.path.splitext(model_path)[0]}.preprocessing.json'
+
+    def get_input_columns(self) -> List[str]:
+        return self.encoder.numeric_columns_ + self.encoder.categorical_columns_
+
+    def get_class_names(self) -> List[Any]:
+        ''' Class names in order of network outputs, empty for regression. '''
+        if isinstance(self.decoder, BinaryCategoryDecoder):
+            return list(self.decoder.category_)
+        if isinstance(self.decoder, OneHotCategoryDecoder):
+            # One hot column names are prefixed with name of output column
+            prefix_length: int = len(self.output_columns[0]) + 1
+            return [self.decoder.decode(idx)[prefix_length:]
+                    for idx in range(len(self.decoder.idx_to_category_))]
+        return []
+
+    def decode(self, predictions: np.ndarray) -> pd.DataFrame:
+        '''
+        Turns network outputs into values of output columns. For classification predicted class
+        is returned together with its probability.
+        '''
+        if self.task == NetworkTaskType.REGRESSION:
+            return pd.DataFrame(predictions, columns=self.output_columns)
+        out_col: str = self.output_columns[0]
+        class_names: np.ndarray = np.asarray(self.get_class_names(), dtype=object)
+        if self.task == NetworkTaskType.BINARY_CLASSIFICATION:
+            positive: np.ndarray = predictions.reshape(-1) >= 0.5
+            probability: np.ndarray = np.where(positive, predictions.reshape(-1),
+                                               1.0 - predictions.reshape(-1))
+            return pd.DataFrame({out_col: class_names[positive.astype(np.int64)],
+                                 f'{out_col}_probability': probability})
+        best: np.ndarray = predictions.argmax(axis=1)
+        return pd.DataFrame({out_col: class_names[best],
+                             f'{out_col}_probability': predictions[np.arange(best.shape[0]), best]})
+
+    def to_dict(self) -> Dict[str, Any]:
+        decoder_kind: str | None = None
+        categories: List[Any] = []
+        if isinstance(self.decoder, BinaryCategoryDecoder):
+            decoder_kind = 'binary'
+            categories = [to_json_value(category) for category in self.decoder.category_]
+        elif isinstance(self.decoder, OneHotCategoryDecoder):
+            decoder_kind = 'one_hot'
+            categories = [self.decoder.decode(idx)
+                          for idx in range(len(self.decoder.idx_to_category_))]
+        return {
+            'task': self.task.name,
+            'encoder': self.encoder.to_dict(),
+            'output_columns': list(self.output_columns),
+            'decoder': decoder_kind,
+            'categories': categories,
+        }
+
+    @staticmethod
+    def from_dict(state: Dict[str, Any]) -> PreprocessingBundle:
+        output_cols: List[str] = state['output_columns']
+        decoder: BinaryCategoryDecoder | OneHotCategoryDecoder | None = None
+        if state['decoder'] == 'binary':
+            decoder = BinaryCategoryDecoder(BinaryEncodedData(
+                data=np.empty(0, dtype=np.float32), category=tuple(state['categories']),
+                name=output_cols[0]))
+        elif state['decoder'] == 'one_hot':
+            decoder = OneHotCategoryDecoder(OneHotEncodedData(
+                data=pd.DataFrame(columns=state['categories']),
+                encoding_columns=state['categories'],
+                categorical_columns=output_cols))
+        return PreprocessingBundle(task=NetworkTaskType[state['task']],
+                                   encoder=IncrementalInputEncoder.from_dict(state['encoder']),
+                                   output_columns=output_cols,
+                                   decoder=decoder)
+
+    def save(self, path: str) -> None:
+        # Written to temporary file and renamed, so that readers never see partial file
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path: str) -> PreprocessingBundle:
+        with open(path, 'r') as f:
+            return PreprocessingBundle.from_dict(json.load(f))
+
+# ==================================================================================================
+#                                     PREPROCESSING CACHE
+# ==================================================================================================
+
+
+# Components of CSR matrix saved by save_array, each one as separate .npy file
+CSR_COMPONENTS: Final[Tuple[str, ...]] = ('data', 'indices', 'indptr', 'shape')
+
+
+def save_array(directory: str, name: str, array: np.ndarray | sparse.csr_matrix) -> None:
+    '''
+    Saves array as name.npy (float arrays as float32) or, if it is sparse, its CSR components as
+    name.data.npy, name.indices.npy, name.indptr.npy and name.shape.npy so that load_array can
+    memory map them.
+    '''
+    if sparse.issparse(array):
+        matrix: sparse.csr_matrix = sparse.csr_matrix(array)
+        for component, values in zip(CSR_COMPONENTS, (matrix.data, matrix.indices, matrix.indptr,
+                                                      np.asarray(matrix.shape, dtype=np.int64))):
+            np.save(os.path.join(directory, f'{name}.{component}.npy'), np.ascontiguousarray(values))
+    elif np.issubdtype(array.dtype, np.integer):
+        np.save(os.path.join(directory, f'{name}.npy'), np.ascontiguousarray(array))
+    else:
+        np.save(os.path.join(directory, f'{name}.npy'),
+                np.ascontiguousarray(array, dtype=np.float32))
+
+
+def load_array(directory: str, name: str) -> np.ndarray | sparse.csr_matrix | None:
+    '''
+    Loads array saved by save_array. Arrays are memory mapped, sparse matrix is built on top of
+    memory mapped components, so processes loading the same matrix share its memory.
+    '''
+    path = os.path.join(directory, name)
+    if os.path.exists(f'{path}.indptr.npy'):
+        data, indices, indptr, shape = (np.load(f'{path}.{component}.npy', mmap_mode='r')
+                                        for component in CSR_COMPONENTS)
+        return sparse.csr_matrix((data, indices, indptr), shape=tuple(int(n) for n in shape),
+                                 copy=False)
+    if os.path.exists(f'{path}.npy'):
+        return np.load(f'{path}.npy', mmap_mode='r')
+    return None
+
+
+class PreprocessingCache:
+    '''
+    Cache of preprocessed (encoded and scaled) data in a directory. Each entry is a subdirectory
+    named by hash of CSV contents, selected columns and encoding thresholds holding .npy matrices,
+    that are memory mapped when loaded (sparse matrices as their CSR components), and
+    meta.json with preprocessing bundle.
+    '''
+
+    # Increase when layout of cache entries changes so that old entries are not used
+    CACHE_VERSION: Final[int] = 4
+    HASH_BLOCK_SIZE: Final[int] = 1 << 20
+    ARRAYS: Final[Tuple[str, ...]] = ('train_input', 'test_input', 'train_out', 'test_out',
+                                      'train_ids', 'test_ids')
+
+    entry_dir_: str
+
+    def __init__(self, cache_dir: str, csv_files: Sequence[str],
+                 input_cols: Sequence[str], output_cols: Sequence[str],
+                 sparse_threshold: Optional[int] = None,
+                 embedding_threshold: Optional[int] = None) -> None:
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(json.dumps([PreprocessingCache.CACHE_VERSION,
+                                  list(input_cols), list(output_cols),
+                                  sparse_threshold, embedding_threshold]).encode())
+        for filename in csv_files:
+            with open(filename, 'rb') as f:
+                while block := f.read(PreprocessingCache.HASH_BLOCK_SIZE):
+                    digest.update(block)
+            # Separator so that moving bytes between files changes the hash
+            digest.update(b'\0')
+        self.entry_dir_ = os.path.join(cache_dir, digest.hexdigest())
+
+    def load(self) -> Tuple[NetworkTaskType, InputData, OutputData] | None:
+        meta_path = os.path.join(self.entry_dir_, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r') as f:
+            meta: Dict[str, Any] = json.load(f)
+        arrays: Dict[str, Any] = {name: load_array(self.entry_dir_, name)
+                                  for name in PreprocessingCache.ARRAYS}
+
+        bundle: PreprocessingBundle = PreprocessingBundle.from_dict(meta)
+        encoder: IncrementalInputEncoder = bundle.encoder
+        return (bundle.task,
+                InputData(arrays['train_input'], arrays['test_input'], encoder.scaler_,
+                          encoder.columns_, arrays['train_ids'], arrays['test_ids'],
+                          encoder.get_embedding_id_counts(), encoder),
+                OutputData(arrays['train_out'], arrays['test_out'], bundle.decoder))
+
+    def save(self, task: NetworkTaskType, data_in: InputData, data_out: OutputData,
+             output_cols: Sequence[str]) -> None:
+        meta: Dict[str, Any] = PreprocessingBundle(
+            task, data_in.encoder, list(output_cols), data_out.decoder).to_dict()
+
+        # Entry is written to temporary directory and renamed, so that interrupted run never
+        # leaves incomplete entry behind.
+        cache_dir = os.path.dirname(self.entry_dir_)
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=cache_dir)
+        try:
+            arrays = (data_in.train_input, data_in.test_input,
+                      data_out.train_out, data_out.test_out,
+                      data_in.train_ids, data_in.test_ids)
+            for name, array in zip(PreprocessingCache.ARRAYS, arrays):
+                if array is not None:
+                    save_array(tmp_dir, name, array)
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+            os.replace(tmp_dir, self.entry_dir_)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            # Other process may have stored the same entry in the meantime
+            if not os.path.exists(self.entry_dir_):
+                raise
+
+# ==================================================================================================
+#                                        STREAMED DATA
+# ==================================================================================================
+
+
+def expand_csv_files(pattern: str) -> List[str]:
+    ''' Returns sorted list of CSV files matching glob pattern (single file is a valid pattern). '''
+    files: List[str] = sorted(glob.glob(pattern))
+    if not files:
+        raise FileNotFoundError(f'No CSV file matches {pattern}')
+    return files
+
+
+def read_csv_files_chunks(files: Sequence[str], cols: Sequence[str], chunk_size: int,
+                          dtypes: Optional[Dict[str, Any]] = None) -> Iterator[pd.DataFrame]:
+    ''' Reads given columns of CSV files one after another in chunks of chunk_size rows. '''
+    for filename in files:
+        yield from pd.read_csv(filename, usecols=list(cols), dtype=dtypes, chunksize=chunk_size)
+
+
+@dataclass
+class StreamedInputData(InputData):
+    '''
+    InputData for samples that stay on disk. Arrays train_input and test_input are empty (with
+    correct feature count), only encoding and scaling fitted on training files are kept and applied
+    to each batch by tf.data pipeline. All categorical columns are one hot encoded.
+    '''
+
+    numeric_columns: List[str]  # Input columns used as they are
+    categories: Dict[str, List[str]]  # Categories of each one hot encoded input column
+    train_samples: int
+    test_samples: int
+
+    def get_training_sample_count(self) -> int:
+        return self.train_samples
+
+    def get_test_sample_count(self) -> int:
+        return self.test_samples
+
+    @staticmethod
+    def prepare_inputs(train_files: Sequence[str],
+                       test_files: Sequence[str],
+                       input_cols: Sequence[str],
+                       chunk_size: int) -> StreamedInputData:
+        # Column kinds are decided on first rows, fitting pass below reads categories as text
+        sample: pd.DataFrame = pd.read_csv(train_files[0], usecols=list(input_cols), nrows=chunk_size)
+        numeric_cols: List[str] = [col for col in input_cols if is_numeric(sample[col])]
+        categorical_cols: List[str] = [col for col in input_cols if col not in numeric_cols]
+
+        # Single pass fits encoding and scaling, categories are read as text so that they match
+        # strings produced by CSV reader of tf.data pipeline
+        encoder = IncrementalInputEncoder(numeric_cols, categorical_cols)
+        for chunk in read_csv_files_chunks(train_files, input_cols, chunk_size,
+                                           {col: str for col in categorical_cols}):
+            encoder.partial_fit(chunk)
+        scaler: StandardScaler = encoder.finalize()
+        train_samples: int = encoder.rows_
+        categories: Dict[str, List[str]] = encoder.categories_
+        columns: List[str] = encoder.columns_
+
+        test_samples = sum(chunk.shape[0] for chunk in
+                           read_csv_files_chunks(test_files, input_cols[:1], chunk_size))
+        empty: np.ndarray = np.empty((0, len(columns)), dtype=np.float32)
+        return StreamedInputData(train_input=empty,
+                                 test_input=empty,
+                                 scaler=scaler,
+                                 columns=columns,
+                                 train_ids=None,
+                                 test_ids=None,
+                                 embedding_ids={},
+                                 encoder=encoder,
+                                 numeric_columns=numeric_cols,
+                                 categories=categories,
+                                 train_samples=train_samples,
+                                 test_samples=test_samples)
+
+    def make_encoder(self, csv_columns: Sequence[str]) -> Callable[[Sequence[tf.Tensor]], tf.Tensor]:
+        ''' Returns function that turns batch of raw CSV columns into scaled network input. '''
+        numeric_idx: List[int] = [csv_columns.index(col) for col in self.numeric_columns]
+        lookups: List[Tuple[int, tf.lookup.StaticHashTable, int]] = []
+        for col, categories in self.categories.items():
+            table = tf.lookup.StaticHashTable(
+                tf.lookup.KeyValueTensorInitializer(tf.constant(categories, dtype=tf.string),
+                                                    tf.range(len(categories), dtype=tf.int64)),
+                default_value=-1)
+            lookups.append((csv_columns.index(col), table, len(categories)))
+        mean = tf.constant(self.scaler.mean_, dtype=tf.float32)
+        scale = tf.constant(self.scaler.scale_, dtype=tf.float32)
+
+        def encode(batch: Sequence[tf.Tensor]) -> tf.Tensor:
+            parts: List[tf.Tensor] = []
+            if numeric_idx:
+                parts.append(tf.stack([tf.cast(batch[idx], tf.float32) for idx in numeric_idx],
+                                      axis=1))
+            # Unknown categories get index -1 which one_hot turns into all zeros
+            for idx, table, depth in lookups:
+                parts.append(tf.one_hot(table.lookup(batch[idx]), depth, dtype=tf.float32))
+            return (tf.concat(parts, axis=1) - mean) / scale
+        return encode
+
+
+@dataclass
+class StreamedOutputData(OutputData):
+    '''
+    OutputData for samples that stay on disk. Encoding is given by categories of TargetSummary,
+    train_out and test_out are empty arrays with correct output size.
+    '''
+
+    output_columns: List[str]
+    task: NetworkTaskType
+    categories: List[str]  # Class names for classification, empty for regression
+
+    @staticmethod
+    def prepare_outputs(target_summary: TargetSummary,
+                        output_cols: Sequence[str],
+                        task: NetworkTaskType) -> StreamedOutputData:
+        if task == NetworkTaskType.REGRESSION:
+            empty: np.ndarray = np.empty((0, len(output_cols)), dtype=np.float32)
+            return StreamedOutputData(empty, empty, None, list(output_cols), task, [])
+
+        if len(output_cols) > 1:
+            raise ValueError(
+                'Classification task cannot have more than one output column.')
+        out_col = output_cols[0]
+        categories: List[str] = target_summary.get_categories()
+        decoder: BinaryCategoryDecoder | OneHotCategoryDecoder
+        if len(categories) == 2:
+            empty = np.empty((0, 1), dtype=np.float32)
+            decoder = BinaryCategoryDecoder(BinaryEncodedData(
+                data=empty, category=(categories[0], categories[1]), name=out_col))
+        else:
+            empty = np.empty((0, len(categories)), dtype=np.float32)
+            encoding_columns: List[str] = [f'{out_col}_{category}' for category in categories]
+            decoder = OneHotCategoryDecoder(OneHotEncodedData(
+                data=pd.DataFrame(columns=encoding_columns),
+                encoding_columns=encoding_columns,
+                categorical_columns=[out_col]))
+        return StreamedOutputData(empty, empty, decoder, list(output_cols), task, categories)
+
+    def make_encoder(self, csv_columns: Sequence[str]) -> Callable[[Sequence[tf.Tensor]], tf.Tensor]:
+        ''' Returns function that turns batch of raw CSV columns into network targets. '''
+        indexes: List[int] = [csv_columns.index(col) for col in self.output_columns]
+        if self.task == NetworkTaskType.REGRESSION:
+            return lambda batch: tf.stack([tf.cast(batch[idx], tf.float32) for idx in indexes],
+                                          axis=1)
+
+        table = tf.lookup.StaticHashTable(
+            tf.lookup.KeyValueTensorInitializer(tf.constant(self.categories, dtype=tf.string),
+                                                tf.range(len(self.categories), dtype=tf.int64)),
+            default_value=-1)
+        if len(self.categories) == 2:
+            return lambda batch: tf.cast(table.lookup(batch[indexes[0]]), tf.float32)[:, tf.newaxis]
+        depth = len(self.categories)
+        return lambda batch: tf.one_hot(table.lookup(batch[indexes[0]]), depth, dtype=tf.float32)
+
+    def csv_column_types(self) -> Dict[str, tf.DType]:
+        if self.task == NetworkTaskType.REGRESSION:
+            return {col: tf.float32 for col in self.output_columns}
+        return {col: tf.string for col in self.output_columns}
+
+
+def make_streamed_dataset(files: Sequence[str],
+                          data_in: StreamedInputData,
+                          data_out: StreamedOutputData,
+                          skip: int,
+                          take: int,
+                          batch_size: int,
+                          shuffle_buffer: Optional[int]) -> tf.data.Dataset:
+    '''
+    Builds tf.data pipeline that reads samples skip..skip+take of CSV files (shards are interleaved
+    in deterministic order), shuffles them if shuffle_buffer is given, batches them and encodes
+    each batch in parallel while previous batches are consumed by training. Dataset repeats
+    forever, each pass has get_streamed_steps(take, batch_size) batches.
+    '''
+    # All shards must share the header, only used columns are parsed
+    header: List[str] = list(pd.read_csv(files[0], nrows=0).columns)
+    column_types: Dict[str, tf.DType] = {col: tf.float32 for col in data_in.numeric_columns}
+    column_types.update({col: tf.string for col in data_in.categories})
+    column_types.update(data_out.csv_column_types())
+    selected: List[int] = sorted(header.index(col) for col in column_types)
+    csv_columns: List[str] = [header[idx] for idx in selected]
+    defaults: List[Any] = [tf.constant(float('nan')) if column_types[col] == tf.float32
+                           else tf.constant('') for col in csv_columns]
+
+    dataset = tf.data.Dataset.from_tensor_slices(list(files)).interleave(
+        lambda filename: tf.data.experimental.CsvDataset(filename, defaults, header=True,
+                                                         select_cols=selected),
+        cycle_length=min(len(files), os.cpu_count() or 1),
+        num_parallel_calls=tf.data.AUTOTUNE,
+        deterministic=True)
+    dataset = dataset.skip(skip).take(take)
+    if shuffle_buffer:
+        dataset = dataset.shuffle(shuffle_buffer, reshuffle_each_iteration=True)
+    encode_in = data_in.make_encoder(csv_columns)
+    encode_out = data_out.make_encoder(csv_columns)
+    # Repeated after batching so that no batch mixes two passes, shuffle buffer is reshuffled on
+    # each pass
+    return dataset.batch(batch_size) \
+        .map(lambda *batch: (encode_in(batch), encode_out(batch)),
+             num_parallel_calls=tf.data.AUTOTUNE) \
+        .repeat() \
+        .prefetch(tf.data.AUTOTUNE)
+
+
+def get_streamed_steps(sample_count: int, batch_size: int) -> int:
+    ''' Number of batches in one pass of dataset made by make_streamed_dataset. '''
+    return max(1, int(math.ceil(sample_count / batch_size)))
+
 # ==================================================================================================
 #                                        NETWORK MODEL
 # ==================================================================================================
 
 
+@dataclass(frozen=True)
+class NetworkHyperparameters:
+    ''' Settings of network and its training, None values are inferred from data. '''
+    layer_sizes: Tuple[int, ...] | None = None  # Sizes of hidden layers
+    learning_rate: float = LEARNING_RATE
+    dropout: float = 0.1
+    batch_size: int | None = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'layer_sizes': None if self.layer_sizes is None else list(self.layer_sizes),
+                'learning_rate': self.learning_rate,
+                'dropout': self.dropout,
+                'batch_size': self.batch_size}
+
+
+@dataclass(frozen=True)
+class PerformanceOptions:
+    ''' How training is executed, these settings do not change the network itself. '''
+    # Compile training step with XLA, 'auto' leaves decision to Keras. Ignored for sparse inputs.
+    jit_compile: bool | str = 'auto'
+    steps_per_execution: int = 1  # Training steps run by one call of compiled function
+    bfloat16: bool = False  # Hidden layers compute in bfloat16, weights stay float32
+    tune_batch_size: bool = False  # Batch size (if not given) is chosen by measured throughput
+
+    @staticmethod
+    def for_cpu() -> PerformanceOptions:
+        return PerformanceOptions(jit_compile=True,
+                                  steps_per_execution=DEFAULT_STEPS_PER_EXECUTION,
+                                  bfloat16=cpu_supports_bfloat16(),
+                                  tune_batch_size=True)
+
+
+def make_epoch_timer() -> krs.callbacks.Callback:
+    ''' Callback recording duration of each epoch in seconds (in its durations attribute). '''
+
+    # Class is defined on call, so that Keras is not imported with this module
+    class EpochTimer(krs.callbacks.Callback):
+        def __init__(self):
+            super().__init__()
+            self.durations: List[float] = []
+            self.start_: float = 0.0
+
+        def on_epoch_begin(self, epoch, logs=None):
+            self.start_ = time.perf_counter()
+
+        def on_epoch_end(self, epoch, logs=None):
+            self.durations.append(time.perf_counter() - self.start_)
+
+    return EpochTimer()
+
+
+def make_metrics_logger(path: str, train_count: int, batch_size: int) -> krs.callbacks.Callback:
+    '''
+    Callback appending one JSON line per epoch to path: Keras metrics, training and validation
+    seconds, training throughput and mean step time. Line is flushed right after epoch ends.
+    '''
+    steps: int = max(1, math.ceil(train_count / batch_size))
+
+    class MetricsLogger(krs.callbacks.Callback):
+        def __init__(self):
+            super().__init__()
+            self.file_: Any = None
+            self.epoch_start_: float = 0.0
+            self.validation_start_: float = 0.0
+            self.validation_seconds_: float = 0.0
+
+        def on_train_begin(self, logs=None):
+            self.file_ = open(path, 'a', buffering=1)
+
+        def on_epoch_begin(self, epoch, logs=None):
+            self.epoch_start_ = time.perf_counter()
+            self.validation_seconds_ = 0.0
+
+        def on_test_begin(self, logs=None):
+            self.validation_start_ = time.perf_counter()
+
+        def on_test_end(self, logs=None):
+            self.validation_seconds_ += time.perf_counter() - self.validation_start_
+
+        def on_epoch_end(self, epoch, logs=None):
+            epoch_seconds: float = time.perf_counter() - self.epoch_start_
+            train_seconds: float = epoch_seconds - self.validation_seconds_
+            record: Dict[str, Any] = {'epoch': epoch + 1,
+                                      'time': datetime.now().isoformat(timespec='seconds')}
+            record.update({name: float(value) for name, value in (logs or {}).items()})
+            record.update({'epoch_seconds': epoch_seconds,
+                           'train_seconds': train_seconds,
+                           'validation_seconds': self.validation_seconds_,
+                           'samples_per_second': train_count / train_seconds,
+                           'step_seconds': train_seconds / steps})
+            self.file_.write(json.dumps(record) + '\n')
+
+        def on_train_end(self, logs=None):
+            self.file_.close()
+
+    return MetricsLogger()
+
+
+def make_training_profiler(trace_dir: Optional[str] = None,
+                           trace_steps: Optional[Tuple[int, int]] = None) -> krs.callbacks.Callback:
+    '''
+    Callback measuring where time of each epoch goes. Epoch time is split into training steps
+    (one step runs steps_per_execution batches), validation, time spent in other callbacks (with
+    ModelCheckpoint writes reported on their own) and other time, which is the rest of time
+    between steps, mostly Keras bookkeeping (and retracing). Batches are fetched inside of steps,
+    time spent waiting for them (part of step time) is measured for datasets passed through
+    time_input method, it is None for arrays that Keras batches on its own.
+    Profiler must be the last callback and other callbacks must be wrapped by its wrap method.
+    TensorFlow profiler trace of trace_steps (first and last, counted from 1 across epochs) is
+    written to trace_dir. Results are returned by get_summary method.
+    '''
+
+    class ProfiledCallback(krs.callbacks.Callback):
+        ''' Calls wrapped callback and reports time spent in it to profiler. '''
+
+        def __init__(self, callback: krs.callbacks.Callback, profiler: Any):
+            super().__init__()
+            self.callback_ = callback
+            self.profiler_ = profiler
+            self.name_: str = type(callback).__name__
+            self.is_checkpoint_: bool = isinstance(callback, krs.callbacks.ModelCheckpoint)
+
+        def set_model(self, model):
+            super().set_model(model)
+            self.callback_.set_model(model)
+
+        def set_params(self, params):
+            super().set_params(params)
+            self.callback_.set_params(params)
+
+        def call_(self, hook: str, *args: Any) -> None:
+            start: float = time.perf_counter()
+            getattr(self.callback_, hook)(*args)
+            self.profiler_.add_callback_time_(self.name_, self.is_checkpoint_,
+                                              time.perf_counter() - start)
+
+        def on_train_begin(self, logs=None):
+            self.call_('on_train_begin', logs)
+
+        def on_train_end(self, logs=None):
+            self.call_('on_train_end', logs)
+
+        def on_epoch_begin(self, epoch, logs=None):
+            self.call_('on_epoch_begin', epoch, logs)
+
+        def on_epoch_end(self, epoch, logs=None):
+            self.call_('on_epoch_end', epoch, logs)
+
+        def on_train_batch_begin(self, batch, logs=None):
+            self.call_('on_train_batch_begin', batch, logs)
+
+        def on_train_batch_end(self, batch, logs=None):
+            self.call_('on_train_batch_end', batch, logs)
+
+        def on_test_begin(self, logs=None):
+            self.call_('on_test_begin', logs)
+
+        def on_test_end(self, logs=None):
+            self.call_('on_test_end', logs)
+
+        def on_test_batch_begin(self, batch, logs=None):
+            self.call_('on_test_batch_begin', batch, logs)
+
+        def on_test_batch_end(self, batch, logs=None):
+            self.call_('on_test_batch_end', batch, logs)
+
+    class TrainingProfiler(krs.callbacks.Callback):
+        def __init__(self):
+            super().__init__()
+            self.epochs_: List[Dict[str, Any]] = []
+            self.epoch_: Dict[str, Any] | None = None  # Profile of running epoch
+            self.outside_epochs_: Dict[str, float] = {}  # Callback seconds outside of epochs
+            self.callback_clock_: float = 0.0  # Seconds spent in wrapped callbacks so far
+            self.step_: int = 0  # Training steps started in all epochs
+            self.step_durations_: List[float] = []  # Seconds of steps of running epoch
+            self.all_step_durations_: List[float] = []
+            self.epoch_start_: float = 0.0
+            self.step_start_: Tuple[float, float] = (0.0, 0.0)  # Time and callback clock
+            self.validation_start_: Tuple[float, float] = (0.0, 0.0)
+            self.tracing_: bool = False
+            self.traced_: bool = False
+            self.input_timed_: bool = False  # Training input was passed through time_input
+            self.input_clock_: float = 0.0  # Seconds spent waiting for training batches so far
+            self.epoch_input_start_: float = 0.0
+
+        def wrap(self, callback: krs.callbacks.Callback) -> krs.callbacks.Callback:
+            return ProfiledCallback(callback, self)
+
+        def time_input(self, dataset: tf.data.Dataset) -> tf.data.Dataset:
+            '''
+            Dataset with batches of given one, time spent waiting for each batch is input wait.
+            Batches pass through Python generator, which adds small overhead to every step.
+            '''
+            self.input_timed_ = True
+
+            def generate():
+                iterator = iter(dataset)
+                while True:
+                    start: float = time.perf_counter()
+                    try:
+                        batch = next(iterator)
+                    except StopIteration:
+                        return
+                    self.input_clock_ += time.perf_counter() - start
+                    yield batch
+
+            return tf.data.Dataset.from_generator(generate, output_signature=dataset.element_spec)
+
+        def add_callback_time_(self, name: str, is_checkpoint: bool, seconds: float) -> None:
+            self.callback_clock_ += seconds
+            target: Dict[str, float] = (self.outside_epochs_ if self.epoch_ is None
+                                        else self.epoch_['callback_seconds'])
+            target[name] = target.get(name, 0.0) + seconds
+            if is_checkpoint and self.epoch_ is not None:
+                self.epoch_['checkpoint_seconds'] += seconds
+
+        def elapsed_(self, start: Tuple[float, float]) -> float:
+            ''' Seconds since start, time spent in wrapped callbacks is not included. '''
+            return time.perf_counter() - start[0] - (self.callback_clock_ - start[1])
+
+        def on_epoch_begin(self, epoch, logs=None):
+            self.epoch_ = {'epoch': epoch + 1, 'callback_seconds': {}, 'checkpoint_seconds': 0.0,
+                           'validation_seconds': 0.0}
+            self.step_durations_ = []
+            self.epoch_input_start_ = self.input_clock_
+            self.epoch_start_ = time.perf_counter()
+
+        def on_train_batch_begin(self, batch, logs=None):
+            self.step_ += 1
+            if trace_steps and trace_dir and self.step_ == trace_steps[0]:
+                tf.profiler.experimental.start(trace_dir)
+                self.tracing_ = self.traced_ = True
+            self.step_start_ = (time.perf_counter(), self.callback_clock_)
+
+        def on_train_batch_end(self, batch, logs=None):
+            self.step_durations_.append(self.elapsed_(self.step_start_))
+            if self.tracing_ and trace_steps and self.step_ >= trace_steps[1]:
+                self.stop_trace_()
+
+        def on_test_begin(self, logs=None):
+            self.validation_start_ = (time.perf_counter(), self.callback_clock_)
+
+        def on_test_end(self, logs=None):
+            if self.epoch_ is not None:
+                self.epoch_['validation_seconds'] += self.elapsed_(self.validation_start_)
+
+        def on_epoch_end(self, epoch, logs=None):
+            if self.epoch_ is None:
+                return
+            profile: Dict[str, Any] = self.epoch_
+            steps: np.ndarray = np.asarray(self.step_durations_)
+            profile['epoch_seconds'] = time.perf_counter() - self.epoch_start_
+            profile['steps'] = int(steps.size)
+            profile['step_seconds'] = float(steps.sum())
+            if steps.size:
+                profile['step_ms'] = get_percentile_summary(steps * 1000.0)
+                profile['step_histogram_ms'] = get_power_of_two_histogram(steps * 1000.0)
+            profile['callbacks_seconds'] = sum(profile['callback_seconds'].values())
+            profile['input_wait_seconds'] = (self.input_clock_ - self.epoch_input_start_
+                                             if self.input_timed_ else None)
+            profile['other_seconds'] = max(0.0, profile['epoch_seconds'] -
+                                           profile['step_seconds'] -
+                                           profile['validation_seconds'] -
+                                           profile['callbacks_seconds'])
+            self.epochs_.append(profile)
+            self.all_step_durations_.extend(self.step_durations_)
+            self.epoch_ = None
+
+        def on_train_end(self, logs=None):
+            if self.tracing_:
+                self.stop_trace_()
+
+        def stop_trace_(self) -> None:
+            tf.profiler.experimental.stop()
+            self.tracing_ = False
+
+        def get_summary(self) -> Dict[str, Any]:
+            totals: Dict[str, Any] = {
+                name: sum(epoch[name] for epoch in self.epochs_)
+                for name in ('epoch_seconds', 'steps', 'step_seconds', 'validation_seconds',
+                             'callbacks_seconds', 'checkpoint_seconds', 'other_seconds')}
+            totals['input_wait_seconds'] = (
+                sum(epoch['input_wait_seconds'] for epoch in self.epochs_)
+                if self.input_timed_ else None)
+            steps: np.ndarray = np.asarray(self.all_step_durations_)
+            if steps.size:
+                totals['step_ms'] = get_percentile_summary(steps * 1000.0)
+                totals['step_histogram_ms'] = get_power_of_two_histogram(steps * 1000.0)
+            return {'epochs': self.epochs_,
+                    'total': totals,
+                    'input_wait_note': (None if self.input_timed_ else
+                                        'Input wait is measured only for streamed data, arrays '
+                                        'in memory are batched by Keras inside of steps.'),
+                    'callback_seconds_outside_epochs': self.outside_epochs_,
+                    'trace_dir': trace_dir if self.traced_ else None}
+
+    return TrainingProfiler()
+
+
+def format_profile_summary(summary: Dict[str, Any]) -> str:
+    '''
+    Table with one row per epoch and total row, times are in seconds. Input wait is part of step
+    time, it is shown as - if it was not measured.
+    '''
+    header: str = (f'{"epoch":>6} {"total":>8} {"steps":>6} {"step":>8} {"p50 ms":>8} '
+                   f'{"p90 ms":>8} {"max ms":>8} {"input":>8} {"other":>8} {"callback":>8} '
+                   f'{"checkpt":>8} {"valid":>8}')
+    lines: List[str] = ['Training profile', header]
+    for name, row in ([(str(epoch['epoch']), epoch) for epoch in summary['epochs']] +
+                      [('total', summary['total'])]):
+        step_ms: Dict[str, float] = row.get('step_ms', {'p50': 0.0, 'p90': 0.0, 'max': 0.0})
+        input_wait: str = ('-' if row['input_wait_seconds'] is None
+                           else f'{row["input_wait_seconds"]:.3f}')
+        lines.append(f'{name:>6} {row["epoch_seconds"]:8.3f} {row["steps"]:6d} '
+                     f'{row["step_seconds"]:8.3f} {step_ms["p50"]:8.2f} {step_ms["p90"]:8.2f} '
+                     f'{step_ms["max"]:8.2f} {input_wait:>8} {row["other_seconds"]:8.3f} '
+                     f'{row["callbacks_seconds"]:8.3f} {row["checkpoint_seconds"]:8.3f} '
+                     f'{row["validation_seconds"]:8.3f}')
+    if summary['input_wait_note']:
+        lines.append(summary['input_wait_note'])
+    if summary['trace_dir']:
+        lines.append(f'TensorFlow profiler trace saved to {summary["trace_dir"]}')
+    return '\n'.join(lines)
+
+
 class NeuralNetwork:
 
     data_in: InputData
     data_out: OutputData
     task: NetworkTaskType
+    hyperparameters: NetworkHyperparameters
     model: krs.Model
     history: None | krs.callbacks.History
 
-    def __init__(self, data_in: InputData, data_out: OutputData, task: NetworkTaskType):
+    def __init__(self, data_in: InputData, data_out: OutputData, task: NetworkTaskType,
+                 hyperparameters: NetworkHyperparameters = NetworkHyperparameters(),
+                 performance: PerformanceOptions = PerformanceOptions()):
         self.data_in = data_in
         self.data_out = data_out
         self.task = task
+        self.hyperparameters = hyperparameters
+        self.performance = performance
+        self.tuned_batch_size: int | None = None
         self.history = None
 
-        # We infer network architecture based on traning data size
+        # We create input layer, sparse input is used as it is by first dense layer
         feature_count = data_in.get_feature_count()
+        input_layer = krs.Input(shape=(feature_count,), sparse=data_in.is_sparse(), name='inputs')
+        inputs: krs.KerasTensor | Dict[str, krs.KerasTensor] = input_layer
+        last_layer = input_layer
+
+        # Embedded columns get one id input each, their embeddings are appended to other features
+        if data_in.embedding_ids:
+            ids_layer = krs.Input(shape=(len(data_in.embedding_ids),), dtype='int32', name='ids')
+            inputs = {'inputs': input_layer, 'ids': ids_layer}
+            embedded: List[krs.KerasTensor] = []
+            for idx, id_count in enumerate(data_in.embedding_ids.values()):
+                embedding = krs.layers.Embedding(id_count, get_embedding_size(id_count),
+                                                 name=f'embedding_{idx}')(ids_layer[:, idx])
+                embedded.append(embedding)
+            last_layer = krs.layers.Concatenate(name='features')([input_layer] + embedded)
+
+        # We infer network architecture based on traning data size
         sample_count = data_in.get_training_sample_count()
         output_size = data_out.get_output_size()
-        layer_sizes = NeuralNetwork.infer_architecture_from_data(
-            sample_count, feature_count)
-
-        # We create input layer
-        input_layer = krs.Input(shape=(feature_count,), name='inputs')
+        layer_sizes = (list(hyperparameters.layer_sizes) if hyperparameters.layer_sizes
+                       else NeuralNetwork.infer_architecture_from_data(
+                           sample_count, NeuralNetwork.get_input_width(data_in)))
 
         # Now we chain input and hidden layers, each hidden layer will have a
-        # corresponding dropout and batch normalization
-        last_layer = input_layer
+        # corresponding dropout and batch normalization. Output layer always computes in float32,
+        # so that loss is not affected by reduced precision.
+        hidden_dtype: str | None = 'mixed_bfloat16' if performance.bfloat16 else None
         for layer_id, layer_size in enumerate(layer_sizes, start=1):
-            last_layer = Dense(layer_size,
-                               activation='relu',
-                               name=f'dense_{layer_id}')(last_layer)
-            last_layer = BatchNormalization(
+            last_layer = krs.layers.Dense(layer_size,
+                                          activation='relu',
+                                          dtype=hidden_dtype,
+                                          name=f'dense_{layer_id}')(last_layer)
+            last_layer = krs.layers.BatchNormalization(
+                dtype=hidden_dtype,
                 name=f'batch_norm_{layer_id}')(last_layer)
-            last_layer = Dropout(0.1, name=f'dropout_{layer_id}')(last_layer)
+            last_layer = krs.layers.Dropout(hyperparameters.dropout,
+                                            name=f'dropout_{layer_id}')(last_layer)
 
         # Finally we add an output layer
         activation: str = {NetworkTaskType.REGRESSION: 'linear',
@@ -541,40 +2374,160 @@ class NeuralNetwork:
         metrics: List[Any] = {NetworkTaskType.REGRESSION: ['mae'],
                               NetworkTaskType.BINARY_CLASSIFICATION: ['accuracy', krs.metrics.AUC(name='auc')],
                               NetworkTaskType.MULTICLASS_CLASSIFICATION: ['accuracy']}[task]
-        output_layer = Dense(output_size, activation,
-                             name='output')(last_layer)
+        output_layer = krs.layers.Dense(output_size, activation,
+                                        name='output')(last_layer)
 
         self.model = krs.Model(
-            inputs=input_layer, outputs=output_layer, name='generic_ffn')
-        self.model.compile(optimizer=krs.optimizers.Adam(learning_rate=LEARNING_RATE),  # type: ignore
+            inputs=inputs, outputs=output_layer, name='generic_ffn')
+        # XLA has no kernels for sparse inputs, such networks are run without it
+        self.model.compile(optimizer=krs.optimizers.Adam(learning_rate=hyperparameters.learning_rate),  # type: ignore
                            loss=loss,
-                           metrics=metrics)
-
-    def train(self, model_out: str, validation_split: float, epochs: int) -> None:
+                           metrics=metrics,
+                           jit_compile=False if data_in.is_sparse() else performance.jit_compile,
+                           steps_per_execution=performance.steps_per_execution)
+
+    def train(self,
+              model_out: str,
+              validation_split: float,
+              epochs: int,
+              train_files: Optional[Sequence[str]] = None,
+              shuffle_buffer: int = DEFAULT_SHUFFLE_BUFFER,
+              validation_count: Optional[int] = None,
+              metrics_out: Optional[str] = None,
+              profiler: Optional[krs.callbacks.Callback] = None) -> None:
+        '''
+        For streamed data train_files must list CSV files used to prepare data. Last
+        validation_count training rows (see split_training_data) are used for validation, if it
+        is not given validation_split of rows is taken from the end of data. Metrics of each
+        epoch are appended to metrics_out JSON Lines file as soon as epoch ends. Profiler (see
+        make_training_profiler) measures time of training steps and of all other callbacks.
+        '''
         if self.history:
             raise ValueError(f'Attempting to train already trained network, '
                              'this functionality is not provided by this implementation')
         callbacks: List[krs.callbacks.Callback] = [
-            ReduceLROnPlateau(monitor='val_loss', factor=0.5,
-                              patience=0, verbose=0, min_lr=MIN_LEARNING_RATE,),
-            EarlyStopping(monitor='val_loss', patience=10, restore_best_weights=True, verbose=0),
-            ModelCheckpoint(monitor='val_loss', filepath=model_out, save_best_only=True, verbose=0)
+            krs.callbacks.ReduceLROnPlateau(monitor='val_loss', factor=0.5,
+                                            patience=0, verbose=0, min_lr=MIN_LEARNING_RATE,),
+            krs.callbacks.EarlyStopping(monitor='val_loss', patience=10,
+                                        restore_best_weights=True, verbose=0),
+            krs.callbacks.ModelCheckpoint(monitor='val_loss', filepath=model_out,
+                                          save_best_only=True, verbose=0)
         ]
-        batch_size = NeuralNetwork.get_reasonable_batch_size(self.data_in.get_training_sample_count())
-        self.history = self.model.fit(self.data_in.train_input,
-                                      self.data_out.train_out,
-                                      validation_split=validation_split,
+        batch_size = self.get_batch_size()
+        sample_count = self.data_in.get_training_sample_count()
+        if validation_count is None:
+            validation_count = sample_count - int(math.ceil(sample_count * (1.0 - validation_split)))
+        train_count = sample_count - validation_count
+        if metrics_out:
+            callbacks.append(make_metrics_logger(metrics_out, train_count, batch_size))
+        if profiler:
+            callbacks = [profiler.wrap(callback) for callback in callbacks] + [profiler]
+        if isinstance(self.data_in, StreamedInputData) and isinstance(self.data_out, StreamedOutputData):
+            if not train_files:
+                raise ValueError('Training files are required to train on streamed data.')
+            # Same split as Keras validation_split, last part of data is used for validation
+            train_dataset = make_streamed_dataset(train_files, self.data_in, self.data_out, 0,
+                                                  train_count, batch_size, shuffle_buffer)
+            if profiler:
+                train_dataset = profiler.time_input(train_dataset)
+            validation_dataset = make_streamed_dataset(train_files, self.data_in, self.data_out,
+                                                       train_count, validation_count,
+                                                       batch_size, None)
+            # Datasets repeat, so epoch length must be given. Samples are shuffled by dataset,
+            # shuffle of Keras (on by default) does not apply to it and only warns.
+            self.history = self.model.fit(
+                train_dataset,
+                validation_data=validation_dataset,
+                epochs=epochs,
+                steps_per_epoch=get_streamed_steps(train_count, batch_size),
+                validation_steps=get_streamed_steps(validation_count, batch_size),
+                callbacks=callbacks,
+                shuffle=False)
+            return
+        train_rows = slice(0, train_count)
+        validation_rows = slice(train_count, sample_count)
+        self.history = self.model.fit(self.data_in.get_train_inputs(train_rows),
+                                      self.data_out.train_out[train_rows],
+                                      validation_data=(self.data_in.get_train_inputs(validation_rows),
+                                                       self.data_out.train_out[validation_rows]),
                                       epochs=epochs,
                                       batch_size=batch_size,
                                       callbacks=callbacks,
                                       shuffle=True
                                       )
 
+    def get_batch_size(self) -> int:
+        if self.hyperparameters.batch_size:
+            return self.hyperparameters.batch_size
+        sample_count: int = self.data_in.get_training_sample_count()
+        # Streamed data cannot be sliced for probing, reasonable size is used for it
+        if not self.performance.tune_batch_size or isinstance(self.data_in, StreamedInputData):
+            return NeuralNetwork.get_reasonable_batch_size(sample_count)
+        if self.tuned_batch_size is None:
+            self.tuned_batch_size = self.tune_batch_size_(sample_count)
+        return self.tuned_batch_size
+
+    def tune_batch_size_(self, sample_count: int) -> int:
+        '''
+        Trains copy of the model on beginning of training data with each candidate batch size and
+        returns smallest one whose throughput is close to the best, as smaller batches usually
+        generalize better. First epoch of each candidate is not timed as it includes tracing.
+        '''
+        candidates: List[int] = NeuralNetwork.get_batch_size_candidates(sample_count)
+        probe_count: int = min(sample_count, candidates[-1] * BATCH_SIZE_PROBE_STEPS)
+        inputs = self.data_in.get_train_inputs(slice(0, probe_count))
+        outputs = self.data_out.train_out[:probe_count]
+        probe: krs.Model = krs.models.clone_model(self.model)
+        probe.compile(optimizer=krs.optimizers.Adam(),  # type: ignore
+                      loss=self.model.loss,
+                      jit_compile=self.model.jit_compile,
+                      steps_per_execution=self.performance.steps_per_execution)
+        throughputs: List[float] = []
+        for batch_size in candidates:
+            timer = make_epoch_timer()
+            probe.fit(inputs, outputs, batch_size=batch_size, epochs=2, callbacks=[timer],
+                      shuffle=False, verbose=0)  # type: ignore
+            throughputs.append(probe_count / timer.durations[-1])
+        best: float = max(throughputs)
+        chosen: int = next(batch_size for batch_size, throughput in zip(candidates, throughputs)
+                           if throughput >= BATCH_SIZE_THROUGHPUT_TOLERANCE * best)
+        print('Batch size throughput (samples/s) : ' +
+              ', '.join(f'{batch_size}: {throughput:.0f}'
+                        for batch_size, throughput in zip(candidates, throughputs)))
+        print(f'Chosen batch size : {chosen}')
+        return chosen
+
     def get_history(self)-> krs.callbacks.History:
         if self.history:
             return self.history
         raise ValueError('Attempted to acces history before training network.')
 
+    def save_history_plot(self, path: str) -> None:
+        '''
+        Renders all metrics into single image with one panel per metric. Figure is drawn by Agg
+        canvas directly, no window or display is needed.
+        '''
+        if not self.history:
+            raise ValueError('Attempted to acces history before training network.')
+        history_dict = self.history.history
+        metrics = [m for m in history_dict.keys() if not m.startswith('val_')]
+        columns: int = min(3, len(metrics))
+        rows: int = int(math.ceil(len(metrics) / columns))
+        figure = matplotlib_figure.Figure(figsize=(6 * columns, 4 * rows))
+        backend_agg.FigureCanvasAgg(figure)
+        for idx, metric in enumerate(metrics, start=1):
+            axes = figure.add_subplot(rows, columns, idx)
+            axes.plot(history_dict[metric], label=f'Train {metric}')
+            if f'val_{metric}' in history_dict:
+                axes.plot(history_dict[f'val_{metric}'], label=f'Validation {metric}')
+            axes.set_xlabel('Epochs')
+            axes.set_ylabel(metric.capitalize())
+            axes.set_title(f'Training and Validation {metric.capitalize()}')
+            axes.legend()
+            axes.grid(True)
+        figure.tight_layout()
+        figure.savefig(path)
+
     def plot_history(self):
         if not self.history:
             raise ValueError('Attempted to acces history before training network.')
@@ -600,6 +2553,18 @@ class NeuralNetwork:
     def get_reasonable_batch_size(sample_count: int) -> int:
         return int(max(32, min(256, sample_count//20)))
 
+    @staticmethod
+    def get_input_width(data_in: InputData) -> int:
+        ''' Number of features entering first hidden layer, including embedding vectors. '''
+        return data_in.get_feature_count() + sum(get_embedding_size(id_count)
+                                                 for id_count in data_in.embedding_ids.values())
+
+    @staticmethod
+    def get_batch_size_candidates(sample_count: int) -> List[int]:
+        ''' Largest candidate still leaves at least 20 updates per epoch. '''
+        limit: int = max(BATCH_SIZE_CANDIDATES[0], sample_count//20)
+        return [batch_size for batch_size in BATCH_SIZE_CANDIDATES if batch_size <= limit]
+
     @staticmethod
     def infer_architecture_from_data(sample_count: int, feature_count: int) -> List[int]:
         # For small data there is no reason for complex networks, we will use smalles one possible.
@@ -622,38 +2587,677 @@ class NeuralNetwork:
 
 
 # ==================================================================================================
-#                                           MAIN
+#                                    HYPERPARAMETER SEARCH
 # ==================================================================================================
 
+SEARCH_BATCH_SIZES: Final[Tuple[int, ...]] = (32, 64, 128, 256, 512, 1024)
+SEARCH_DROPOUTS: Final[Tuple[float, ...]] = (0.0, 0.1, 0.2, 0.3)
+SEARCH_LEARNING_RATE_EXPONENTS: Final[Tuple[float, float]] = (-4.0, -2.0)
+SEARCH_REDUCTION_FACTOR: Final[int] = 3  # Part of trials (1/factor) that advances to next rung
+
+
+def sample_hyperparameters(count: int, seed: int) -> List[NetworkHyperparameters]:
+    ''' First candidate is default setting (inferred from data), others are drawn at random. '''
+    rng = np.random.default_rng(seed)
+    candidates: List[NetworkHyperparameters] = [NetworkHyperparameters()]
+    min_exponent: int = int(math.log2(MIN_LAYER_SIZE))
+    max_exponent: int = int(math.log2(MAX_LAYER_SIZE))
+    attempts: int = 0
+    while len(candidates) < count and attempts < 100 * count:
+        attempts += 1
+        # Consecutive layers are halved, same as in inferred architecture
+        first_size: int = 2 ** int(rng.integers(min_exponent, max_exponent + 1))
+        layer_count: int = int(rng.integers(1, MAX_LAYER_COUNT + 1))
+        candidate = NetworkHyperparameters(
+            layer_sizes=tuple(max(MIN_LAYER_SIZE, first_size >> idx) for idx in range(layer_count)),
+            learning_rate=float(10 ** rng.uniform(*SEARCH_LEARNING_RATE_EXPONENTS)),
+            dropout=float(rng.choice(SEARCH_DROPOUTS)),
+            batch_size=int(rng.choice(SEARCH_BATCH_SIZES)))
+        if candidate not in candidates:
+            candidates.append(candidate)
+    return candidates
 
-def main(argv: Optional[Sequence[str]] = None) -> None:
-    cfg: Config = Config.from_args()
 
-    # Reading data
-    train_dataframe: pd.DataFrame = pd.read_csv(cfg.train_csv)
-    test_dataframe: pd.DataFrame = pd.read_csv(cfg.test_csv)
+@dataclass
+class SearchData:
+    '''
+    Preprocessed training data stored in directory. Only this description is sent to workers,
+    which memory map arrays instead of receiving pickled copies.
+    '''
+    data_dir: str
+    task: NetworkTaskType
+    encoder: IncrementalInputEncoder
+    validation_count: int  # Last rows of training data used for validation
+    seed: int
 
-    # Checking for missing columns
-    try:
-        check_for_missing_columns(
-            train_dataframe, cfg.input_cols, cfg.train_csv)
-        check_for_missing_columns(
-            train_dataframe, cfg.output_cols, cfg.train_csv)
-        check_for_missing_columns(
-            test_dataframe, cfg.input_cols, cfg.test_csv)
-        check_for_missing_columns(
-            test_dataframe, cfg.output_cols, cfg.test_csv)
-    except KeyError as err:
-        panic(f'Missing columns found - {err}')
+    ARRAYS: ClassVar[Tuple[str, ...]] = ('train_input', 'train_ids', 'train_out')
+
+    @staticmethod
+    def store(data_dir: str, task: NetworkTaskType, data_in: InputData, data_out: OutputData,
+              validation_count: int, seed: int) -> SearchData:
+        for name, array in zip(SearchData.ARRAYS,
+                               (data_in.train_input, data_in.train_ids, data_out.train_out)):
+            if array is not None:
+                save_array(data_dir, name, array)
+        return SearchData(data_dir, task, data_in.encoder, validation_count, seed)
+
+    def load(self) -> Tuple[InputData, OutputData]:
+        train_input, train_ids, train_out = (load_array(self.data_dir, name)
+                                             for name in SearchData.ARRAYS)
+        empty: np.ndarray = np.empty((0, train_input.shape[1]), dtype=np.float32)
+        data_in = InputData(train_input, empty, self.encoder.scaler_, self.encoder.columns_,
+                            train_ids, None, self.encoder.get_embedding_id_counts(), self.encoder)
+        return data_in, OutputData(train_out, np.empty_like(train_out[:0]), None)
+
+
+@dataclass(frozen=True)
+class SearchTrial:
+    trial_id: int
+    hyperparameters: NetworkHyperparameters
+    initial_epoch: int  # Epochs trained in previous rungs, model is then loaded from model_path
+    epochs: int  # Epochs trained after this rung
+    model_path: str
+
+
+@dataclass(frozen=True)
+class SearchResult:
+    trial_id: int
+    hyperparameters: NetworkHyperparameters
+    epochs: int
+    val_loss: float  # Best validation loss in last rung
+    seconds: float  # Training time in last rung
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'trial_id': self.trial_id, 'epochs': self.epochs, 'val_loss': self.val_loss,
+                'seconds': self.seconds, **self.hyperparameters.to_dict()}
+
+
+# Data of search worker process, set by init_search_worker
+SEARCH_WORKER_DATA: Optional[Tuple[InputData, OutputData, SearchData]] = None
+
+
+def init_search_worker(search_data: SearchData, threads: int, worker_counter: Any) -> None:
+    ''' Pins worker to its own cores and limits TensorFlow threads, then maps shared data. '''
+    global SEARCH_WORKER_DATA
+    with worker_counter.get_lock():
+        worker_id: int = worker_counter.value
+        worker_counter.value += 1
+    if hasattr(os, 'sched_setaffinity'):
+        cores: List[int] = sorted(os.sched_getaffinity(0))
+        # Workers are pinned only if each of them can get its own cores
+        if len(cores) >= threads * (worker_id + 1):
+            os.sched_setaffinity(0, cores[worker_id * threads:(worker_id + 1) * threads])
+    configure_tensorflow_threads(threads, 1)
+    SEARCH_WORKER_DATA = (*search_data.load(), search_data)
+
+
+def run_search_trial(trial: SearchTrial) -> SearchResult:
+    assert SEARCH_WORKER_DATA is not None, 'Search worker was not initialized'
+    data_in, data_out, search_data = SEARCH_WORKER_DATA
+    set_global_random_seed(search_data.seed + trial.trial_id)
+    start: float = time.perf_counter()
+    if trial.initial_epoch == 0:
+        net = NeuralNetwork(data_in, data_out, search_data.task, trial.hyperparameters)
+        model: krs.Model = net.model
+        batch_size: int = net.get_batch_size()
+    else:
+        # Model saved by previous rung keeps also optimizer state
+        model = krs.saving.load_model(trial.model_path)
+        batch_size = (trial.hyperparameters.batch_size or
+                      NeuralNetwork.get_reasonable_batch_size(data_in.get_training_sample_count()))
+    split_at: int = data_in.get_training_sample_count() - search_data.validation_count
+    history = model.fit(data_in.get_train_inputs(slice(0, split_at)),
+                        data_out.train_out[:split_at],
+                        validation_data=(data_in.get_train_inputs(slice(split_at, None)),
+                                         data_out.train_out[split_at:]),
+                        initial_epoch=trial.initial_epoch,
+                        epochs=trial.epochs,
+                        batch_size=batch_size,
+                        shuffle=True,
+                        verbose=0)
+    model.save(trial.model_path)
+    val_loss: float = float(np.nanmin(history.history['val_loss'] + [np.inf]))
+    return SearchResult(trial.trial_id, trial.hyperparameters, trial.epochs, val_loss,
+                        time.perf_counter() - start)
+
+
+def run_hyperparameter_search(data_in: InputData,
+                              data_out: OutputData,
+                              task: NetworkTaskType,
+                              trial_count: int,
+                              workers: int,
+                              threads: int,
+                              min_epochs: int,
+                              max_epochs: int,
+                              validation_count: int,
+                              seed: int) -> List[SearchResult]:
+    '''
+    Evaluates sampled hyperparameters in worker processes with successive halving. Every trial is
+    trained for min_epochs, then best 1/SEARCH_REDUCTION_FACTOR of them continue training until
+    they were trained SEARCH_REDUCTION_FACTOR times longer and so on, until max_epochs is reached
+    or single trial is left. Last validation_count training rows are used for validation.
+    Returns last result of each trial, best first.
+    '''
+    candidates: List[NetworkHyperparameters] = sample_hyperparameters(trial_count, seed)
+    results: Dict[int, SearchResult] = {}
+    with tempfile.TemporaryDirectory(prefix='generic_ff_search_') as work_dir:
+        search_data = SearchData.store(work_dir, task, data_in, data_out, validation_count, seed)
+        # Spawned workers do not inherit TensorFlow state of this process
+        ctx = multiprocessing.get_context('spawn')
+        counter = ctx.Value('i', 0)
+        survivors: List[int] = list(range(len(candidates)))
+        trained_epochs: int = 0
+        epochs: int = min(min_epochs, max_epochs)
+        with ctx.Pool(min(workers, len(candidates)), initializer=init_search_worker,
+                      initargs=(search_data, threads, counter)) as pool:
+            while True:
+                trials: List[SearchTrial] = [
+                    SearchTrial(idx, candidates[idx], trained_epochs, epochs,
+                                os.path.join(work_dir, f'trial_{idx}.keras'))
+                    for idx in survivors]
+                for result in pool.imap_unordered(run_search_trial, trials):
+                    results[result.trial_id] = result
+                    print(f'Trial {result.trial_id} - epochs {result.epochs}, '
+                          f'val_loss {result.val_loss:.5f} ({result.seconds:.1f}s) '
+                          f'{result.hyperparameters}')
+                if epochs >= max_epochs or len(survivors) == 1:
+                    break
+                survivors = sorted(survivors, key=lambda idx: results[idx].val_loss)[
+                    :max(1, len(survivors) // SEARCH_REDUCTION_FACTOR)]
+                trained_epochs = epochs
+                epochs = min(max_epochs, epochs * SEARCH_REDUCTION_FACTOR)
+    # Trials that got further are better than all pruned ones
+    return sorted(results.values(), key=lambda result: (-result.epochs, result.val_loss))
+
+
+# ==================================================================================================
+#                                         PREDICTION
+# ==================================================================================================
 
-    task: NetworkTaskType = NetworkTaskType.infer_from_data(
-        train_dataframe[list(cfg.output_cols)])
-    input_data: InputData = InputData.prepare_inputs(
-        train_dataframe, test_dataframe, cfg.input_cols)
-    output_data: OutputData = OutputData.prepare_outputs(
-        train_dataframe, test_dataframe, cfg.output_cols, task)
-    net: NeuralNetwork = NeuralNetwork(input_data, output_data, task)
+
+def predict_csv(model: krs.Model,
+                bundle: PreprocessingBundle,
+                input_files: Sequence[str],
+                output_csv: str,
+                keep_cols: Sequence[str] = (),
+                chunk_size: int = DEFAULT_CSV_CHUNK_SIZE,
+                batch_size: int = DEFAULT_PREDICT_BATCH_SIZE) -> int:
+    '''
+    Streams input files chunk by chunk through preprocessing and network. Decoded predictions are
+    appended to output_csv as soon as each chunk is done. Returns number of predicted rows.
+    '''
+    used_cols: List[str] = list(dict.fromkeys(list(keep_cols) + bundle.get_input_columns()))
+    # Categorical columns are read as text, the same way as their levels were read for training
+    dtypes: Dict[str, Any] = {col: str for col in bundle.encoder.categorical_columns_}
+    rows: int = 0
+    with open(output_csv, 'w', newline='') as f:
+        for filename in input_files:
+            check_for_missing_columns(pd.read_csv(filename, nrows=0), used_cols, filename)
+            for chunk in pd.read_csv(filename, usecols=used_cols, dtype=dtypes,
+                                     chunksize=chunk_size):
+                features, ids = bundle.encoder.transform(chunk, chunk.shape[0])
+                predictions = model.predict(InputData.make_model_inputs(features, ids),
+                                            batch_size=batch_size, verbose=0)
+                result: pd.DataFrame = bundle.decode(np.asarray(predictions))
+                for idx, col in enumerate(keep_cols):
+                    result.insert(idx, col, chunk[col].to_numpy())
+                result.to_csv(f, header=rows == 0, index=False)
+                rows += chunk.shape[0]
+    return rows
+
+
+# ==================================================================================================
+#                                      PREDICTION SERVER
+# ==================================================================================================
+
+
+def to_sparse_tensor(matrix: sparse.csr_matrix) -> tf.SparseTensor:
+    ''' Keras models called directly (not through fit/predict) do not accept scipy matrices. '''
+    coo = matrix.tocoo()
+    return tf.SparseTensor(np.stack([coo.row, coo.col], axis=1).astype(np.int64),
+                           coo.data.astype(np.float32), coo.shape)
+
+
+class ServerMetrics:
+    ''' Thread safe latency and batch size statistics of last WINDOW requests and batches. '''
+
+    WINDOW: Final[int] = 10_000
+
+    lock_: threading.Lock
+    started_: float
+    requests_: int
+    rows_: int
+    batches_: int
+    errors_: int
+    latencies_: Deque[float]  # Seconds from receiving request to its result
+    batch_rows_: Deque[int]
+    batch_requests_: Deque[int]
+
+    def __init__(self) -> None:
+        self.lock_ = threading.Lock()
+        self.started_ = time.monotonic()
+        self.requests_ = 0
+        self.rows_ = 0
+        self.batches_ = 0
+        self.errors_ = 0
+        self.latencies_ = deque(maxlen=ServerMetrics.WINDOW)
+        self.batch_rows_ = deque(maxlen=ServerMetrics.WINDOW)
+        self.batch_requests_ = deque(maxlen=ServerMetrics.WINDOW)
+
+    def record_request(self, latency: float, rows: int, failed: bool = False) -> None:
+        with self.lock_:
+            self.requests_ += 1
+            self.rows_ += rows
+            self.errors_ += int(failed)
+            self.latencies_.append(latency)
+
+    def record_batch(self, requests: int, rows: int) -> None:
+        with self.lock_:
+            self.batches_ += 1
+            self.batch_requests_.append(requests)
+            self.batch_rows_.append(rows)
+
+    def summary(self) -> Dict[str, Any]:
+        with self.lock_:
+            latencies: np.ndarray = np.asarray(self.latencies_, dtype=np.float64) * 1000.0
+            batch_rows: np.ndarray = np.asarray(self.batch_rows_, dtype=np.int64)
+            batch_requests: np.ndarray = np.asarray(self.batch_requests_, dtype=np.int64)
+            result: Dict[str, Any] = {
+                'uptime_s': time.monotonic() - self.started_,
+                'requests': self.requests_,
+                'rows': self.rows_,
+                'batches': self.batches_,
+                'errors': self.errors_,
+            }
+        if latencies.size:
+            result['latency_ms'] = get_percentile_summary(latencies)
+        if batch_rows.size:
+            result['batch'] = {'mean_rows': float(batch_rows.mean()),
+                               'mean_requests': float(batch_requests.mean()),
+                               'max_rows': int(batch_rows.max()),
+                               'rows_histogram': get_power_of_two_histogram(batch_rows)}
+        return result
+
+
+@dataclass
+class PendingPrediction:
+    records: List[Dict[str, Any]]  # Rows as received in JSON request
+    received: float  # time.monotonic() when request arrived
+    done: threading.Event = field(default_factory=threading.Event)
+    result: pd.DataFrame | None = None
+    error: Exception | None = None
+
+
+class MicroBatchPredictor:
+    '''
+    Collects concurrent prediction requests and runs them through network together. Batch is
+    closed when batch_window seconds passed since its first request arrived or when it has
+    max_batch_rows rows, so single request waits at most batch_window for others.
+    '''
+
+    model_: krs.Model
+    bundle_: PreprocessingBundle
+    batch_window_: float
+    max_batch_rows_: int
+    metrics_: ServerMetrics
+    queue_: queue.Queue
+    thread_: threading.Thread
+
+    def __init__(self, model: krs.Model, bundle: PreprocessingBundle,
+                 batch_window: float, max_batch_rows: int) -> None:
+        self.model_ = model
+        self.bundle_ = bundle
+        self.batch_window_ = batch_window
+        self.max_batch_rows_ = max_batch_rows
+        self.metrics_ = ServerMetrics()
+        self.queue_ = queue.Queue()
+        self.warm_up_()
+        self.thread_ = threading.Thread(target=self.run_, name='micro_batcher', daemon=True)
+        self.thread_.start()
+
+    def warm_up_(self) -> None:
+        ''' First call of model traces it, that is done before first request arrives. '''
+        encoder: IncrementalInputEncoder = self.bundle_.encoder
+        features: Any = np.zeros((1, len(encoder.columns_)), dtype=np.float32)
+        if encoder.is_sparse():
+            features = to_sparse_tensor(sparse.csr_matrix(features))
+        ids: np.ndarray | None = None
+        if encoder.embedded_columns_:
+            ids = np.zeros((1, len(encoder.embedded_columns_)), dtype=np.int32)
+        self.model_.predict_on_batch(InputData.make_model_inputs(features, ids))
+
+    def get_metrics(self) -> ServerMetrics:
+        return self.metrics_
+
+    def check_records(self, records: List[Dict[str, Any]]) -> None:
+        input_cols: List[str] = self.bundle_.get_input_columns()
+        for record in records:
+            if not isinstance(record, dict):
+                raise TypeError(f'Row must be JSON object, {type(record).__name__} given instead')
+            missing: List[str] = [col for col in input_cols if col not in record]
+            if missing:
+                raise KeyError(f'Row is missing following columns {missing}')
+            for col in input_cols:
+                if isinstance(record[col], (dict, list)):
+                    raise TypeError(f'Value of column {col} must be number, string or null, '
+                                    f'{type(record[col]).__name__} given instead')
+
+    def prepare_rows_(self, records: List[Dict[str, Any]]) -> pd.DataFrame:
+        ''' Builds frame with input columns from JSON records, values are parsed as CSV ones. '''
+        rows: pd.DataFrame = pd.DataFrame.from_records(records,
+                                                       columns=self.bundle_.get_input_columns())
+        for col in self.bundle_.encoder.numeric_columns_:
+            rows[col] = pd.to_numeric(rows[col])
+        for col in self.bundle_.encoder.categorical_columns_:
+            rows[col] = rows[col].where(rows[col].isna(), rows[col].astype(str))
+        return rows
+
+    def predict(self, records: List[Dict[str, Any]]) -> pd.DataFrame:
+        '''
+        Blocks until records (checked by check_records) are predicted as part of some batch.
+        ValueError or TypeError is raised for values that cannot be parsed.
+        '''
+        pending = PendingPrediction(records, time.monotonic())
+        self.queue_.put(pending)
+        pending.done.wait()
+        self.metrics_.record_request(time.monotonic() - pending.received, len(records),
+                                     pending.error is not None)
+        if pending.error is not None:
+            raise pending.error
+        assert pending.result is not None
+        return pending.result
+
+    def close(self) -> None:
+        self.queue_.put(None)
+        self.thread_.join()
+
+    def run_(self) -> None:
+        while True:
+            first: PendingPrediction | None = self.queue_.get()
+            if first is None:
+                return
+            batch: List[PendingPrediction] = [first]
+            batch_rows: int = len(first.records)
+            deadline: float = first.received + self.batch_window_
+            closing: bool = False
+            while batch_rows < self.max_batch_rows_:
+                # Requests that queued up while previous batch was running are taken without
+                # waiting, even if window of first of them has already passed
+                remaining: float = deadline - time.monotonic()
+                try:
+                    pending: PendingPrediction | None = (self.queue_.get(timeout=remaining)
+                                                         if remaining > 0
+                                                         else self.queue_.get_nowait())
+                except queue.Empty:
+                    break
+                if pending is None:
+                    closing = True
+                    break
+                batch.append(pending)
+                batch_rows += len(pending.records)
+            try:
+                self.run_batch_(batch)
+            except Exception as err:  # Batcher thread must survive, error goes to the requests
+                for pending in batch:
+                    if not pending.done.is_set():
+                        pending.error = err
+                        pending.done.set()
+            if closing:
+                return
+
+    def run_batch_(self, batch: List[PendingPrediction]) -> None:
+        # Batch is parsed as a whole, only when it fails requests are parsed one by one so that
+        # invalid values fail just the request that sent them
+        try:
+            frame: pd.DataFrame = self.prepare_rows_(
+                [record for pending in batch for record in pending.records])
+        except (ValueError, TypeError):
+            parsed: List[pd.DataFrame] = []
+            for pending in batch:
+                try:
+                    parsed.append(self.prepare_rows_(pending.records))
+                except (ValueError, TypeError) as err:
+                    pending.error = err
+                    pending.done.set()
+            batch = [pending for pending in batch if pending.error is None]
+            if not batch:
+                return
+            frame = pd.concat(parsed, ignore_index=True)
+        self.run_frame_(batch, frame)
+
+    def run_frame_(self, batch: List[PendingPrediction], frame: pd.DataFrame) -> None:
+        try:
+            features, ids = self.bundle_.encoder.transform(frame, frame.shape[0])
+            if sparse.issparse(features):
+                features = to_sparse_tensor(features)
+            predictions = self.model_.predict_on_batch(InputData.make_model_inputs(features, ids))
+            decoded: pd.DataFrame = self.bundle_.decode(np.asarray(predictions))
+            offset: int = 0
+            for pending in batch:
+                count: int = len(pending.records)
+                pending.result = decoded.iloc[offset:offset + count]
+                offset += count
+        except Exception as err:  # Error is reported to every request of the batch
+            for pending in batch:
+                pending.error = err
+        self.metrics_.record_batch(len(batch), frame.shape[0])
+        for pending in batch:
+            pending.done.set()
+
+
+def get_request_rows(body: Any) -> List[Dict[str, Any]]:
+    '''
+    Returns rows of prediction request body, that is either {"rows": [row, ...]} or single row
+    object. Malformed body raises ValueError with message meant for client.
+    '''
+    if not isinstance(body, dict):
+        raise ValueError(f'Request body must be JSON object, {type(body).__name__} given instead')
+    if 'rows' not in body:
+        return [body]
+    records: Any = body['rows']
+    if not isinstance(records, list):
+        raise ValueError(f'Value of "rows" must be JSON array of row objects, '
+                         f'{type(records).__name__} given instead')
+    if not records:
+        raise ValueError('Value of "rows" must contain at least one row')
+    for idx, record in enumerate(records):
+        if not isinstance(record, dict):
+            raise ValueError(f'Row {idx} must be JSON object, {type(record).__name__} given instead')
+    return records
+
+
+def make_request_handler(predictor: MicroBatchPredictor) -> type:
+    '''
+    Creates HTTP handler serving POST /predict with JSON body {"rows": [{column: value, ...}]}
+    (or a single row object) and GET /metrics, GET /health.
+    '''
+
+    class PredictionRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # Keep alive, clients reuse connections
+
+        def send_json_(self, status: int, body: Any) -> None:
+            payload: bytes = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self) -> None:
+            if self.path == '/metrics':
+                self.send_json_(200, predictor.get_metrics().summary())
+            elif self.path == '/health':
+                self.send_json_(200, {'status': 'ok'})
+            else:
+                self.send_json_(404, {'error': f'Unknown path {self.path}'})
+
+        def do_POST(self) -> None:
+            if self.path != '/predict':
+                self.send_json_(404, {'error': f'Unknown path {self.path}'})
+                return
+            try:
+                body: Any = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            except ValueError as err:
+                self.send_json_(400, {'error': f'Request body is not valid JSON - {err}'})
+                return
+            try:
+                records: List[Dict[str, Any]] = get_request_rows(body)
+                predictor.check_records(records)
+            except (ValueError, KeyError, TypeError) as err:
+                # Message of KeyError is quoted by str()
+                self.send_json_(400, {'error': err.args[0] if err.args else str(err)})
+                return
+            try:
+                result: pd.DataFrame = predictor.predict(records)
+            except (ValueError, TypeError) as err:
+                self.send_json_(400, {'error': str(err)})
+                return
+            except Exception as err:
+                self.send_json_(500, {'error': str(err)})
+                return
+            self.send_json_(200, {'predictions': json.loads(result.to_json(orient='records'))})
+
+        def address_string(self) -> str:
+            # Client address of unix socket is not a (host, port) pair
+            return str(self.client_address[0]) if self.client_address else 'unix'
+
+        def log_message(self, format: str, *args: Any) -> None:
+            logging.debug(format, *args)
+
+    return PredictionRequestHandler
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self) -> None:
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float = 60.0) -> None:
+        super().__init__('localhost', timeout=timeout)
+        self.path_ = path
+
+    def connect(self) -> None:
+        # Timeout is set only after connecting, non blocking connect to unix socket fails right
+        # away when server backlog is full instead of waiting
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path_)
+        self.sock.settimeout(self.timeout)
+
+
+class PredictionClient:
+    ''' Client of prediction server, each thread should use its own instance. '''
+
+    connection_: http.client.HTTPConnection
+
+    def __init__(self, host: str = DEFAULT_SERVER_HOST, port: int = DEFAULT_SERVER_PORT,
+                 unix_socket: Optional[str] = None) -> None:
+        self.connection_ = (UnixHTTPConnection(unix_socket) if unix_socket
+                            else http.client.HTTPConnection(host, port, timeout=60.0))
+
+    def request_(self, method: str, path: str, body: Any = None) -> Any:
+        payload: bytes | None = None if body is None else json.dumps(body).encode()
+        headers: Dict[str, str] = {'Content-Type': 'application/json'} if payload else {}
+        self.connection_.request(method, path, body=payload, headers=headers)
+        response = self.connection_.getresponse()
+        result: Any = json.loads(response.read())
+        if response.status != 200:
+            raise ValueError(f'Server responded with {response.status}: {result.get("error")}')
+        return result
+
+    def predict(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return self.request_('POST', '/predict', {'rows': rows})['predictions']
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return self.request_('GET', '/metrics')
+
+    def close(self) -> None:
+        self.connection_.close()
+
+
+def make_prediction_server(predictor: MicroBatchPredictor,
+                           host: str = DEFAULT_SERVER_HOST,
+                           port: int = DEFAULT_SERVER_PORT,
+                           unix_socket: Optional[str] = None) -> socketserver.BaseServer:
+    ''' Creates (but does not start) server, unix socket is used instead of TCP when given. '''
+    handler: type = make_request_handler(predictor)
+    if unix_socket:
+        return ThreadingUnixHTTPServer(unix_socket, handler)
+    return ThreadingHTTPServer((host, port), handler)
+
+
+# ==================================================================================================
+#                                           MAIN
+# ==================================================================================================
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    cfg: Config = Config.from_args(argv)
+    performance: PerformanceOptions = PerformanceOptions()
+    if cfg.cpu_performance and not cfg.dry_run:
+        # Threads must be configured before TensorFlow runs anything
+        configure_tensorflow_threads()
+        performance = PerformanceOptions.for_cpu()
+        print(f'CPU performance options : {performance}')
+
+    # Reading data, only input and output columns are loaded. Missing columns are reported
+    # before any data is read.
+    used_cols: List[str] = list(cfg.input_cols) + list(cfg.output_cols)
+    train_files: Optional[List[str]] = None
+    input_data: InputData
+    output_data: OutputData
+    target_summary: TargetSummary | None = None  # Not available for cached data
+    if cfg.streaming:
+        # Output columns are summarized chunk by chunk, inputs are streamed during training
+        try:
+            train_files = expand_csv_files(cfg.train_csv)
+            test_files: List[str] = expand_csv_files(cfg.test_csv)
+            for filename in train_files + test_files:
+                check_for_missing_columns(pd.read_csv(filename, nrows=0), used_cols, filename)
+        except (KeyError, FileNotFoundError) as err:
+            panic(f'Unable to use training data - {err}')
+        target_summary = TargetSummary.from_chunks(
+            read_csv_files_chunks(train_files, cfg.output_cols, cfg.chunk_size))
+        task: NetworkTaskType = target_summary.get_task()
+        input_data = StreamedInputData.prepare_inputs(
+            train_files, test_files, cfg.input_cols, cfg.chunk_size)
+        output_data = StreamedOutputData.prepare_outputs(target_summary, cfg.output_cols, task)
+    else:
+        cache: PreprocessingCache | None = None
+        cached: Tuple[NetworkTaskType, InputData, OutputData] | None = None
+        if cfg.cache_dir:
+            cache = PreprocessingCache(cfg.cache_dir, [cfg.train_csv, cfg.test_csv],
+                                       cfg.input_cols, cfg.output_cols,
+                                       cfg.sparse_threshold, cfg.embedding_threshold)
+            cached = cache.load()
+        if cached:
+            print('Using cached preprocessed data.')
+            task, input_data, output_data = cached
+        else:
+            try:
+                train_dataframe: pd.DataFrame = read_csv_columns(
+                    cfg.train_csv, used_cols, cfg.chunk_size)
+                test_dataframe: pd.DataFrame = read_csv_columns(
+                    cfg.test_csv, used_cols, cfg.chunk_size)
+            except KeyError as err:
+                panic(f'Missing columns found - {err}')
+
+            target_summary = TargetSummary.from_data(train_dataframe[list(cfg.output_cols)])
+            task = target_summary.get_task()
+            input_data = InputData.prepare_inputs(
+                train_dataframe, test_dataframe, cfg.input_cols, cfg.chunk_size, cfg.memmap_dir,
+                cfg.sparse_threshold, cfg.embedding_threshold)
+            output_data = OutputData.prepare_outputs(
+                train_dataframe, test_dataframe, cfg.output_cols, task)
+            if cache:
+                cache.save(task, input_data, output_data, cfg.output_cols)
     print(f'Inferred task : {task}')
+    if target_summary and target_summary.get_value_range():
+        print(f'Output value range : {target_summary.get_value_range()}')
     if task in [NetworkTaskType.BINARY_CLASSIFICATION, NetworkTaskType.MULTICLASS_CLASSIFICATION]:
         print(f'Category count : {output_data.get_category_count()}')
     print(f'Train samples - {input_data.get_training_sample_count()}')
@@ -661,15 +3265,190 @@ def main(argv: Optional[Sequence[str]] = None) -> None:
     if cfg.history_out:
         print(f'Training history will be saved to {cfg.history_out}')
     else:
-        print(f'Training history will not be saved.')
-    print(f' TRAIN OUT SHAPE = {output_data.train_out.shape}')
-    if not input('Proceed with training (y/n)>')=='y':
+        print(f'Training history table will not be saved.')
+    if cfg.plot_out:
+        print(f'History plots will be saved to {cfg.plot_out}')
+    print(f' TRAIN OUT SHAPE = '
+          f'{(input_data.get_training_sample_count(),) + output_data.train_out.shape[1:]}')
+    if cfg.dry_run:
+        # Everything above needs only pandas and numpy, nothing is trained
+        print(f' TRAIN IN SHAPE = '
+              f'{(input_data.get_training_sample_count(), input_data.get_feature_count())}')
+        print(f' TEST IN SHAPE = '
+              f'{(input_data.get_test_sample_count(), input_data.get_feature_count())}')
+        print(f'Sparse inputs : {input_data.is_sparse()}, '
+              f'embedded columns : {input_data.embedding_ids or None}')
+        layer_sizes: List[int] = NeuralNetwork.infer_architecture_from_data(
+            input_data.get_training_sample_count(), NeuralNetwork.get_input_width(input_data))
+        print(f'Inferred architecture : {NeuralNetwork.get_input_width(input_data)} -> '
+              f'{" -> ".join(map(str, layer_sizes))} -> {output_data.get_output_size()}')
+        print(f'TensorFlow loaded : {"tensorflow" in sys.modules}')
+        return
+    if cfg.metrics_out:
+        print(f'Metrics of each epoch will be appended to {cfg.metrics_out}')
+    if not cfg.non_interactive and not input('Proceed with training (y/n)>')=='y':
         sys.exit()    
-    net.train(cfg.model_out, cfg.validation_split, cfg.epochs)
-    net.plot_history()
+    seed: int = cfg.random_seed or int(datetime.now().timestamp())
+    validation_count: Optional[int] = None
+    if not cfg.streaming:
+        # Streamed data cannot be reordered, its validation rows are taken from the end
+        input_data, output_data, split = split_training_data(
+            input_data, output_data, task, cfg.validation_split, seed, cfg.memmap_dir)
+        validation_count = split.get_validation_count()
+    hyperparameters: NetworkHyperparameters = NetworkHyperparameters()
+    if cfg.search_trials:
+        if cfg.streaming or validation_count is None:
+            panic('Hyperparameter search needs data in memory, it cannot be used with streaming.')
+        results: List[SearchResult] = run_hyperparameter_search(
+            input_data, output_data, task, cfg.search_trials, cfg.search_workers,
+            cfg.search_threads, cfg.search_min_epochs, cfg.search_max_epochs,
+            validation_count, seed)
+        hyperparameters = results[0].hyperparameters
+        search_out: str = f'{os.path.splitext(cfg.model_out)[0]}.search.json'
+        with open(search_out, 'w') as f:
+            json.dump([result.to_dict() for result in results], f, indent=2)
+        print(f'Best hyperparameters : {hyperparameters}, all results saved to {search_out}')
+    net: NeuralNetwork = NeuralNetwork(input_data, output_data, task, hyperparameters, performance)
+    profile_stem: str = os.path.splitext(cfg.history_out or cfg.model_out)[0]
+    profiler: krs.callbacks.Callback | None = None
+    if cfg.profile:
+        profiler = make_training_profiler(f'{profile_stem}.trace', cfg.profile_trace_steps)
+    # Preprocessing is stored next to the model, so that the model can be used by predict
+    PreprocessingBundle(task, input_data.encoder, list(cfg.output_cols), output_data.decoder).save(
+        PreprocessingBundle.get_path(cfg.model_out))
+    net.train(cfg.model_out, cfg.validation_split, cfg.epochs, train_files, cfg.shuffle_buffer,
+              validation_count, cfg.metrics_out, profiler)
+    if cfg.plot_out:
+        net.save_history_plot(cfg.plot_out)
+        print(f'History plots saved to {cfg.plot_out}')
+    else:
+        net.plot_history()
     if cfg.history_out:
         history = pd.DataFrame(net.get_history().history)
         history.to_csv(cfg.history_out)
+    if profiler:
+        profile: Dict[str, Any] = profiler.get_summary()
+        print(format_profile_summary(profile))
+        with open(f'{profile_stem}.profile.json', 'w') as f:
+            json.dump(profile, f, indent=2)
+        print(f'Profile saved to {profile_stem}.profile.json')
+
+def predict_main(argv: Optional[Sequence[str]] = None) -> None:
+    cfg: PredictConfig = PredictConfig.from_args(argv)
+    try:
+        input_files: List[str] = expand_csv_files(cfg.input_csv)
+        bundle: PreprocessingBundle = PreprocessingBundle.load(
+            PreprocessingBundle.get_path(cfg.model))
+    except FileNotFoundError as err:
+        panic(f'Unable to use model - {err}')
+    model: krs.Model = krs.saving.load_model(cfg.model)
+    try:
+        rows: int = predict_csv(model, bundle, input_files, cfg.output_csv, cfg.keep_cols,
+                                cfg.chunk_size, cfg.batch_size)
+    except KeyError as err:
+        panic(f'Missing columns found - {err}')
+    print(f'Predicted {rows} rows, results saved to {cfg.output_csv}')
+
+
+def serve_main(argv: Optional[Sequence[str]] = None) -> None:
+    cfg: ServeConfig = ServeConfig.from_args(argv)
+    try:
+        bundle: PreprocessingBundle = PreprocessingBundle.load(
+            PreprocessingBundle.get_path(cfg.model))
+    except FileNotFoundError as err:
+        panic(f'Unable to use model - {err}')
+    model: krs.Model = krs.saving.load_model(cfg.model)
+    predictor = MicroBatchPredictor(model, bundle, cfg.batch_window_ms / 1000.0,
+                                    cfg.max_batch_rows)
+    server = make_prediction_server(predictor, cfg.host, cfg.port, cfg.unix_socket)
+    print(f'Serving {cfg.model} on '
+          f'{cfg.unix_socket if cfg.unix_socket else f"http://{cfg.host}:{cfg.port}"}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        predictor.close()
+    print(json.dumps(predictor.get_metrics().summary(), indent=2))
+
+
+def query_main(argv: Optional[Sequence[str]] = None) -> None:
+    cfg: QueryConfig = QueryConfig.from_args(argv)
+    frame: pd.DataFrame = pd.read_csv(cfg.input_csv, nrows=cfg.rows)
+    # JSON has no NaN, missing values are sent as null
+    records: List[Dict[str, Any]] = frame.astype(object).where(frame.notna(), None).to_dict('records')
+    requests: List[List[Dict[str, Any]]] = [records[start:start + cfg.request_rows]
+                                            for start in range(0, len(records), cfg.request_rows)]
+
+    local = threading.local()
+
+    def send(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if not hasattr(local, 'client'):
+            local.client = PredictionClient(cfg.host, cfg.port, cfg.unix_socket)
+        return local.client.predict(rows)
+
+    start: float = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=cfg.concurrency) as executor:
+        results: List[List[Dict[str, Any]]] = list(executor.map(send, requests))
+    elapsed: float = time.perf_counter() - start
+    print(f'Sent {len(records)} rows in {len(requests)} requests in {elapsed:.3f}s '
+          f'({len(records) / elapsed:.1f} rows/s)')
+    if cfg.output_csv:
+        pd.DataFrame([prediction for result in results for prediction in result]).to_csv(
+            cfg.output_csv, index=False)
+    client = PredictionClient(cfg.host, cfg.port, cfg.unix_socket)
+    print(json.dumps(client.get_metrics(), indent=2))
+    client.close()
+
+
+def measure_import(script: str) -> Dict[str, Any]:
+    ''' Imports script in fresh interpreter, returns import seconds and heavy modules it loaded. '''
+    code: str = (
+        'import json, sys, time\n'
+        f'sys.path.insert(0, {os.path.dirname(script)!r})\n'
+        'start = time.perf_counter()\n'
+        f'import {os.path.splitext(os.path.basename(script))[0]} as script\n'
+        'seconds = time.perf_counter() - start\n'
+        'print(json.dumps({"seconds": seconds, "loaded": sorted({name.split(".")[0] for name in '
+        'sys.modules} & set(script.HEAVY_MODULES))}))\n')
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                            check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def benchmark_import_main(argv: Optional[Sequence[str]] = None) -> None:
+    cfg: ImportBenchmarkConfig = ImportBenchmarkConfig.from_args(argv)
+    script: str = os.path.abspath(__file__)
+    import_seconds: List[float] = []
+    help_seconds: List[float] = []
+    loaded: set[str] = set()
+    for _ in range(cfg.repeats):
+        measurement: Dict[str, Any] = measure_import(script)
+        import_seconds.append(measurement['seconds'])
+        loaded.update(measurement['loaded'])
+        start: float = time.perf_counter()
+        subprocess.run([sys.executable, script, '--help'], capture_output=True, check=True)
+        help_seconds.append(time.perf_counter() - start)
+    median_import: float = float(np.median(import_seconds))
+    print(f'Import : median {median_import:.3f}s, max {max(import_seconds):.3f}s')
+    print(f'--help (with interpreter startup) : median {float(np.median(help_seconds)):.3f}s')
+    print(f'Heavy modules loaded by import : {sorted(loaded) or None}')
+    if loaded:
+        panic(f'Import loads heavy modules {sorted(loaded)}')
+    if median_import > cfg.max_seconds:
+        panic(f'Import takes {median_import:.3f}s, limit is {cfg.max_seconds:.3f}s')
+
+
+SUBCOMMANDS: Final[Dict[str, Callable[[Optional[Sequence[str]]], None]]] = {
+    'predict': predict_main,
+    'serve': serve_main,
+    'query': query_main,
+    'benchmark_import': benchmark_import_main,
+}
 
 if __name__ == '__main__':
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        SUBCOMMANDS[sys.argv[1]](sys.argv[2:])
+    else:
+        main()
@@ -0,0 +1,201 @@
+'''
+Tests of generic_ff.py helpers, run with "python -m pytest" from this directory.
+'''
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import generic_ff as gff
+
+
+def test_import_does_not_load_heavy_modules():
+    # Fresh interpreter, modules imported by pytest or other tests must not hide a regression
+    code = ('import sys, generic_ff; '
+            'print(",".join(m for m in generic_ff.HEAVY_MODULES if m in sys.modules))')
+    loaded = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(gff.__file__),
+                            capture_output=True, text=True, check=True).stdout.strip()
+    assert loaded == ''
+    assert {'tensorflow', 'keras', 'sklearn', 'matplotlib'} <= set(gff.HEAVY_MODULES)
+
+
+def test_read_csv_columns_merges_types_of_all_chunks(tmp_path):
+    # Blank integer and text in numeric column appear only after first chunk
+    frame = pd.DataFrame({'ints': [1, 2, 3, 4, None, 6],
+                          'codes': ['1', '2', '3', '4', '5', 'x'],
+                          'ids': [1, 2, 3, 4, 300, 6],
+                          'text': ['a', 'b', 'c', 'd', 'e', None],
+                          'unused': range(6)})
+    path = tmp_path / 'data.csv'
+    frame.to_csv(path, index=False)
+    data = gff.read_csv_columns(str(path), ['ints', 'codes', 'ids', 'text'], 2)
+    assert list(data.columns) == ['ints', 'codes', 'ids', 'text']
+    assert data['ints'].dtype == np.float32
+    assert np.isnan(data['ints'][4]) and data['ints'][5] == 6
+    assert list(data['codes'].cat.categories) == ['1', '2', '3', '4', '5', 'x']
+    assert data['ids'].dtype == np.int16
+    assert data['ids'].tolist() == [1, 2, 3, 4, 300, 6]
+    assert list(data['text'].cat.categories) == ['a', 'b', 'c', 'd', 'e']
+    assert data['text'].isna().tolist() == [False] * 5 + [True]
+
+
+
+def test_read_csv_columns_keeps_text_of_numbers_in_text_column(tmp_path):
+    # Numbers in first chunks are written as text would be, whole file read keeps them as written
+    path = tmp_path / 'data.csv'
+    path.write_text('code,label\n001,\n002,\n3,a\n,\n3.50,b\nx,\n')
+    chunked = gff.read_csv_columns(str(path), ['code', 'label'], 2)
+    whole = pd.read_csv(path, dtype=str)
+    for col in ['code', 'label']:
+        assert list(chunked[col].cat.categories) == sorted(whole[col].dropna().unique())
+        assert chunked[col].isna().tolist() == whole[col].isna().tolist()
+    assert list(chunked['code'].cat.categories) == ['001', '002', '3', '3.50', 'x']
+
+
+@pytest.fixture(scope='module')
+def trained_model(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('model')
+    rng = np.random.default_rng(0)
+    rows = 600
+    frame = pd.DataFrame({'x': rng.normal(size=rows),
+                          'z': rng.normal(size=rows),
+                          'color': rng.choice(['red', 'green', 'blue'], rows)})
+    frame['cls'] = np.where(frame['x'] + (frame['color'] == 'red') > 0.5, 'high', 'low')
+    frame.loc[::7, 'z'] = np.nan
+    frame.iloc[:500].to_csv(directory / 'train.csv', index=False)
+    frame.iloc[500:].to_csv(directory / 'test.csv', index=False)
+    model_path = directory / 'model.keras'
+    gff.main(['--train_csv', str(directory / 'train.csv'), '--test_csv', str(directory / 'test.csv'),
+              '--input_cols', 'x,z,color', '--output_cols', 'cls', '--model_out', str(model_path),
+              '--epochs', '2', '--random_seed', '1', '--verbosity', 'SILENT', '--non_interactive'])
+    return model_path, directory / 'test.csv'
+
+
+@pytest.fixture(scope='module')
+def predictor(trained_model):
+    model_path, _ = trained_model
+    bundle = gff.PreprocessingBundle.load(gff.PreprocessingBundle.get_path(str(model_path)))
+    predictor = gff.MicroBatchPredictor(gff.krs.saving.load_model(str(model_path)), bundle,
+                                        0.002, 64)
+    yield predictor
+    predictor.close()
+
+
+@pytest.fixture(scope='module')
+def server_port(predictor):
+    server = gff.make_prediction_server(predictor, '127.0.0.1', 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def test_served_predictions_match_predict_csv(trained_model, server_port, tmp_path):
+    model_path, test_csv = trained_model
+    bundle = gff.PreprocessingBundle.load(gff.PreprocessingBundle.get_path(str(model_path)))
+    model = gff.krs.saving.load_model(str(model_path))
+    output_csv = tmp_path / 'predictions.csv'
+    gff.predict_csv(model, bundle, [str(test_csv)], str(output_csv))
+    expected = pd.read_csv(output_csv)
+
+    frame = pd.read_csv(test_csv)
+    records = frame.astype(object).where(frame.notna(), None).to_dict('records')
+    client = gff.PredictionClient('127.0.0.1', server_port)
+    try:
+        # Requests of several sizes so that server batches differ from predict_csv ones
+        served = pd.DataFrame([prediction for start, stop in [(0, 1), (1, 40), (40, len(records))]
+                               for prediction in client.predict(records[start:stop])])
+    finally:
+        client.close()
+    assert list(served.columns) == list(expected.columns)
+    for col in expected.columns:
+        if gff.is_numeric(expected[col]):
+            np.testing.assert_allclose(served[col], expected[col], rtol=1e-5, atol=1e-6)
+        else:
+            assert served[col].tolist() == expected[col].tolist()
+
+
+@pytest.mark.parametrize('body, message', [
+    (b'{"rows": "x"}', 'Value of "rows" must be JSON array of row objects, str given instead'),
+    (b'[{"x": 1}]', 'Request body must be JSON object, list given instead'),
+    (b'"x"', 'Request body must be JSON object, str given instead'),
+    (b'{"rows": []}', 'Value of "rows" must contain at least one row'),
+    (b'{"rows": [{"x": 1, "z": 2, "color": "red"}, 3]}',
+     'Row 1 must be JSON object, int given instead'),
+    (b'{"x": 1, "z": 2}', "Row is missing following columns ['color']"),
+    (b'{"x": {"a": 1}, "z": 2, "color": "red"}',
+     'Value of column x must be number, string or null, dict given instead'),
+    (b'{"x": 1, "z": [2], "color": "red"}',
+     'Value of column z must be number, string or null, list given instead'),
+    (b'{"rows": [', 'Request body is not valid JSON'),
+])
+def test_malformed_request_is_rejected(server_port, body, message):
+    connection = http.client.HTTPConnection('127.0.0.1', server_port, timeout=60.0)
+    try:
+        connection.request('POST', '/predict', body=body,
+                           headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        error = json.loads(response.read())['error']
+    finally:
+        connection.close()
+    assert response.status == 400
+    assert error.startswith(message)
+
+
+def test_sparse_array_is_loaded_from_memory_mapped_components(tmp_path):
+    matrix = gff.sparse.random(40, 30, density=0.1, format='csr', dtype=np.float32,
+                               random_state=0)
+    gff.save_array(str(tmp_path), 'train_input', matrix)
+    loaded = gff.load_array(str(tmp_path), 'train_input')
+    assert loaded.shape == matrix.shape
+    assert (loaded != matrix).nnz == 0
+    # Components are views of memory mapped files, not private copies
+    for values in (loaded.data, loaded.indices, loaded.indptr):
+        while values is not None and not isinstance(values, np.memmap):
+            values = values.base
+        assert isinstance(values, np.memmap)
+
+
+@pytest.mark.parametrize('values, task, categories', [
+    ([2, 0, 1, 0, 10, 1], gff.NetworkTaskType.MULTICLASS_CLASSIFICATION, ['0', '1', '2', '10']),
+    (['yes', 'no', 'no', 'yes', 'no', 'no'], gff.NetworkTaskType.BINARY_CLASSIFICATION,
+     ['no', 'yes']),
+    ([0.5, -1.0, 2.0, 3.0, 0.0, 1.0], gff.NetworkTaskType.REGRESSION, []),
+])
+def test_target_summary_of_chunks_matches_summary_of_whole_data(values, task, categories):
+    data = pd.DataFrame({'y': values})
+    whole = gff.TargetSummary.from_data(data)
+    chunked = gff.TargetSummary.from_chunks(data.iloc[start:start + 2] for start in range(0, 6, 2))
+    assert chunked.get_task() == whole.get_task() == task
+    assert chunked.get_class_count() == whole.get_class_count()
+    assert chunked.get_value_range() == whole.get_value_range()
+    assert chunked.get_categories() == categories
+
+
+def test_batcher_survives_request_that_cannot_be_parsed(predictor):
+    # Records are not checked here, so that bad values reach batcher thread
+    valid = {'x': 0.5, 'z': None, 'color': 'red'}
+    for invalid in ({'x': {'a': 1}, 'z': 1.0, 'color': 'red'},
+                    {'x': 'not a number', 'z': 1.0, 'color': 'red'}):
+        with pytest.raises((TypeError, ValueError)):
+            predictor.predict([invalid])
+        assert predictor.predict([valid]).shape[0] == 1
+    assert predictor.thread_.is_alive()
+
+
+@pytest.mark.parametrize('first', [[0.5, 2.0], [-1, 3], [5000, 7], [1.0, np.nan]])
+def test_target_summary_of_chunks_finds_text_after_numbers(tmp_path, first):
+    # Numbers that cannot be class ids come before text, whole column is still text
+    path = tmp_path / 'target.csv'
+    pd.DataFrame({'y': first + ['low', 'high', '3']}).to_csv(path, index=False)
+    whole = gff.TargetSummary.from_data(pd.read_csv(path))
+    chunked = gff.TargetSummary.from_chunks(pd.read_csv(path, chunksize=2))
+    assert chunked.get_task() == whole.get_task() == gff.NetworkTaskType.MULTICLASS_CLASSIFICATION
+    assert chunked.get_categories() == whole.get_categories()
@@ -0,0 +1,88 @@
+'''
+Tests of yolo_for_image.py helpers, run with "python -m pytest" from this directory.
+'''
+import argparse
+import csv
+import io
+
+import cv2
+import numpy as np
+import pytest
+
+import yolo_for_image as yfi
+
+
+def test_non_max_suppression_keeps_boxes_of_other_class_with_negative_coordinates():
+    # Box at image edge has negative x and y, it must not be moved onto box of other class
+    boxes = np.array([[0, 0, 10, 10], [-11, -11, 10, 10]], dtype=np.float32)
+    scores = np.array([0.9, 0.8], dtype=np.float32)
+    category_ids = np.array([0, 1], dtype=np.intp)
+    keep = yfi.non_max_suppression(boxes, scores, category_ids, 0.5)
+    assert keep.tolist() == [0, 1]
+
+
+def test_non_max_suppression_removes_overlapping_box_of_same_class():
+    boxes = np.array([[-5, -5, 10, 10], [-4, -4, 10, 10], [50, 50, 10, 10]], dtype=np.float32)
+    scores = np.array([0.9, 0.8, 0.7], dtype=np.float32)
+    category_ids = np.array([1, 1, 1], dtype=np.intp)
+    keep = yfi.non_max_suppression(boxes, scores, category_ids, 0.5)
+    assert keep.tolist() == [0, 2]
+
+
+@pytest.fixture(scope='module')
+def tiny_wrapper(tmp_path_factory):
+    config, weights, classes = yfi.write_tiny_darknet_model(tmp_path_factory.mktemp('tiny'), 3)
+    return yfi.YoloWrapper(config, weights, classes, use_cache=False, reuse_blob=True)
+
+
+@pytest.mark.parametrize('input_size', [(416, 416), (320, 480)])
+@pytest.mark.parametrize('mean', [(0.0, 0.0, 0.0), (104.0, 117.0, 123.5)])
+@pytest.mark.parametrize('scale', [1.0, 1 / 255.0, 0.0078125])
+@pytest.mark.parametrize('image_shape', [(416, 416), (480, 640), (1080, 1920), (37, 91)])
+def test_fill_blob_matches_blob_from_image(tiny_wrapper, monkeypatch, input_size, mean, scale,
+                                           image_shape):
+    # Input size is given in numpy (rows, cols) order, non square size checks buffer layout
+    monkeypatch.setattr(yfi.YoloWrapper, 'YOLO_INPUT_SIZE', yfi.ImageSize(*input_size))
+    monkeypatch.setattr(yfi.YoloWrapper, 'YOLO_INPUT_MEAN', mean)
+    monkeypatch.setattr(tiny_wrapper, 'resized_buffer_', None)
+    monkeypatch.setattr(tiny_wrapper, 'blob_buffer_', None)
+    rng = np.random.default_rng(sum(image_shape))
+    img = rng.integers(0, 256, size=image_shape + (3,), dtype=np.uint8)
+    expected = cv2.dnn.blobFromImage(img, scalefactor=scale,
+                                     size=yfi.YoloWrapper.YOLO_INPUT_SIZE.to_cv_tuple(),
+                                     mean=mean, swapRB=True, crop=False, ddepth=cv2.CV_32F)
+    blob = tiny_wrapper.fill_blob_(img, scale)
+    assert blob.shape == (1, 3) + input_size
+    np.testing.assert_array_equal(blob, expected)
+
+
+def test_csv_result_keeps_image_without_detections():
+    detection = {'category': 'dog', 'confidence': 0.75, 'x': 1, 'y': 2, 'w': 3, 'h': 4}
+    out = io.StringIO()
+    yfi.write_csv_result(out, 'a.jpg', [detection])
+    yfi.write_csv_result(out, 'empty.jpg', [])
+    yfi.write_csv_result(out, 'b.jpg', [detection, detection])
+    rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+    assert [row['image'] for row in rows] == ['a.jpg', 'empty.jpg', 'b.jpg', 'b.jpg']
+    assert rows[0]['category'] == 'dog'
+    assert all(rows[1][field] == '' for field in yfi.CSV_FIELDS if field != 'image')
+
+
+def test_fp16_backend_is_rejected_when_opencv_lacks_fp16_target(monkeypatch):
+    monkeypatch.delattr(cv2.dnn, 'DNN_TARGET_CPU_FP16', raising=False)
+    with pytest.raises(ValueError, match='DNN_TARGET_CPU_FP16'):
+        yfi.DnnBackend.FP16.to_backend_and_target()
+    with pytest.raises(argparse.ArgumentTypeError, match='DNN_TARGET_CPU_FP16'):
+        yfi.arg_dnn_backend('fp16')
+    assert yfi.DnnBackend.OPENCV.to_backend_and_target() == (cv2.dnn.DNN_BACKEND_OPENCV,
+                                                             cv2.dnn.DNN_TARGET_CPU)
+
+
+def test_fp16_backend_is_used_only_where_opencv_supports_it():
+    target = getattr(cv2.dnn, 'DNN_TARGET_CPU_FP16', None)
+    if target is not None and target in cv2.dnn.getAvailableTargets(cv2.dnn.DNN_BACKEND_OPENCV):
+        assert yfi.DnnBackend.FP16.to_backend_and_target() == (cv2.dnn.DNN_BACKEND_OPENCV,
+                                                               target)
+    else:
+        with pytest.raises(ValueError, match='DNN_TARGET_CPU_FP16|not supported on this CPU'):
+            yfi.DnnBackend.FP16.to_backend_and_target()
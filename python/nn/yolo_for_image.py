@@ -5,6 +5,8 @@
 A very simple example of how to use pretrained YOLO.
 Pretrained weights may be downloaded from https://www.kaggle.com/datasets/shivam316/yolov3-weights/data
 FIXME: STILL RELYING ON TUTORIAL CODE,
+Run with "video", "directory" or "benchmark" as first argument for other modes, e.g.
+    yolo_for_image.py benchmark --iterations 50
 '''
 
 # ==================================================================================================
@@ -17,8 +19,20 @@ from __future__ import annotations
 import pathlib
 import sys
 import argparse
-from dataclasses import dataclass
-from typing import Optional, Sequence, Tuple, List
+import bisect
+import csv
+import functools
+import glob
+import json
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Optional, Sequence, Tuple, List, Final, Dict, Any, TextIO, Iterator, Callable
 
 # Library specific imports
 import cv2
@@ -55,6 +69,18 @@ def arg_scale(txt: str) -> float:
             f'Unable to convert "{txt}" to valid float.')
 
 
+def arg_positive_int(txt: str) -> int:
+    try:
+        val = int(txt)
+        if not val > 0:
+            raise argparse.ArgumentTypeError(
+                'Argument value must be greater than 0')
+        return val
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f'Unable to convert "{txt}" to valid integer')
+
+
 @dataclass(frozen=True)
 class Config:
 
@@ -95,6 +121,229 @@ class Config:
             scale=args.scale
         )
 
+
+@dataclass(frozen=True)
+class VideoConfig:
+
+    source: str  # Path to video file or index of local capture device
+    yolo_config: str  # Path to yolo config file
+    weights_file: str  # Path to file with pretrained weights
+    classes_file: str  # Path to file with classes
+    scale: float  # Scale of image that will be fed to network
+    output_video: Optional[str]  # Path to output video, if not set frames are displayed
+    queue_size: int  # Maximum number of frames waiting between pipeline stages
+    drop_frames: bool  # Drop frames instead of waiting when inference falls behind
+    backend: DnnBackend  # OpenCV DNN backend and target used for inference
+    warmup_runs: int  # Number of forward passes run on empty input before first frame
+    reuse_blob: bool  # Fill one preallocated input blob instead of allocating one per frame
+
+    @staticmethod
+    def from_args(argv: Optional[Sequence[str]] = None) -> VideoConfig:
+        prsr = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawTextHelpFormatter,
+        )
+
+        # Declare arguments
+        prsr.add_argument('--source', required=True, type=str,
+                          help='Path to video file or index of local capture device (e.g. 0)')
+        prsr.add_argument('--yolo_config', required=True,
+                          type=arg_file_path, help='Path to yolo config file')
+        prsr.add_argument('--weights_file', required=True,
+                          type=arg_file_path, help='Path to file with pretrained weights')
+        prsr.add_argument('--classes_file', required=True,
+                          type=arg_file_path, help='Path to file with classes')
+        prsr.add_argument('--scale', default=0.004,
+                          type=arg_scale, help='Scale of image that will be fed to network')
+        prsr.add_argument('--output_video', default=None, type=str,
+                          help='Path to output video, if not set frames are displayed in a window')
+        prsr.add_argument('--queue_size', default=4, type=arg_positive_int,
+                          help='Maximum number of frames waiting between stages (default: 4)')
+        prsr.add_argument('--no_drop_frames', action='store_true',
+                          help='Wait for inference instead of dropping frames, '
+                          'useful when every frame of a file must be processed')
+        prsr.add_argument('--backend', default=DnnBackend.OPENCV, type=arg_dnn_backend,
+                          help='DNN backend, available values are '
+                          f'{[e.value for e in DnnBackend]} (default: opencv)')
+        prsr.add_argument('--warmup_runs', default=1, type=arg_non_negative_int,
+                          help='Forward passes run before first frame (default: 1)')
+        prsr.add_argument('--reuse_blob', action='store_true',
+                          help='Fill one preallocated input blob instead of allocating one per frame')
+
+        # Parsing arguments
+        args: argparse.Namespace = prsr.parse_args(argv)
+
+        # Returning config
+        return VideoConfig(
+            source=args.source,
+            yolo_config=args.yolo_config,
+            weights_file=args.weights_file,
+            classes_file=args.classes_file,
+            scale=args.scale,
+            output_video=args.output_video,
+            queue_size=args.queue_size,
+            drop_frames=not args.no_drop_frames,
+            backend=args.backend,
+            warmup_runs=args.warmup_runs,
+            reuse_blob=args.reuse_blob
+        )
+
+
+def arg_dnn_backend(txt: str) -> DnnBackend:
+    try:
+        backend = DnnBackend.parse_string(txt)
+        backend.check_supported()
+        return backend
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def arg_non_negative_int(txt: str) -> int:
+    try:
+        val = int(txt)
+        if val < 0:
+            raise argparse.ArgumentTypeError(
+                'Argument value must not be negative')
+        return val
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f'Unable to convert "{txt}" to valid integer')
+
+
+@dataclass(frozen=True)
+class DirectoryConfig:
+
+    input_images: str  # Directory with images or glob pattern matching them
+    yolo_config: str  # Path to yolo config file
+    weights_file: str  # Path to file with pretrained weights
+    classes_file: str  # Path to file with classes
+    scale: float  # Scale of image that will be fed to network
+    output: str  # Path to output file, format is chosen by extension (.jsonl or .csv)
+    workers: int  # Number of worker processes, each of them loads its own network
+    cv_threads: int  # Number of OpenCV threads in each worker, 0 leaves OpenCV default
+    ordered: bool  # Write results in input order instead of order of completion
+    backend: DnnBackend  # OpenCV DNN backend and target used for inference
+
+    @staticmethod
+    def from_args(argv: Optional[Sequence[str]] = None) -> DirectoryConfig:
+        prsr = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawTextHelpFormatter,
+        )
+
+        # Declare arguments
+        prsr.add_argument('--input_images', required=True, type=str,
+                          help='Directory with images or glob pattern (e.g. "photos/**/*.jpg")')
+        prsr.add_argument('--yolo_config', required=True,
+                          type=arg_file_path, help='Path to yolo config file')
+        prsr.add_argument('--weights_file', required=True,
+                          type=arg_file_path, help='Path to file with pretrained weights')
+        prsr.add_argument('--classes_file', required=True,
+                          type=arg_file_path, help='Path to file with classes')
+        prsr.add_argument('--scale', default=0.004,
+                          type=arg_scale, help='Scale of image that will be fed to network')
+        prsr.add_argument('--output', required=True, type=str,
+                          help='Output file, JSON Lines for .jsonl and CSV for .csv extension')
+        prsr.add_argument('--workers', default=os.cpu_count() or 1, type=arg_positive_int,
+                          help='Number of worker processes (default: number of cores)')
+        prsr.add_argument('--cv_threads', default=1, type=arg_non_negative_int,
+                          help='OpenCV threads per worker, 0 keeps OpenCV default (default: 1)')
+        prsr.add_argument('--ordered', action='store_true',
+                          help='Write results in input order instead of as they complete')
+        prsr.add_argument('--backend', default=DnnBackend.OPENCV, type=arg_dnn_backend,
+                          help='DNN backend, available values are '
+                          f'{[e.value for e in DnnBackend]} (default: opencv)')
+
+        # Parsing arguments
+        args: argparse.Namespace = prsr.parse_args(argv)
+        if pathlib.Path(args.output).suffix not in OUTPUT_WRITERS:
+            prsr.error(f'Unsupported output format "{args.output}", '
+                       f'valid extensions are {list(OUTPUT_WRITERS)}')
+
+        # Returning config
+        return DirectoryConfig(
+            input_images=args.input_images,
+            yolo_config=args.yolo_config,
+            weights_file=args.weights_file,
+            classes_file=args.classes_file,
+            scale=args.scale,
+            output=args.output,
+            workers=args.workers,
+            cv_threads=args.cv_threads,
+            ordered=args.ordered,
+            backend=args.backend
+        )
+
+@dataclass(frozen=True)
+class BenchmarkConfig:
+
+    yolo_config: Optional[str]  # Path to yolo config file, if not set tiny random model is used
+    weights_file: Optional[str]  # Path to file with pretrained weights
+    classes_file: Optional[str]  # Path to file with classes
+    width: int  # Width of synthetic frames
+    height: int  # Height of synthetic frames
+    iterations: int  # Number of measured iterations
+    batch_size: int  # Number of frames processed by single iteration
+    warmup_runs: int  # Number of forward passes run before measurement
+    backend: DnnBackend  # OpenCV DNN backend and target used for inference
+    show_layers: bool  # Print timings of each network layer
+    reuse_blob: bool  # Fill one preallocated input blob instead of allocating one per frame
+
+    @staticmethod
+    def from_args(argv: Optional[Sequence[str]] = None) -> BenchmarkConfig:
+        prsr = argparse.ArgumentParser(
+            description=__doc__,
+            formatter_class=argparse.RawTextHelpFormatter,
+        )
+
+        # Declare arguments
+        prsr.add_argument('--yolo_config', default=None, type=arg_file_path,
+                          help='Path to yolo config file, if model is not given a tiny model '
+                          'with random weights is generated so that benchmark runs offline')
+        prsr.add_argument('--weights_file', default=None,
+                          type=arg_file_path, help='Path to file with pretrained weights')
+        prsr.add_argument('--classes_file', default=None,
+                          type=arg_file_path, help='Path to file with classes')
+        prsr.add_argument('--width', default=1280, type=arg_positive_int,
+                          help='Width of synthetic frames (default: 1280)')
+        prsr.add_argument('--height', default=720, type=arg_positive_int,
+                          help='Height of synthetic frames (default: 720)')
+        prsr.add_argument('--iterations', default=100, type=arg_positive_int,
+                          help='Number of measured iterations (default: 100)')
+        prsr.add_argument('--batch_size', default=1, type=arg_positive_int,
+                          help='Frames processed by single iteration (default: 1)')
+        prsr.add_argument('--warmup_runs', default=3, type=arg_non_negative_int,
+                          help='Forward passes run before measurement (default: 3)')
+        prsr.add_argument('--backend', default=DnnBackend.OPENCV, type=arg_dnn_backend,
+                          help='DNN backend, available values are '
+                          f'{[e.value for e in DnnBackend]} (default: opencv)')
+        prsr.add_argument('--show_layers', action='store_true',
+                          help='Print timings of each network layer')
+        prsr.add_argument('--reuse_blob', action='store_true',
+                          help='Fill one preallocated input blob instead of allocating one per frame')
+
+        # Parsing arguments
+        args: argparse.Namespace = prsr.parse_args(argv)
+        model_files = [args.yolo_config, args.weights_file, args.classes_file]
+        if any(model_files) and not all(model_files):
+            prsr.error('Arguments --yolo_config, --weights_file and --classes_file must be '
+                       'given together or not at all.')
+
+        # Returning config
+        return BenchmarkConfig(
+            yolo_config=args.yolo_config,
+            weights_file=args.weights_file,
+            classes_file=args.classes_file,
+            width=args.width,
+            height=args.height,
+            iterations=args.iterations,
+            batch_size=args.batch_size,
+            warmup_runs=args.warmup_runs,
+            backend=args.backend,
+            show_layers=args.show_layers,
+            reuse_blob=args.reuse_blob
+        )
+
 # ==================================================================================================
 #                                         HELPERS
 # ==================================================================================================
@@ -109,7 +358,7 @@ def panic(msg: str) -> None:
 #                                         IMAGE SIZE
 # ==================================================================================================
 
-@dataclass
+@dataclass(slots=True)
 class PixelCoord:
 
     x: int
@@ -122,7 +371,7 @@ class PixelCoord:
         return (self.x, self.y)
 
 
-@dataclass
+@dataclass(slots=True)
 class ImageSize(PixelCoord):
 
     @staticmethod
@@ -141,19 +390,237 @@ class ImageSize(PixelCoord):
     def scale(self, scale: float) -> ImageSize:
         return ImageSize(x=int(self.x*scale), y=int(self.y*scale))
 
+# ==================================================================================================
+#                                    NON MAXIMUM SUPPRESSION
+# ==================================================================================================
+
+
+def box_iou(box: npt.NDArray[np.float32], others: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
+    ''' IoU of a single (x, y, w, h) box against each row of others. '''
+    left = np.maximum(box[0], others[:, 0])
+    top = np.maximum(box[1], others[:, 1])
+    right = np.minimum(box[0] + box[2], others[:, 0] + others[:, 2])
+    bottom = np.minimum(box[1] + box[3], others[:, 1] + others[:, 3])
+    intersection = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+    union = box[2] * box[3] + others[:, 2] * others[:, 3] - intersection
+    return intersection / np.maximum(union, np.finfo(np.float32).eps)
+
+
+def non_max_suppression(boxes: npt.NDArray[np.float32],
+                        scores: npt.NDArray[np.float32],
+                        category_ids: npt.NDArray[np.intp],
+                        iou_threshold: float,
+                        class_agnostic: bool = False) -> npt.NDArray[np.intp]:
+    '''
+    Greedy NMS over (x, y, w, h) boxes, returns indexes of kept boxes ordered by score.
+    Each iteration keeps the best remaining box and removes all boxes overlapping it in a single
+    vectorized step, so cost grows with number of kept boxes rather than number of candidates.
+    '''
+    if boxes.shape[0] == 0:
+        return np.empty(0, dtype=np.intp)
+    boxes = boxes.astype(np.float32, copy=True)
+
+    # Per class suppression is done in one pass by moving boxes of each class to a separate
+    # region of the plane, so that boxes of different classes can never overlap. Extent is
+    # computed from coordinate range, boxes at image edge have negative x or y.
+    if not class_agnostic:
+        extent = (float(np.max(boxes[:, :2] + boxes[:, 2:])) -
+                  float(np.min(boxes[:, :2])) + 1.0)
+        boxes[:, :2] += (category_ids.astype(np.float32) * extent)[:, np.newaxis]
+
+    order: npt.NDArray[np.intp] = np.argsort(-scores, kind='stable')
+    keep: List[int] = []
+    while order.size > 0:
+        best = order[0]
+        keep.append(int(best))
+        rest = order[1:]
+        order = rest[box_iou(boxes[best], boxes[rest]) <= iou_threshold]
+    return np.asarray(keep, dtype=np.intp)
+
+
+def tile_starts(length: int, tile: int, overlap: int) -> List[int]:
+    ''' Start offsets of overlapping tiles covering given length, last tile is aligned to end. '''
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, tile - overlap))
+    starts.append(length - tile)
+    return starts
+
+# ==================================================================================================
+#                                            TIMING
+# ==================================================================================================
+
+
+class LatencyHistogram:
+    '''
+    Histogram of durations with logarithmic buckets (5% wide, from 1 us to 100 s), so memory use
+    does not depend on number of recorded samples and percentiles are accurate to a few percent.
+    '''
+
+    BUCKET_EDGES_MS: Final[List[float]] = np.geomspace(1e-3, 1e5, 379).tolist()
+
+    def __init__(self) -> None:
+        self.counts_: List[int] = [0] * (len(LatencyHistogram.BUCKET_EDGES_MS) + 1)
+        self.count_ = 0
+        self.total_ms_ = 0.0
+        self.max_ms_ = 0.0
+
+    def record(self, duration_ms: float) -> None:
+        self.counts_[bisect.bisect_left(LatencyHistogram.BUCKET_EDGES_MS, duration_ms)] += 1
+        self.count_ += 1
+        self.total_ms_ += duration_ms
+        self.max_ms_ = max(self.max_ms_, duration_ms)
+
+    def count(self) -> int:
+        return self.count_
+
+    def mean(self) -> float:
+        return self.total_ms_ / self.count_ if self.count_ else 0.0
+
+    def percentile(self, q: float) -> float:
+        ''' Returns geometric middle of bucket containing q-th percentile (in milliseconds). '''
+        if not self.count_:
+            return 0.0
+        edges = LatencyHistogram.BUCKET_EDGES_MS
+        target = q / 100.0 * self.count_
+        cumulative = 0
+        for idx, bucket_count in enumerate(self.counts_):
+            cumulative += bucket_count
+            if cumulative >= target and bucket_count:
+                break
+        if idx == 0:
+            return min(self.max_ms_, edges[0])
+        if idx == len(edges):
+            return self.max_ms_
+        return min(self.max_ms_, float(np.sqrt(edges[idx - 1] * edges[idx])))
+
+    def summary(self) -> str:
+        return (f'n={self.count_:<6} mean={self.mean():9.3f} ms p50={self.percentile(50):9.3f} ms '
+                f'p95={self.percentile(95):9.3f} ms p99={self.percentile(99):9.3f} ms '
+                f'max={self.max_ms_:9.3f} ms')
+
+
+def timed_stage(stage: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    ''' Records duration of decorated YoloWrapper method, if wrapper collects timings. '''
+    def decorator(method: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(method)
+        def wrapper(self: YoloWrapper, *args: Any, **kwargs: Any) -> Any:
+            if self.timings_ is None:
+                return method(self, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.record_timing_(stage, 1000 * (time.perf_counter() - start))
+        return wrapper
+    return decorator
+
+# ==================================================================================================
+#                                        NETWORK LOADING
+# ==================================================================================================
+
+
+class DnnBackend(Enum):
+    ''' Supported combinations of OpenCV DNN backend and target. '''
+    OPENCV = 'opencv'  # Default OpenCV implementation on CPU
+    OPENVINO = 'openvino'  # OpenVINO (Inference Engine) on CPU, if OpenCV was built with it
+    FP16 = 'fp16'  # OpenCV implementation with half precision CPU target
+
+    def check_supported(self) -> None:
+        '''
+        FP16 is only used when requested explicitly, falling back to FP32 target would make results
+        (e.g. of benchmark) reported as FP16 ones, so ValueError is raised if it is not supported.
+        '''
+        if self != DnnBackend.FP16:
+            return
+        target: int | None = getattr(cv2.dnn, 'DNN_TARGET_CPU_FP16', None)
+        if target is None:
+            raise ValueError(f'DNN backend {self} needs OpenCV with DNN_TARGET_CPU_FP16 (4.10 or '
+                             f'newer), installed version is {cv2.__version__}')
+        if target not in cv2.dnn.getAvailableTargets(cv2.dnn.DNN_BACKEND_OPENCV):
+            # OpenCV itself falls back to FP32 target on CPUs without FP16 support
+            raise ValueError(f'DNN backend {self} is not supported on this CPU by installed '
+                             f'OpenCV {cv2.__version__}')
+
+    def to_backend_and_target(self) -> Tuple[int, int]:
+        '''
+        Returns backend and target, falling back to OPENCV if combination is not available (FP16
+        raises ValueError instead, see check_supported).
+        '''
+        self.check_supported()
+        backend, target = {
+            DnnBackend.OPENCV: (cv2.dnn.DNN_BACKEND_OPENCV, cv2.dnn.DNN_TARGET_CPU),
+            DnnBackend.OPENVINO: (cv2.dnn.DNN_BACKEND_INFERENCE_ENGINE, cv2.dnn.DNN_TARGET_CPU),
+            # Entries are built for every backend, FP16 target exists when FP16 gets here
+            DnnBackend.FP16: (cv2.dnn.DNN_BACKEND_OPENCV,
+                              getattr(cv2.dnn, 'DNN_TARGET_CPU_FP16', cv2.dnn.DNN_TARGET_CPU)),
+        }[self]
+        if target not in cv2.dnn.getAvailableTargets(backend):
+            print(f'Warning - DNN backend {self} is not available, using {DnnBackend.OPENCV}')
+            return cv2.dnn.DNN_BACKEND_OPENCV, cv2.dnn.DNN_TARGET_CPU
+        return backend, target
+
+    @staticmethod
+    def parse_string(txt: str) -> DnnBackend:
+        try:
+            return DnnBackend(txt.lower())
+        except ValueError:
+            raise ValueError(f'String "{txt}" is not valid for DnnBackend '
+                             f'enum. Valid values are {[e.value for e in DnnBackend]}')
+
+    def __str__(self):
+        return self.value
+
+
+@dataclass
+class CachedNet:
+
+    net: cv2.dnn.Net
+    output_layers: List[str]
+    warmed_up: bool = False
+
+
+# Networks already loaded by this process. Key consists of resolved paths and modification times of
+# config and weights (so that changed files are loaded again) and of selected backend.
+NET_CACHE: Dict[Tuple[str, int, str, int, DnnBackend], CachedNet] = {}
+
+
+def load_net(yolo_config: str, weights_file: str, backend: DnnBackend, use_cache: bool) -> CachedNet:
+    config_path = pathlib.Path(yolo_config).resolve()
+    weights_path = pathlib.Path(weights_file).resolve()
+    key = (str(config_path), config_path.stat().st_mtime_ns,
+           str(weights_path), weights_path.stat().st_mtime_ns, backend)
+    if use_cache and key in NET_CACHE:
+        return NET_CACHE[key]
+
+    # TODO: Error handling for reading net
+    net: cv2.dnn.Net = cv2.dnn.readNet(str(weights_path), str(config_path))
+    preferable_backend, preferable_target = backend.to_backend_and_target()
+    net.setPreferableBackend(preferable_backend)
+    net.setPreferableTarget(preferable_target)
+    layer_names = net.getLayerNames()
+    loaded = CachedNet(net, [layer_names[i - 1] for i in net.getUnconnectedOutLayers()])
+    if use_cache:
+        NET_CACHE[key] = loaded
+    return loaded
+
 # ==================================================================================================
 #                                          YOLO WRAPPER
 # ==================================================================================================
 
 
-@dataclass(frozen=True)
+# Class ids, confidences and (x, y, w, h) boxes of detections that were not yet turned into objects
+DecodedBoxes = Tuple[npt.NDArray[np.intp], npt.NDArray[np.float32], npt.NDArray[np.int64]]
+
+
+@dataclass(frozen=True, slots=True)
 class YoloCategory:
 
     name: str  # Name of class
     colour: Tuple[int, int, int]
 
 
-@dataclass
+@dataclass(slots=True)
 class YoloDetectedObject:
 
     category: YoloCategory
@@ -162,14 +629,172 @@ class YoloDetectedObject:
     size: ImageSize
 
 
+# Single record of DetectionBatch, image is index of image in batch and category index of category
+DETECTION_DTYPE: Final[np.dtype] = np.dtype([('image', np.int32),
+                                             ('category', np.int32),
+                                             ('confidence', np.float32),
+                                             ('x', np.int32),
+                                             ('y', np.int32),
+                                             ('w', np.int32),
+                                             ('h', np.int32)])
+# Columns of CSV export, one row per detection
+CSV_FIELDS: Final[Tuple[str, ...]] = ('image', 'category', 'confidence', 'x', 'y', 'w', 'h')
+
+
+class DetectionBatch:
+    '''
+    Columnar storage of detections from any number of images. All detections are kept in a single
+    structured array (28 bytes per box), YoloDetectedObject is built only when a single item is
+    accessed. All operations return new batches and work on whole columns.
+    '''
+
+    records_: npt.NDArray[np.void]
+    categories_: Sequence[YoloCategory]
+
+    def __init__(self, records: npt.NDArray[np.void], categories: Sequence[YoloCategory]) -> None:
+        if records.dtype != DETECTION_DTYPE:
+            raise ValueError(f'Detection records must have {DETECTION_DTYPE} dtype, '
+                             f'{records.dtype} given instead.')
+        self.records_ = records
+        self.categories_ = categories
+
+    @staticmethod
+    def empty(categories: Sequence[YoloCategory]) -> DetectionBatch:
+        return DetectionBatch(np.empty(0, dtype=DETECTION_DTYPE), categories)
+
+    @staticmethod
+    def from_arrays(category_ids: npt.NDArray[np.integer],
+                    confidences: npt.NDArray[np.floating],
+                    boxes: npt.NDArray[np.integer],
+                    image_index: int | npt.NDArray[np.integer],
+                    categories: Sequence[YoloCategory]) -> DetectionBatch:
+        records = np.empty(len(category_ids), dtype=DETECTION_DTYPE)
+        records['image'] = image_index
+        records['category'] = category_ids
+        records['confidence'] = confidences
+        records['x'], records['y'], records['w'], records['h'] = boxes.T
+        return DetectionBatch(records, categories)
+
+    @staticmethod
+    def concatenate(batches: Sequence[DetectionBatch]) -> DetectionBatch:
+        if not batches:
+            raise ValueError('Attempting to concatenate empty sequence of batches.')
+        return DetectionBatch(np.concatenate([batch.records_ for batch in batches]),
+                              batches[0].categories_)
+
+    @staticmethod
+    def load(path: str, categories: Sequence[YoloCategory]) -> DetectionBatch:
+        ''' Loads batch saved with save, records are memory mapped instead of being read. '''
+        return DetectionBatch(np.load(path, mmap_mode='r'), categories)
+
+    def __len__(self) -> int:
+        return self.records_.shape[0]
+
+    def __getitem__(self, idx: int) -> YoloDetectedObject:
+        record = self.records_[idx]
+        return YoloDetectedObject(category=self.categories_[int(record['category'])],
+                                  confidence=float(record['confidence']),
+                                  position=PixelCoord(int(record['x']), int(record['y'])),
+                                  size=ImageSize(int(record['w']), int(record['h'])))
+
+    def __iter__(self) -> Iterator[YoloDetectedObject]:
+        return (self[idx] for idx in range(len(self)))
+
+    @property
+    def records(self) -> npt.NDArray[np.void]:
+        return self.records_
+
+    @property
+    def boxes(self) -> npt.NDArray[np.int32]:
+        ''' (x, y, w, h) boxes as regular (N, 4) array. '''
+        return np.stack([self.records_['x'], self.records_['y'],
+                         self.records_['w'], self.records_['h']], axis=1)
+
+    def filter(self, mask: npt.NDArray[np.bool_]) -> DetectionBatch:
+        return DetectionBatch(self.records_[mask], self.categories_)
+
+    def threshold(self, min_confidence: float) -> DetectionBatch:
+        return self.filter(self.records_['confidence'] > min_confidence)
+
+    def for_categories(self, names: Sequence[str]) -> DetectionBatch:
+        ids = [idx for idx, category in enumerate(self.categories_) if category.name in names]
+        return self.filter(np.isin(self.records_['category'], ids))
+
+    def for_image(self, image_index: int) -> DetectionBatch:
+        return self.filter(self.records_['image'] == image_index)
+
+    def nms(self, iou_threshold: float, class_agnostic: bool = False) -> DetectionBatch:
+        ''' Suppression is done separately for each image, boxes of different images never compete. '''
+        if len(self) == 0:
+            return self
+        # Sorting by image gives contiguous slice for every image
+        order = np.argsort(self.records_['image'], kind='stable')
+        images = self.records_['image'][order]
+        bounds = np.flatnonzero(np.diff(images)) + 1
+        boxes = self.boxes.astype(np.float32)
+        keep: List[npt.NDArray[np.intp]] = []
+        for group in np.split(order, bounds):
+            kept = non_max_suppression(boxes[group],
+                                       self.records_['confidence'][group],
+                                       self.records_['category'][group],
+                                       iou_threshold, class_agnostic)
+            keep.append(group[kept])
+        return DetectionBatch(self.records_[np.concatenate(keep)], self.categories_)
+
+    def save(self, path: str) -> None:
+        np.save(path, self.records_)
+
+    def write_csv(self, out: TextIO, image_names: Optional[Sequence[str]] = None) -> None:
+        ''' Writes one row per detection, image is given by name if names are provided. '''
+        names = np.asarray([category.name for category in self.categories_], dtype=object)
+        images = self.records_['image'] if image_names is None \
+            else np.asarray(image_names, dtype=object)[self.records_['image']]
+        writer = csv.writer(out)
+        writer.writerow(CSV_FIELDS)
+        writer.writerows(zip(images.tolist(),
+                             names[self.records_['category']].tolist(),
+                             self.records_['confidence'].tolist(),
+                             self.records_['x'].tolist(),
+                             self.records_['y'].tolist(),
+                             self.records_['w'].tolist(),
+                             self.records_['h'].tolist()))
+
+
 class YoloWrapper:
 
     YOLO_INPUT_SIZE: ImageSize = ImageSize(x=416, y=416)
     YOLO_INPUT_MEAN: Tuple[float, float, float] = (0.0, 0.0, 0.0)
+    DEFAULT_BATCH_SIZE: int = 8
+    DEFAULT_TILE_OVERLAP: int = 64
+    DEFAULT_TILE_MERGE_THRESHOLD: float = 0.5
 
     categories_: List[YoloCategory]
 
-    def __init__(self, yolo_config: str, weights_file: str, classes_file: str) -> None:
+    def __init__(self,
+                 yolo_config: str,
+                 weights_file: str,
+                 classes_file: str,
+                 confidence_threshold: float = 0.5,
+                 nms_threshold: Optional[float] = 0.4,
+                 class_agnostic_nms: bool = False,
+                 backend: DnnBackend = DnnBackend.OPENCV,
+                 warmup_runs: int = 0,
+                 use_cache: bool = True,
+                 collect_timings: bool = False,
+                 reuse_blob: bool = False) -> None:
+
+        # With reuse_blob every detect_objects call fills the same preallocated input blob
+        # instead of creating a new one, blob returned by make_blob_ is then only valid until
+        # next call.
+        self.reuse_blob_ = reuse_blob
+        self.resized_buffer_: Optional[npt.NDArray[np.uint8]] = None
+        self.blob_buffer_: Optional[npt.NDArray[np.float32]] = None
+
+        # Detections below confidence threshold are discarded, remaining ones are suppressed
+        # with given IoU threshold. Setting nms_threshold to None returns raw boxes.
+        self.confidence_threshold_ = confidence_threshold
+        self.nms_threshold_ = nms_threshold
+        self.class_agnostic_nms_ = class_agnostic_nms
 
         # Reading class names from file and assigning colors to each of them
         categories: List[str] = []
@@ -183,14 +808,54 @@ class YoloWrapper:
         for name, colour in zip(categories, colours):
             self.categories_.append(YoloCategory(name, (colour[0], colour[1], colour[2])))
 
-        # TODO: Error handling for reading net
-        self.net_: cv2.dnn.Net = cv2.dnn.readNet(weights_file, yolo_config)
-        layer_names = self.net_.getLayerNames()
-        self.output_layers_ = [layer_names[i - 1]
-                               for i in self.net_.getUnconnectedOutLayers()]
-
+        # Durations of processing stages in milliseconds, None when timing is disabled. Warm-up
+        # runs are not recorded.
+        self.timings_: Optional[Dict[str, LatencyHistogram]] = None
+
+        # Network is shared with other wrappers created in this process for the same files, such
+        # wrappers must not be used from different threads at the same time.
+        loaded: CachedNet = load_net(yolo_config, weights_file, backend, use_cache)
+        self.net_: cv2.dnn.Net = loaded.net
+        self.output_layers_: List[str] = loaded.output_layers
+
+        # First forward pass allocates buffers and initializes backend, doing it here moves
+        # this cost out of first real detection.
+        if warmup_runs > 0 and not loaded.warmed_up:
+            blob = np.zeros((1, 3, YoloWrapper.YOLO_INPUT_SIZE.x, YoloWrapper.YOLO_INPUT_SIZE.y),
+                            dtype=np.float32)
+            for _ in range(warmup_runs):
+                self.run_network_(blob)
+            loaded.warmed_up = True
+        if collect_timings:
+            self.reset_timings()
+
+    def reset_timings(self) -> None:
+        ''' Enables timing (if it was disabled) and clears all recorded durations. '''
+        self.timings_ = {}
+
+    def get_timings(self) -> Dict[str, LatencyHistogram]:
+        if self.timings_ is None:
+            raise ValueError('Attempted to access timings of wrapper that does not collect them.')
+        return self.timings_
+
+    def record_timing_(self, stage: str, duration_ms: float) -> None:
+        if self.timings_ is not None:
+            self.timings_.setdefault(stage, LatencyHistogram()).record(duration_ms)
+
+    @timed_stage('total')
     def detect_objects(self, img: npt.NDArray[np.uint8], scale: float = 1.0)-> List[YoloDetectedObject]:
         # Prepare input based on image, assuring correct typing
+        blob: npt.NDArray[np.float32] = self.make_blob_(img, scale)
+
+        # Run network
+        output: Sequence[npt.NDArray[np.float32]] = self.run_network_(blob)
+
+        return self.decode_output_(output, ImageSize.from_tuple(img.shape))
+
+    @timed_stage('preprocess')
+    def make_blob_(self, img: npt.NDArray[np.uint8], scale: float) -> npt.NDArray[np.float32]:
+        if self.reuse_blob_:
+            return self.fill_blob_(img, scale)
         blob_raw: cvt.MatLike = cv2.dnn.blobFromImage(img,
                                                       scalefactor=scale,
                                                       size=YoloWrapper.YOLO_INPUT_SIZE.to_cv_tuple(),
@@ -198,39 +863,543 @@ class YoloWrapper:
                                                       swapRB=True,
                                                       crop=False,
                                                       ddepth=cv2.CV_32F)
-        blob: npt.NDArray[np.float32] = np.asarray(blob_raw, dtype=np.float32)
+        return np.asarray(blob_raw, dtype=np.float32)
+
+    def fill_blob_(self, img: npt.NDArray[np.uint8], scale: float) -> npt.NDArray[np.float32]:
+        '''
+        Same result as blobFromImage (resize, BGR to RGB swap, mean and scale) written into
+        preallocated buffers, so no memory is allocated per frame.
+        '''
+        if self.resized_buffer_ is None or self.blob_buffer_ is None:
+            # Buffers use numpy (rows, cols) order, resize below gets the same size in OpenCV
+            # (width, height) order
+            rows, cols = YoloWrapper.YOLO_INPUT_SIZE.to_np_tuple()
+            self.resized_buffer_ = np.empty((rows, cols, 3), dtype=np.uint8)
+            self.blob_buffer_ = np.empty((1, 3, rows, cols), dtype=np.float32)
+        resized = self.resized_buffer_
+        blob = self.blob_buffer_
+
+        # Like blobFromImage we resize 8 bit image and only then convert it to float
+        cv2.resize(img, YoloWrapper.YOLO_INPUT_SIZE.to_cv_tuple(), dst=resized,
+                   interpolation=cv2.INTER_LINEAR)
+        # Each RGB plane of blob is filled from corresponding BGR channel, multiplication is done
+        # in double precision as in OpenCV so that result is bit exact.
+        for channel in range(3):
+            plane = blob[0, channel]
+            source = resized[:, :, 2 - channel]
+            mean = YoloWrapper.YOLO_INPUT_MEAN[channel]
+            if mean:
+                np.subtract(source, mean, out=plane, dtype=np.float64, casting='same_kind')
+                np.multiply(plane, scale, out=plane, dtype=np.float64, casting='same_kind')
+            else:
+                np.multiply(source, scale, out=plane, dtype=np.float64, casting='same_kind')
+        return blob
+
+    def decode_output_(self,
+                       output: Sequence[npt.NDArray[np.float32]],
+                       image_size: ImageSize) -> List[YoloDetectedObject]:
+        category_ids, confidences, boxes = self.decode_boxes_(output, image_size)
+        if self.nms_threshold_ is not None:
+            category_ids, confidences, boxes = self.suppress_(category_ids, confidences, boxes,
+                                                              self.nms_threshold_)
+        return self.build_objects_(category_ids, confidences, boxes)
+
+    @timed_stage('decode')
+    def decode_boxes_(self,
+                      output: Sequence[npt.NDArray[np.float32]],
+                      image_size: ImageSize) -> DecodedBoxes:
+        # All output layers share the same row layout (box, objectness, class scores) so we can
+        # stack them into a single matrix and do the whole filtering with array operations.
+        detections: npt.NDArray[np.float32] = np.concatenate(
+            [np.asarray(out, dtype=np.float32).reshape(-1, out.shape[-1]) for out in output])
+        scores: npt.NDArray[np.float32] = detections[:, 5:]
+        category_ids: npt.NDArray[np.intp] = np.argmax(scores, axis=1)
+        confidences: npt.NDArray[np.float32] = np.take_along_axis(
+            scores, category_ids[:, np.newaxis], axis=1)[:, 0]
+
+        # Only rows that pass the threshold are decoded into boxes
+        keep: npt.NDArray[np.intp] = np.flatnonzero(confidences > self.confidence_threshold_)
+        # Image size keeps rows in x and columns in y, hence the swapped scaling
+        box_scale = np.array([image_size.y, image_size.x, image_size.y, image_size.x],
+                             dtype=np.float32)
+        boxes: npt.NDArray[np.int64] = (detections[keep, :4] * box_scale).astype(np.int64)
+        # Convert (center x, center y, w, h) into (x, y, w, h) of top left corner
+        boxes[:, :2] -= boxes[:, 2:] // 2
+        return category_ids[keep], confidences[keep], boxes
+
+    @timed_stage('nms')
+    def suppress_(self,
+                  category_ids: npt.NDArray[np.intp],
+                  confidences: npt.NDArray[np.float32],
+                  boxes: npt.NDArray[np.int64],
+                  iou_threshold: float) -> DecodedBoxes:
+        keep = non_max_suppression(boxes.astype(np.float32), confidences, category_ids,
+                                   iou_threshold, self.class_agnostic_nms_)
+        return category_ids[keep], confidences[keep], boxes[keep]
+
+    @timed_stage('objects')
+    def build_objects_(self,
+                       category_ids: npt.NDArray[np.intp],
+                       confidences: npt.NDArray[np.float32],
+                       boxes: npt.NDArray[np.int64]) -> List[YoloDetectedObject]:
+        # Python objects are built only for detections that survived
+        return [YoloDetectedObject(category=self.categories_[category_id],
+                                   confidence=confidence,
+                                   position=PixelCoord(x, y),
+                                   size=ImageSize(w, h))
+                for category_id, confidence, (x, y, w, h) in zip(category_ids.tolist(),
+                                                                 confidences.tolist(),
+                                                                 boxes.tolist())]
+
+    def detect_objects_batch(self,
+                             images: Sequence[npt.NDArray[np.uint8]],
+                             scale: float = 1.0,
+                             batch_size: int = DEFAULT_BATCH_SIZE) -> List[List[YoloDetectedObject]]:
+        if batch_size < 1:
+            raise ValueError(f'Batch size must be greater than 0, {batch_size} given instead.')
+
+        # Images are processed in chunks of batch_size so that size of blob (and network
+        # activations) is bounded regardless of how many images were given.
+        detected_objects: List[List[YoloDetectedObject]] = []
+        for start in range(0, len(images), batch_size):
+            batch: Sequence[npt.NDArray[np.uint8]] = images[start:start + batch_size]
+            for img, output in zip(batch, self.run_network_batch_(batch, scale)):
+                detected_objects.append(self.decode_output_(output,
+                                                            ImageSize.from_tuple(img.shape)))
+        return detected_objects
 
-        # Run network
+    def detect_columnar(self,
+                        images: Sequence[npt.NDArray[np.uint8]],
+                        scale: float = 1.0,
+                        batch_size: int = DEFAULT_BATCH_SIZE) -> DetectionBatch:
+        ''' Same as detect_objects_batch but results are kept in a single DetectionBatch. '''
+        if batch_size < 1:
+            raise ValueError(f'Batch size must be greater than 0, {batch_size} given instead.')
+
+        batches: List[DetectionBatch] = [DetectionBatch.empty(self.categories_)]
+        for start in range(0, len(images), batch_size):
+            batch: Sequence[npt.NDArray[np.uint8]] = images[start:start + batch_size]
+            for image_index, (img, output) in enumerate(zip(batch,
+                                                            self.run_network_batch_(batch, scale)),
+                                                        start=start):
+                category_ids, confidences, boxes = self.decode_boxes_(
+                    output, ImageSize.from_tuple(img.shape))
+                if self.nms_threshold_ is not None:
+                    category_ids, confidences, boxes = self.suppress_(
+                        category_ids, confidences, boxes, self.nms_threshold_)
+                batches.append(DetectionBatch.from_arrays(category_ids, confidences, boxes,
+                                                          image_index, self.categories_))
+        return DetectionBatch.concatenate(batches)
+
+    def detect_objects_tiled(self,
+                             img: npt.NDArray[np.uint8],
+                             scale: float = 1.0,
+                             tile_size: ImageSize = YOLO_INPUT_SIZE,
+                             overlap: int = DEFAULT_TILE_OVERLAP,
+                             max_tiles_per_batch: int = DEFAULT_BATCH_SIZE,
+                             merge_threshold: float = DEFAULT_TILE_MERGE_THRESHOLD
+                             ) -> List[YoloDetectedObject]:
+        '''
+        Detection for images much larger than network input. Image is cut into overlapping tiles
+        (tile size follows ImageSize convention, x are rows and y are columns), each tile is
+        detected separately and boxes are merged with NMS so that objects lying on tile borders
+        are reported only once.
+        '''
+        if max_tiles_per_batch < 1:
+            raise ValueError(
+                f'Tiles per batch must be greater than 0, {max_tiles_per_batch} given instead.')
+        if not 0 <= overlap < min(tile_size.x, tile_size.y):
+            raise ValueError(f'Tile overlap must be in range <0;{min(tile_size.x, tile_size.y)}), '
+                             f'{overlap} given instead.')
+
+        image_size: ImageSize = ImageSize.from_tuple(img.shape)
+        origins: List[PixelCoord] = [PixelCoord(x, y)
+                                     for y in tile_starts(image_size.x, tile_size.x, overlap)
+                                     for x in tile_starts(image_size.y, tile_size.y, overlap)]
+
+        decoded: List[DecodedBoxes] = []
+        for start in range(0, len(origins), max_tiles_per_batch):
+            batch_origins: List[PixelCoord] = origins[start:start + max_tiles_per_batch]
+            # Slicing gives views of source image, pixels are copied only once into the blob
+            tiles: List[npt.NDArray[np.uint8]] = [
+                img[origin.y:origin.y + tile_size.x, origin.x:origin.x + tile_size.y]
+                for origin in batch_origins]
+            for origin, tile, output in zip(batch_origins, tiles,
+                                            self.run_network_batch_(tiles, scale)):
+                category_ids, confidences, boxes = self.decode_boxes_(
+                    output, ImageSize.from_tuple(tile.shape))
+                # Suppressing inside each tile first keeps final merge small
+                if self.nms_threshold_ is not None:
+                    category_ids, confidences, boxes = self.suppress_(
+                        category_ids, confidences, boxes, self.nms_threshold_)
+                boxes[:, 0] += origin.x
+                boxes[:, 1] += origin.y
+                decoded.append((category_ids, confidences, boxes))
+
+        # Duplicates from overlapping tiles are merged even if NMS is otherwise disabled
+        category_ids = np.concatenate([d[0] for d in decoded])
+        confidences = np.concatenate([d[1] for d in decoded])
+        boxes = np.concatenate([d[2] for d in decoded])
+        iou_threshold = merge_threshold if self.nms_threshold_ is None \
+            else min(self.nms_threshold_, merge_threshold)
+        return self.build_objects_(*self.suppress_(category_ids, confidences, boxes,
+                                                   iou_threshold))
+
+    def run_network_batch_(self,
+                           images: Sequence[npt.NDArray[np.uint8]],
+                           scale: float) -> List[List[npt.NDArray[np.float32]]]:
+        ''' Runs single forward pass over all images, returns network output of each image. '''
+        blob: npt.NDArray[np.float32] = self.make_batch_blob_(images, scale)
+        output: Sequence[npt.NDArray[np.float32]] = self.run_network_(blob)
+
+        # Depending on OpenCV version outputs are either (N, rows, values) or (N*rows, values),
+        # in both cases rows of each image are contiguous so reshape splits them correctly.
+        per_image: List[npt.NDArray[np.float32]] = [
+            np.asarray(out, dtype=np.float32).reshape(len(images), -1, out.shape[-1])
+            for out in output]
+        return [[out[idx] for out in per_image] for idx in range(len(images))]
+
+    @timed_stage('preprocess')
+    def make_batch_blob_(self,
+                         images: Sequence[npt.NDArray[np.uint8]],
+                         scale: float) -> npt.NDArray[np.float32]:
+        blob_raw: cvt.MatLike = cv2.dnn.blobFromImages(images,
+                                                       scalefactor=scale,
+                                                       size=YoloWrapper.YOLO_INPUT_SIZE.to_cv_tuple(),
+                                                       mean=YoloWrapper.YOLO_INPUT_MEAN,
+                                                       swapRB=True,
+                                                       crop=False,
+                                                       ddepth=cv2.CV_32F)
+        return np.asarray(blob_raw, dtype=np.float32)
+
+    @timed_stage('forward')
+    def run_network_(self, blob: npt.NDArray[np.float32]) -> Sequence[npt.NDArray[np.float32]]:
         self.net_.setInput(blob)
         # TODO: Assure return type
-        output: Tuple[npt.NDArray[np.float32], npt.NDArray[np.float32],
-                      npt.NDArray[np.float32]] = self.net_.forward(self.output_layers_)
+        output: Sequence[npt.NDArray[np.float32]] = self.net_.forward(self.output_layers_)
 
-        # Build object list
-        detected_objects: List[YoloDetectedObject] = []
-        image_size: ImageSize = ImageSize.from_tuple(img.shape)
-        for out in output:
-            for detection in out:
-                category_id = np.argmax(detection[5:])
-                confidence: float = detection[5:][category_id]
-                if confidence > 0.5:
-                    # TODO: Make this clearer 
-                    center_x = int(detection[0] * image_size.y)
-                    center_y = int(detection[1] * image_size.x)
-                    w = int(detection[2] * image_size.y)
-                    h = int(detection[3] * image_size.x)
-                    x = center_x - w // 2
-                    y = center_y - h // 2
-                    detected_objects.append(YoloDetectedObject(
-                        category=self.categories_[category_id],
-                        confidence=confidence,
-                        position=PixelCoord(x,y),
-                        size=ImageSize(w,h)
-                    ))
-        return detected_objects
+        # OpenCV measures each layer of last forward pass, values are in ticks
+        if self.timings_ is not None:
+            _, layer_ticks = self.net_.getPerfProfile()
+            ticks_per_ms = cv2.getTickFrequency() / 1000
+            for name, ticks in zip(self.net_.getLayerNames(), np.ravel(layer_ticks).tolist()):
+                self.record_timing_(f'layer/{name}', ticks / ticks_per_ms)
+        return output
+
+# ==================================================================================================
+#                                        VIDEO PIPELINE
+# ==================================================================================================
+
+
+@dataclass
+class VideoFrame:
+
+    index: int  # Position of frame in source stream
+    image: npt.NDArray[np.uint8]
+    captured_at: float  # Value of time.perf_counter() when frame was decoded
+    objects: List[YoloDetectedObject] = field(default_factory=list)
+
+
+class StageStats:
+    ''' Frame count and processing time of a single pipeline stage. '''
+
+    def __init__(self, name: str) -> None:
+        self.name_ = name
+        self.frames_ = 0
+        self.dropped_ = 0
+        self.busy_time_ = 0.0
+        self.started_at_ = time.perf_counter()
+
+    def record(self, duration: float) -> None:
+        self.frames_ += 1
+        self.busy_time_ += duration
 
-    def run_network_(self):
-        pass
+    def record_drop(self) -> None:
+        self.dropped_ += 1
+
+    def report(self) -> str:
+        elapsed = time.perf_counter() - self.started_at_
+        fps = self.frames_ / elapsed if elapsed > 0 else 0.0
+        latency_ms = 1000 * self.busy_time_ / self.frames_ if self.frames_ else 0.0
+        return (f'{self.name_:<10} frames={self.frames_:<6} dropped={self.dropped_:<6} '
+                f'fps={fps:7.2f} latency={latency_ms:8.2f} ms')
+
+
+# Marks end of stream, it is passed through all queues so that every stage can finish.
+END_OF_STREAM: Final[None] = None
+
+
+def put_frame(frame_queue: queue.Queue[Optional[VideoFrame]],
+              frame: VideoFrame,
+              drop: bool,
+              stats: StageStats) -> None:
+    if not drop:
+        frame_queue.put(frame)
+        return
+    # When queue is full we throw away the oldest waiting frame, so that consumer always gets
+    # the freshest one and queue never grows beyond its bound.
+    try:
+        frame_queue.put_nowait(frame)
+    except queue.Full:
+        try:
+            frame_queue.get_nowait()
+            stats.record_drop()
+        except queue.Empty:
+            pass
+        frame_queue.put_nowait(frame)
+
+
+def decode_stage(capture: cv2.VideoCapture,
+                 out_queue: queue.Queue[Optional[VideoFrame]],
+                 drop: bool,
+                 stop: threading.Event,
+                 stats: StageStats) -> None:
+    index = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        ok, image = capture.read()
+        if not ok:
+            break
+        stats.record(time.perf_counter() - start)
+        put_frame(out_queue, VideoFrame(index, np.asarray(image, dtype=np.uint8), start),
+                  drop, stats)
+        index += 1
+    out_queue.put(END_OF_STREAM)
+
+
+def inference_stage(yolo: YoloWrapper,
+                    scale: float,
+                    in_queue: queue.Queue[Optional[VideoFrame]],
+                    out_queue: queue.Queue[Optional[VideoFrame]],
+                    drop: bool,
+                    stats: StageStats) -> None:
+    while (frame := in_queue.get()) is not END_OF_STREAM:
+        start = time.perf_counter()
+        frame.objects = yolo.detect_objects(frame.image, scale)
+        stats.record(time.perf_counter() - start)
+        put_frame(out_queue, frame, drop, stats)
+    out_queue.put(END_OF_STREAM)
+
+
+def run_video_pipeline(capture: cv2.VideoCapture,
+                       yolo: YoloWrapper,
+                       cfg: VideoConfig) -> List[StageStats]:
+    decoded: queue.Queue[Optional[VideoFrame]] = queue.Queue(maxsize=cfg.queue_size)
+    detected: queue.Queue[Optional[VideoFrame]] = queue.Queue(maxsize=cfg.queue_size)
+    stop = threading.Event()
+    decode_stats = StageStats('decode')
+    inference_stats = StageStats('inference')
+    output_stats = StageStats('output')
+    end_to_end_stats = StageStats('end-to-end')
+
+    # Decoding and inference run in their own threads (OpenCV releases GIL in both), while
+    # drawing and encoding stay in main thread as HighGUI windows must be handled there.
+    workers = [
+        threading.Thread(target=decode_stage, name='decode',
+                         args=(capture, decoded, cfg.drop_frames, stop, decode_stats)),
+        threading.Thread(target=inference_stage, name='inference',
+                         args=(yolo, cfg.scale, decoded, detected, cfg.drop_frames,
+                               inference_stats)),
+    ]
+    for worker in workers:
+        worker.start()
+
+    writer: Optional[cv2.VideoWriter] = None
+    try:
+        while (frame := detected.get()) is not END_OF_STREAM:
+            # After stop was requested we only drain queues until end of stream arrives
+            if stop.is_set():
+                continue
+            start = time.perf_counter()
+            for obj in frame.objects:
+                new_draw_bounding_box(frame.image, obj)
+            if cfg.output_video:
+                if writer is None:
+                    fps: float = capture.get(cv2.CAP_PROP_FPS) or 30.0
+                    height, width = frame.image.shape[:2]
+                    writer = cv2.VideoWriter(cfg.output_video,
+                                             cv2.VideoWriter.fourcc(*'mp4v'),
+                                             fps, (width, height))
+                writer.write(frame.image)
+            else:
+                cv2.imshow('object detection', frame.image)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    stop.set()
+            finished = time.perf_counter()
+            output_stats.record(finished - start)
+            end_to_end_stats.record(finished - frame.captured_at)
+    except KeyboardInterrupt:
+        stop.set()
+        while detected.get() is not END_OF_STREAM:
+            pass
+    finally:
+        for worker in workers:
+            worker.join()
+        if writer is not None:
+            writer.release()
+
+    return [decode_stats, inference_stats, output_stats, end_to_end_stats]
+
+# ==================================================================================================
+#                                        DIRECTORY JOBS
+# ==================================================================================================
+
+IMAGE_EXTENSIONS: Final[Tuple[str, ...]] = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+
+# Network of current worker process, created once by init_detection_worker
+WORKER_YOLO: Optional[YoloWrapper] = None
+WORKER_SCALE: float = 1.0
+
+
+def find_images(input_images: str) -> List[str]:
+    if os.path.isdir(input_images):
+        return sorted(str(path) for path in pathlib.Path(input_images).iterdir()
+                      if path.suffix.lower() in IMAGE_EXTENSIONS)
+    return sorted(glob.glob(input_images, recursive=True))
+
+
+def init_detection_worker(yolo_config: str, weights_file: str, classes_file: str,
+                          scale: float, cv_threads: int, backend: DnnBackend) -> None:
+    global WORKER_YOLO, WORKER_SCALE
+    # Workers already run in parallel so by default OpenCV should not spawn its own
+    # thread pool in each of them, otherwise cores get oversubscribed.
+    if cv_threads > 0:
+        cv2.setNumThreads(cv_threads)
+    WORKER_YOLO = YoloWrapper(yolo_config, weights_file, classes_file, backend=backend)
+    WORKER_SCALE = scale
+
+
+def detect_in_file(path: str) -> Tuple[str, List[Dict[str, Any]], Optional[str]]:
+    ''' Returns image path, detections as plain records and error message if image failed. '''
+    if WORKER_YOLO is None:
+        raise RuntimeError('Detection worker was not initialized.')
+    image = cv2.imread(path)
+    if image is None:
+        return path, [], f'Unable to open {path} as image'
+    objects = WORKER_YOLO.detect_objects(np.asarray(image, dtype=np.uint8), WORKER_SCALE)
+    return path, [{'category': obj.category.name,
+                   'confidence': obj.confidence,
+                   'x': obj.position.x,
+                   'y': obj.position.y,
+                   'w': obj.size.x,
+                   'h': obj.size.y} for obj in objects], None
+
+
+def write_jsonl_result(out: TextIO, path: str, detections: List[Dict[str, Any]]) -> None:
+    out.write(json.dumps({'image': path, 'detections': detections}) + '\n')
+
+
+def write_csv_result(out: TextIO, path: str, detections: List[Dict[str, Any]]) -> None:
+    '''
+    Writes one row per detection. Image without detections gets single row with empty detection
+    fields, so that it can be told apart from image which was not processed.
+    '''
+    writer = csv.DictWriter(out, fieldnames=CSV_FIELDS)
+    if out.tell() == 0:
+        writer.writeheader()
+    if not detections:
+        writer.writerow({'image': path})
+    writer.writerows({'image': path, **detection} for detection in detections)
+
+
+OUTPUT_WRITERS = {
+    '.jsonl': write_jsonl_result,
+    '.csv': write_csv_result,
+}
+
+
+def run_directory_job(cfg: DirectoryConfig, paths: Sequence[str]) -> int:
+    ''' Runs detection over all paths in worker pool, returns number of failed images. '''
+    write_result = OUTPUT_WRITERS[pathlib.Path(cfg.output).suffix]
+    failed = 0
+    # Spawned workers do not inherit OpenCV thread pools of parent, which may deadlock after fork
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(processes=cfg.workers,
+                      initializer=init_detection_worker,
+                      initargs=(str(cfg.yolo_config), str(cfg.weights_file),
+                                str(cfg.classes_file), cfg.scale, cfg.cv_threads,
+                                cfg.backend)) as pool, \
+            open(cfg.output, 'w', newline='') as out:
+        results = pool.imap(detect_in_file, paths) if cfg.ordered \
+            else pool.imap_unordered(detect_in_file, paths)
+        for path, detections, error in results:
+            if error:
+                print(f'Error - {error}', file=sys.stderr)
+                failed += 1
+                continue
+            write_result(out, path, detections)
+            out.flush()
+    return failed
+
+# ==================================================================================================
+#                                          BENCHMARK
+# ==================================================================================================
+
+# Layers of tiny model used for offline benchmarks as (filters, kernel size) pairs, each hidden
+# convolution uses leaky activation and is followed by 2x2 max pooling. Last (linear) convolution
+# feeds single YOLO layer.
+TINY_MODEL_HIDDEN_LAYERS: Final[Tuple[Tuple[int, int], ...]] = ((16, 3), (32, 3), (64, 3))
+TINY_MODEL_ANCHORS: Final[str] = '10,14,  23,27,  37,58'
+
+
+def write_tiny_darknet_model(directory: pathlib.Path,
+                             class_count: int = 80,
+                             seed: int = 0) -> Tuple[str, str, str]:
+    '''
+    Writes Darknet config, random weights and class names of a small YOLO network into directory,
+    returns their paths. Network has the same input and output format as YOLOv3 so it exercises
+    whole detection path, only with much smaller convolutions.
+    '''
+    anchor_count = len(TINY_MODEL_ANCHORS.split(',')) // 2
+    output_filters = (class_count + 5) * anchor_count
+    cfg_lines: List[str] = ['[net]', 'batch=1', f'width={YoloWrapper.YOLO_INPUT_SIZE.y}',
+                            f'height={YoloWrapper.YOLO_INPUT_SIZE.x}', 'channels=3', '']
+    rng = np.random.default_rng(seed)
+    # Darknet weights start with version (major, minor, revision) and number of seen images,
+    # convolutions without batch normalization then store biases followed by kernels.
+    weights: List[bytes] = [np.array([0, 2, 0], dtype=np.int32).tobytes(),
+                            np.array([0], dtype=np.int64).tobytes()]
+    in_channels = 3
+    layers = [(filters, size, 'leaky') for filters, size in TINY_MODEL_HIDDEN_LAYERS]
+    layers.append((output_filters, 1, 'linear'))
+    for layer_id, (filters, size, activation) in enumerate(layers):
+        cfg_lines += ['[convolutional]', f'filters={filters}', f'size={size}', 'stride=1',
+                      'pad=1', f'activation={activation}', '']
+        if activation != 'linear':
+            cfg_lines += ['[maxpool]', 'size=2', 'stride=2', '']
+        weights.append(rng.normal(0.0, 0.1, filters).astype(np.float32).tobytes())
+        weights.append(rng.normal(0.0, 1.0 / (size * np.sqrt(in_channels)),
+                                  filters * in_channels * size * size).astype(np.float32).tobytes())
+        in_channels = filters
+    cfg_lines += ['[yolo]', f'mask={",".join(str(i) for i in range(anchor_count))}',
+                  f'anchors={TINY_MODEL_ANCHORS}', f'classes={class_count}',
+                  f'num={anchor_count}', '']
+
+    cfg_path = directory / 'tiny_yolo.cfg'
+    weights_path = directory / 'tiny_yolo.weights'
+    classes_path = directory / 'tiny_yolo_classes.txt'
+    cfg_path.write_text('\n'.join(cfg_lines))
+    weights_path.write_bytes(b''.join(weights))
+    classes_path.write_text('\n'.join(f'class_{idx}' for idx in range(class_count)))
+    return str(cfg_path), str(weights_path), str(classes_path)
+
+
+def run_benchmark(yolo: YoloWrapper, cfg: BenchmarkConfig) -> LatencyHistogram:
+    ''' Runs detection on synthetic frames, returns latency of every iteration. '''
+    rng = np.random.default_rng(0)
+    frames: List[npt.NDArray[np.uint8]] = [
+        rng.integers(0, 256, size=(cfg.height, cfg.width, 3), dtype=np.uint8)
+        for _ in range(cfg.batch_size)]
+    latency = LatencyHistogram()
+    yolo.reset_timings()
+    for _ in range(cfg.iterations):
+        start = time.perf_counter()
+        if cfg.batch_size == 1:
+            yolo.detect_objects(frames[0], 1 / 255)
+        else:
+            yolo.detect_objects_batch(frames, 1 / 255, cfg.batch_size)
+        latency.record(1000 * (time.perf_counter() - start))
+    return latency
 
 # ==================================================================================================
 #                                           MAIN
@@ -238,7 +1407,6 @@ class YoloWrapper:
 
 def new_draw_bounding_box(img: npt.NDArray[np.uint8], obj: YoloDetectedObject):
 
-    print(obj.category.colour)
     cv2.rectangle(img, obj.position.to_cv_tuple(), obj.size.to_cv_tuple(),
                   color=(0,0,0), thickness=2)
 
@@ -263,6 +1431,64 @@ def new_main():
     cv2.waitKey()
 
 
+def video_main(argv: Optional[Sequence[str]] = None) -> None:
+    cfg: VideoConfig = VideoConfig.from_args(argv)
+
+    # Numeric source is treated as index of local capture device
+    capture = cv2.VideoCapture(int(cfg.source) if cfg.source.isdigit() else cfg.source)
+    if not capture.isOpened():
+        panic(f'Unable to open {cfg.source} as video source')
+
+    yolo = YoloWrapper(cfg.yolo_config, cfg.weights_file, cfg.classes_file,
+                       backend=cfg.backend, warmup_runs=cfg.warmup_runs,
+                       reuse_blob=cfg.reuse_blob)
+    try:
+        stats = run_video_pipeline(capture, yolo, cfg)
+    finally:
+        capture.release()
+        if not cfg.output_video:
+            cv2.destroyAllWindows()
+
+    for stage in stats:
+        print(stage.report())
+
+
+def directory_main(argv: Optional[Sequence[str]] = None) -> None:
+    cfg: DirectoryConfig = DirectoryConfig.from_args(argv)
+
+    paths: List[str] = find_images(cfg.input_images)
+    if not paths:
+        panic(f'No images found for {cfg.input_images}')
+
+    start = time.perf_counter()
+    failed = run_directory_job(cfg, paths)
+    elapsed = time.perf_counter() - start
+    print(f'Processed {len(paths) - failed} images ({failed} failed) in {elapsed:.2f} s '
+          f'with {cfg.workers} workers, results saved to {cfg.output}')
+
+
+def benchmark_main(argv: Optional[Sequence[str]] = None) -> None:
+    cfg: BenchmarkConfig = BenchmarkConfig.from_args(argv)
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        if cfg.yolo_config and cfg.weights_file and cfg.classes_file:
+            model_files = (str(cfg.yolo_config), str(cfg.weights_file), str(cfg.classes_file))
+        else:
+            model_files = write_tiny_darknet_model(pathlib.Path(model_dir))
+        yolo = YoloWrapper(*model_files, backend=cfg.backend, warmup_runs=cfg.warmup_runs,
+                           reuse_blob=cfg.reuse_blob)
+        latency = run_benchmark(yolo, cfg)
+
+    total_seconds = latency.count() * latency.mean() / 1000
+    print(f'Frames {cfg.width}x{cfg.height}, batch size {cfg.batch_size}, '
+          f'{cfg.iterations} iterations, backend {cfg.backend}')
+    print(f'{"iteration":<16} {latency.summary()}')
+    print(f'Throughput {cfg.iterations * cfg.batch_size / total_seconds:.2f} frames/s')
+    for stage, histogram in yolo.get_timings().items():
+        if cfg.show_layers or not stage.startswith('layer/'):
+            print(f'{stage:<16} {histogram.summary()}')
+
+
 # function to get the output layer names
 # in the architecture
 def get_output_layers(net):
@@ -383,5 +1609,15 @@ def main(argv: Optional[Sequence[str]] = None) -> None:
     cv2.destroyAllWindows()
 
 
+# Entry points selected by first argument, without a known subcommand legacy main is used
+SUBCOMMANDS: Final[Dict[str, Callable[[Optional[Sequence[str]]], None]]] = {
+    'video': video_main,
+    'directory': directory_main,
+    'benchmark': benchmark_main,
+}
+
 if __name__ == '__main__':
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        SUBCOMMANDS[sys.argv[1]](sys.argv[2:])
+    else:
+        main()